@@ -1,14 +1,26 @@
 from abc import abstractmethod
 import argparse
+from collections import namedtuple
 import logging
 import os
 import sys
 # from . fs_helper import create_subdirectory_if_needed
 # from src import fs_helper
+from pdf_sorter import data_explorer
 from pdf_sorter import fs_helper
+from pdf_sorter import ocr_backend
+from pdf_sorter import ocr_cache
+from pdf_sorter import ocr_pool
+from pdf_sorter import page_classifier
+from pdf_sorter import pdf_image_sorter
+from pdf_sorter import rasterizer
+from pdf_sorter import sharding
 
 logger = logging.getLogger('pdf_sorter')
 
+# A criteria key and value index to sort by, and the sort list and output file of that sort
+SortTarget = namedtuple('SortTarget', ['criteria', 'index', 'sort', 'output'])
+
 class ArgumentValidator(argparse.Action):
     """
     Main argument validation base class.
@@ -21,17 +33,18 @@ class ArgumentValidator(argparse.Action):
 
 class SortValidator(ArgumentValidator):
     """
-    Validates input for sorted list of values
+    Validates input for sorted list(s) of values
     Flags: -s --sort
-    Expect: .txt file type, file should exist
+    Expect: .txt file type(s), file(s) should exist
     """
     def __call__(self, parser, namespace, values, option_string=None):
-        ext = os.path.splitext(values)[-1].lower()
-        if ext != '.txt':
-            raise argparse.ArgumentError(self,
-                'Expected file with list of sorted values to be .txt. Instead receieved %s' % values)
-        if not os.path.exists(values):
-            raise argparse.ArgumentError(self, 'File %s not found' % (values))
+        for value in values:
+            ext = os.path.splitext(value)[-1].lower()
+            if ext != '.txt':
+                raise argparse.ArgumentError(self,
+                    'Expected file with list of sorted values to be .txt. Instead receieved %s' % value)
+            if not os.path.exists(value):
+                raise argparse.ArgumentError(self, 'File %s not found' % (value))
         setattr(namespace, self.dest, values)
 
 
@@ -55,29 +68,34 @@ class FileValidator(ArgumentValidator):
 
 class OutputValidator(ArgumentValidator):
     """
-    Validates naming convention of output file
+    Validates naming convention of output file(s)
     Flags: -o --output
-    Expect: .pdf file, cannot override file without --override flag
+    Expect: .pdf file(s), cannot override file without --override flag, no file listed twice
     """
     def __call__(self, parser, namespace, values, option_string=None):
         subdirectory = fs_helper.create_subdirectory_if_needed('output')
-        file_path = subdirectory + values
-        ext = os.path.splitext(values)[-1].lower()
-        if ext != '.pdf':
-            raise argparse.ArgumentError(self, 'Expected output file to be .pdf. Instead receieved %s' % values)
-        if os.path.exists(file_path) and '--override' not in sys.argv:
-            raise argparse.ArgumentError(self, 'Output file %s already exists in subdirectory %s. Please rename file or use --override flag to override output file.' % (values, subdirectory))
-        setattr(namespace, self.dest, file_path)
+        file_paths = []
+        for value in values:
+            file_path = subdirectory + value
+            ext = os.path.splitext(value)[-1].lower()
+            if ext != '.pdf':
+                raise argparse.ArgumentError(self, 'Expected output file to be .pdf. Instead receieved %s' % value)
+            if os.path.exists(file_path) and '--override' not in sys.argv:
+                raise argparse.ArgumentError(self, 'Output file %s already exists in subdirectory %s. Please rename file or use --override flag to override output file.' % (value, subdirectory))
+            if file_path in file_paths:
+                raise argparse.ArgumentError(self, 'Output file %s is listed more than once' % value)
+            file_paths.append(file_path)
+        setattr(namespace, self.dest, file_paths)
 
 
 class IndexValidator(ArgumentValidator):
     """
-    Validates input for value index lookup
+    Validates input for value index lookup(s)
     Flags: -i --index
     Expect: cannot be the same index as lookup criteria (!=0)
     """
     def __call__(self, parser, namespace, values, option_string=None):
-        if values == 0:
+        if 0 in values:
             raise argparse.ArgumentError(self,
                 'Expected value index to be different than index of criteria key (i > criteria or criteria < i)')
         setattr(namespace, self.dest, values)
@@ -127,6 +145,139 @@ class DPIValidator(ArgumentValidator):
                 'Expected dpi value of at least 100. Instead receieved %s' % values)
         setattr(namespace, self.dest, values)
 
+class AdaptiveDPIValidator(ArgumentValidator):
+    """
+    Validates input for the lower resolutions of adaptive OCR passes
+    Flags: --adaptive-dpi
+    Expect: minimum dpi of 100 for every pass
+    Modifications: ignore duplicates, sort from lowest to highest
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        for value in values:
+            if value < 100:
+                raise argparse.ArgumentError(self,
+                    'Expected adaptive dpi values of at least 100. Instead receieved %s' % value)
+        setattr(namespace, self.dest, sorted(set(values)))
+
+
+class ConfidenceValidator(ArgumentValidator):
+    """
+    Validates input for minimum OCR confidence
+    Flags: --min-confidence
+    Expect: value between 0-100
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values < 0 or values > 100:
+            raise argparse.ArgumentError(self,
+                'Expected confidence between 0-100. Instead receieved %s' % values)
+        setattr(namespace, self.dest, values)
+
+
+class PositiveIntegerValidator(ArgumentValidator):
+    """
+    Validates input for worker, page and thread limits
+    Flags: -w --workers, --page-budget, --render-threads, --cache-size, --chunk-size, --shard-size, --shard-timeout
+    Expect: at least 1
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values < 1:
+            raise argparse.ArgumentError(self,
+                'Expected %s to be at least 1. Instead receieved %s' % (option_string, values))
+        setattr(namespace, self.dest, values)
+
+
+class NonNegativeIntegerValidator(ArgumentValidator):
+    """
+    Validates input for counts that can be zero
+    Flags: --local-shard-workers
+    Expect: at least 0
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values < 0:
+            raise argparse.ArgumentError(self,
+                'Expected %s to be at least 0. Instead receieved %s' % (option_string, values))
+        setattr(namespace, self.dest, values)
+
+
+class InkRatioValidator(ArgumentValidator):
+    """
+    Validates input for the share of ink pixels of a blank page
+    Flags: --blank-ink
+    Expect: value between 0-1
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values < 0 or values > 1:
+            raise argparse.ArgumentError(self,
+                'Expected blank page ink ratio between 0-1. Instead receieved %s' % values)
+        setattr(namespace, self.dest, values)
+
+
+class StatsdValidator(ArgumentValidator):
+    """
+    Validates address of StatsD server to send run metrics to
+    Flags: --statsd
+    Expect: host:port
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        host, _, port = values.rpartition(':')
+        if not host or not port.isdigit():
+            raise argparse.ArgumentError(self,
+                'Expected StatsD address as host:port. Instead receieved %s' % values)
+        setattr(namespace, self.dest, (host, int(port)))
+
+
+class ExploreFormatValidator(ArgumentValidator):
+    """
+    Validates file format of explore mode output
+    Flags: --explore-format
+    Expect: csv or parquet. parquet requires pyarrow to be installed
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values not in data_explorer.EXPLORE_FORMATS:
+            raise argparse.ArgumentError(self,
+                'Expected explore format to be one of %s. Instead receieved %s' % (', '.join(data_explorer.EXPLORE_FORMATS), values))
+        if values == data_explorer.PARQUET_FORMAT:
+            try:
+                import pyarrow
+            except ImportError:
+                raise argparse.ArgumentError(self, 'Parquet explore output requires pyarrow. Install it with "pip install pyarrow"')
+        setattr(namespace, self.dest, values)
+
+
+class OcrBackendValidator(ArgumentValidator):
+    """
+    Validates OCR backend used by the OCR workers
+    Flags: --ocr-backend
+    Expect: auto, pytesseract or tesserocr. tesserocr requires tesserocr to be installed
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values not in ocr_backend.OCR_BACKENDS:
+            raise argparse.ArgumentError(self,
+                'Expected OCR backend to be one of %s. Instead receieved %s' % (', '.join(ocr_backend.OCR_BACKENDS), values))
+        if values == ocr_backend.TESSEROCR and not ocr_backend.is_tesserocr_available():
+            raise argparse.ArgumentError(self, 'The tesserocr OCR backend requires tesserocr. Install it with "pip install tesserocr"')
+        setattr(namespace, self.dest, values)
+
+def set_sort_targets(parser, args):
+    """
+    Pairs each criteria key with its value index, sort list and output file as args.sort_targets.
+    criteria, index, sort and output are then set to those of the first target, which is also
+    the criteria used in explore mode.
+    Expect: one sort list and output file per criteria key, and one index per key or one for all
+    """
+    criteria_count = len(args.criteria)
+    if len(args.sort) != criteria_count or len(args.output) != criteria_count:
+        parser.error('Expected one sort list (-s) and output file (-o) per criteria key (-c). Instead receieved %d criteria, %d sort lists and %d output files' % (
+            criteria_count, len(args.sort), len(args.output)))
+    if len(args.index) not in (1, criteria_count):
+        parser.error('Expected one value index (-i) per criteria key (-c), or one for all of them. Instead receieved %d indexes for %d criteria' % (
+            len(args.index), criteria_count))
+    indexes = args.index * criteria_count if len(args.index) == 1 else args.index
+
+    args.sort_targets = [SortTarget(*target) for target in zip(args.criteria, indexes, args.sort, args.output)]
+    args.criteria, args.index, args.sort, args.output = args.sort_targets[0]
+    return args
+
 def get_valid_arguments(args):
     """
     Set up expected input arguments, and validation. Returns validated arguments.
@@ -134,21 +285,21 @@ def get_valid_arguments(args):
     parser = argparse.ArgumentParser(
         description='Re-sort image-based PDFs based on internal document values')
 
-    parser.add_argument('-s', '--sort', action=SortValidator, type=str, required=True,
-                        help='<Required> The new order to re-sort the document(s). Input is expected to be a newline delimeted textfile of expected values.')
+    parser.add_argument('-s', '--sort', nargs='+', action=SortValidator, type=str, required=True,
+                        help='<Required> The new order to re-sort the document(s). Input is expected to be a newline delimeted textfile of expected values. Provide one file per criteria key to produce several sorted outputs from a single OCR pass.')
 
     parser.add_argument('-f', '--files', nargs='+', action=FileValidator, type=str, required=True,
                         help='<Required> The original input file(s). Requires minimum 1 .pdf format file; program can merge multiple files together and then sort.')
 
-    parser.add_argument('-o', '--output', action=OutputValidator, type=str, required=True,
-                        help='<Required> The name of the output .pdf file to be created.')
+    parser.add_argument('-o', '--output', nargs='+', action=OutputValidator, type=str, required=True,
+                        help='<Required> The name of the output .pdf file to be created. Provide one file per criteria key.')
 
-    parser.add_argument('-c', '--criteria', action='store', type=str, required=True,
-                        help='<Required> The criteria key to search within the document, eg. "Order"')
+    parser.add_argument('-c', '--criteria', nargs='+', action='store', type=str, required=True,
+                        help='<Required> The criteria key to search within the document, eg. "Order". Several keys (eg. -c Order Color:) each sort the document by their own value, in the order of the matching -s file, into the matching -o file.')
 
-    parser.add_argument('-i', '--index', action=IndexValidator, type=int, required=False,
-                        default=1,
-                        help='Optional (default = 1): The index of the lookup value. Default is the index directly after the criteria key (+1). Can accept negative values')
+    parser.add_argument('-i', '--index', nargs='+', action=IndexValidator, type=int, required=False,
+                        default=[1],
+                        help='Optional (default = 1): The index of the lookup value. Default is the index directly after the criteria key (+1). Can accept negative values. Provide one index per criteria key, or one for all of them')
 
     parser.add_argument('-q', '--quadrant', nargs='+', action=QuadrantValidator, type=int, required=False,
                         default=[0],
@@ -158,6 +309,66 @@ def get_valid_arguments(args):
                         default=300,
                         help='Optional (default = 300): Dots per inch (dpi). Control the resolution of the image converted from the orignal PDF. Higher values will produce higher resolution images, which may improve character recognition but can increase processing times. Minimum value is 100.')
     
+    parser.add_argument('--adaptive-dpi', nargs='+', action=AdaptiveDPIValidator, type=int, required=False,
+                        default=None,
+                        help='Optional: Lower resolutions to OCR pages at first, eg. "--adaptive-dpi 120 200". Only pages where the criteria value is not found, or is found with low confidence, are converted again at the next resolution, up to -d. Most clean pages are then only converted at the lowest resolution.')
+
+    parser.add_argument('--min-confidence', action=ConfidenceValidator, type=int, required=False,
+                        default=pdf_image_sorter.DEFAULT_MIN_CONFIDENCE,
+                        help='Optional (default = %d): Minimum tesseract confidence (0-100) in a criteria value found with --adaptive-dpi before the page is accepted without trying a higher resolution.' % pdf_image_sorter.DEFAULT_MIN_CONFIDENCE)
+
+    parser.add_argument('--blank-ink', action=InkRatioValidator, type=float, required=False,
+                        default=None,
+                        help='Optional: Classify rendered pages with at most this share (0-1) of ink pixels as blank before OCR, eg. 0.0005. Blank pages skip tesseract, and are treated like any page without the criteria key (see --multipage and --drop-blank).')
+
+    parser.add_argument('-w', '--workers', action=PositiveIntegerValidator, type=int, required=False,
+                        default=ocr_pool.default_worker_count(),
+                        help='Optional (default = number of cores): Number of worker processes used to run OCR on document pages in parallel.')
+
+    parser.add_argument('--ocr-backend', action=OcrBackendValidator, type=str, required=False,
+                        default=ocr_backend.AUTO,
+                        help='Optional (default = auto): OCR backend, pytesseract or tesserocr. tesserocr keeps one tesseract engine loaded in each worker and passes it page images in memory, instead of starting a tesseract process (and writing a temporary file) per page. auto uses tesserocr if it is installed, otherwise pytesseract.')
+
+    parser.add_argument('--page-budget', action=PositiveIntegerValidator, type=int, required=False,
+                        default=None,
+                        help='Optional (default = 2 x workers): Maximum number of rendered pages waiting for OCR. Pages are rendered in windows of this size so memory use does not grow with the length of the document. Up to 3 x this many rendered pages are held at once, counting the window being rendered and the pages being OCR\'d.')
+
+    parser.add_argument('--render-threads', action=PositiveIntegerValidator, type=int, required=False,
+                        default=rasterizer.DEFAULT_RENDER_THREADS,
+                        help='Optional (default = %d): Maximum number of poppler processes used to render each window of pages.' % rasterizer.DEFAULT_RENDER_THREADS)
+
+    parser.add_argument('--cache-dir', action='store', type=str, required=False,
+                        default=ocr_cache.DEFAULT_CACHE_DIRECTORY,
+                        help='Optional (default = %s): Directory of the OCR result cache. Pages OCR\'d by a previous run with the same settings are read from the cache instead of being converted and OCR\'d again.' % ocr_cache.DEFAULT_CACHE_DIRECTORY)
+
+    parser.add_argument('--cache-size', action=PositiveIntegerValidator, type=int, required=False,
+                        default=ocr_cache.DEFAULT_CACHE_SIZE_MB,
+                        help='Optional (default = %d): Maximum size of the OCR result cache in MB. Least recently used results are removed once the cache is full.' % ocr_cache.DEFAULT_CACHE_SIZE_MB)
+
+    parser.add_argument('--chunk-size', action=PositiveIntegerValidator, type=int, required=False,
+                        default=None,
+                        help='Optional: Split the sorted output into PDFs of at most this many pages (eg. one per printer tray), named <output>_001.pdf, <output>_002.pdf and so on.')
+
+    parser.add_argument('--shard-dir', action='store', type=str, required=False,
+                        default=None,
+                        help='Optional: Split the pages into shards and extract their text on shard workers, which share this spool directory with the sort (eg. a network share mounted at the same path on every host). Start more workers on any host with "python -m pdf_sorter shard-worker <directory>".')
+
+    parser.add_argument('--shard-size', action=PositiveIntegerValidator, type=int, required=False,
+                        default=sharding.DEFAULT_SHARD_SIZE,
+                        help='Optional (default = %d): Number of pages in each shard, with --shard-dir.' % sharding.DEFAULT_SHARD_SIZE)
+
+    parser.add_argument('--local-shard-workers', action=NonNegativeIntegerValidator, type=int, required=False,
+                        default=sharding.DEFAULT_LOCAL_SHARD_WORKERS,
+                        help='Optional (default = %d): Number of shard workers started on this host with --shard-dir, each with its own pool of -w OCR workers. Use 0 to leave every shard to workers started separately.' % sharding.DEFAULT_LOCAL_SHARD_WORKERS)
+
+    parser.add_argument('--shard-timeout', action=PositiveIntegerValidator, type=int, required=False,
+                        default=sharding.DEFAULT_SHARD_TIMEOUT,
+                        help='Optional (default = %d): Seconds a shard worker can go without finishing a page before its shard is handed to another worker, eg. after its host went down.' % sharding.DEFAULT_SHARD_TIMEOUT)
+
+    parser.add_argument('--statsd', action=StatsdValidator, type=str, required=False,
+                        default=None,
+                        help='Optional: host:port of a StatsD server to send the stage timings and page metrics of each run to, over UDP.')
+
     parser.add_argument('--override', action='store_true', required=False,
                         help='[FLAG] Override the output file if a file of that name already exists.')
     
@@ -168,9 +379,34 @@ def get_valid_arguments(args):
                         help='[FLAG] Indicate that original document may have criteria values that can span multiple pages (eg. multi-page orders), but the value itself may not be included on every page. Including this flag to assume blank pages (without criteria found) are connected to the previous page. Excluding this flag means the blank pages will be excluded from the final document.')
 
 
+    parser.add_argument('--text-layer', action='store_true', required=False,
+                        help='[FLAG] Use the embedded text of searchable pages instead of OCR. Pages where the criteria key is not found in the text layer (eg. scanned pages) are still converted to images and OCR\'d.')
+
+    parser.add_argument('--targeted', action='store_true', required=False,
+                        help='[FLAG] Learn where the criteria key is on the first page it is found, and only OCR a small region around that spot on later pages. Pages where the key or value is not found in the region are OCR\'d in full. Useful for templated documents. Ignored in explore mode.')
+
+    parser.add_argument('--drop-blank', action='store_true', required=False,
+                        help='[FLAG] Leave blank pages (see --blank-ink, default %s) out of the sorted output, even with --multipage.' % page_classifier.DEFAULT_BLANK_INK_RATIO)
+
+    parser.add_argument('--no-cache', action='store_true', required=False,
+                        help='[FLAG] Do not read or write the OCR result cache.')
+
+    parser.add_argument('--no-dedup', action='store_true', required=False,
+                        help='[FLAG] OCR every page, even pages with the same content as an earlier page of the input (eg. reprinted orders, repeated inserts, or a file listed twice), which otherwise reuse the text of that page.')
+
+    parser.add_argument('--from-index', action='store_true', required=False,
+                        help='[FLAG] Reuse the values extracted by a previous sort of the same input file(s), saved in a sort index next to the input, and only write the newly sorted PDF. Falls back to a full run if the index is missing or was built from different files or settings.')
+
+    parser.add_argument('--resume', action='store_true', required=False,
+                        help='[FLAG] Resume a sort that did not finish (eg. the process was killed) from the first page it had not extracted. The value of every page is saved to a journal in ./output/journals as it is extracted. Only resumes a job with the same input files, output and settings.')
+
     parser.add_argument('--explore', action='store_true', required=False,
                         help='[FLAG] Run in explore mode (-d=explore) to return OCR output. This is useful for determining parameters for -c and -i inputs.')
     
+    parser.add_argument('--explore-format', action=ExploreFormatValidator, type=str, required=False,
+                        default=data_explorer.CSV_FORMAT,
+                        help='Optional (default = csv): File format of the explore mode output, csv or parquet. Parquet files are smaller and faster to load for large documents, and require pyarrow.')
+    
     parser.add_argument('--debug', action="store_const", required=False,
                         dest="loglevel",
                         const=logging.DEBUG,
@@ -183,4 +419,4 @@ def get_valid_arguments(args):
                         default=logging.WARNING,
                         help='[FLAG] Include descriptive statements in logging output (excludes debug logging statements)')
 
-    return parser.parse_args(args)
+    return set_sort_targets(parser, parser.parse_args(args))
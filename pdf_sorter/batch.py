@@ -0,0 +1,177 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import logging
+import os
+import time
+from pdf_sorter import argument_handler
+from pdf_sorter import fs_helper
+from pdf_sorter import metrics
+from pdf_sorter import ocr_pool
+from pdf_sorter import pipeline
+
+logger = logging.getLogger('pdf_sorter')
+
+DEFAULT_CONCURRENT_JOBS = 2
+REQUIRED_MANIFEST_FIELDS = ['files', 'sort', 'output', 'criteria']
+FLAG_MANIFEST_FIELDS = ['multipage', 'reverse', 'explore']
+# Explore jobs write their CSV here, named after the job's output
+EXPLORE_SUBDIRECTORY = 'output/data'
+
+def read_manifest(manifest_path):
+  """
+  Reads the list of batch jobs from a .json or .csv manifest.
+  * JSON manifests are a list of job objects, or an object with a "jobs" list
+  * CSV manifests have one job per row, and separate multiple input files with ";"
+  * Each job needs files, sort, output and criteria, and can set index, quadrant,
+    multipage, reverse, explore and a name
+  """
+  ext = os.path.splitext(manifest_path)[-1].lower()
+  with open(manifest_path, 'r') as manifest:
+    if ext == '.json':
+      jobs = json.load(manifest)
+      jobs = jobs.get('jobs', []) if isinstance(jobs, dict) else jobs
+    elif ext == '.csv':
+      jobs = list(csv.DictReader(manifest))
+    else:
+      raise ValueError('Expected batch manifest to be .json or .csv. Instead receieved %s' % manifest_path)
+
+  for job_number, job in enumerate(jobs, 1):
+    missing_fields = [field for field in REQUIRED_MANIFEST_FIELDS if not job.get(field)]
+    if missing_fields:
+      raise ValueError('Job %d in %s is missing %s' % (job_number, manifest_path, ', '.join(missing_fields)))
+  return jobs
+
+
+def is_enabled(value):
+  if isinstance(value, str):
+    return value.strip().lower() in ['1', 'true', 'yes', 'y']
+  return bool(value)
+
+
+def split_values(value, separator):
+  if isinstance(value, str):
+    return [item.strip() for item in value.split(separator) if item.strip()]
+  return [str(item) for item in value]
+
+
+def get_job_arguments(job, shared_arguments):
+  """ Converts a manifest job into the command line arguments of a single run """
+  job_arguments = ['-s', job['sort'], '-f'] + split_values(job['files'], ';') + ['-o', job['output'], '-c', job['criteria']]
+  if job.get('index') not in [None, '']:
+    job_arguments += ['-i', str(job['index'])]
+  if job.get('quadrant') not in [None, '']:
+    job_arguments += ['-q'] + split_values(job['quadrant'], ' ')
+  job_arguments += ['--' + flag for flag in FLAG_MANIFEST_FIELDS if is_enabled(job.get(flag))]
+  return job_arguments + shared_arguments
+
+
+def get_job_name(job):
+  return job.get('name') or job['output']
+
+
+def run_batch_job(job_name, args, pool, cache):
+  """ Runs a single job, returning its status rather than raising """
+  start_time = time.time()
+  status = {'name': job_name, 'status': 'success', 'output': None, 'error': None}
+  run_metrics = metrics.RunMetrics()
+  try:
+    explore_file = None
+    if args.explore:
+      explore_file = fs_helper.create_subdirectory_if_needed(EXPLORE_SUBDIRECTORY) + '%s.csv' % os.path.splitext(os.path.basename(args.output))[0]
+    status['output'] = pipeline.run_job(args, pool, cache, explore_file, run_metrics=run_metrics)
+  except Exception as error:
+    logger.exception("Batch job %s failed" % job_name)
+    status.update({'status': 'failed', 'error': str(error)})
+  status['seconds'] = round(time.time() - start_time, 3)
+  status['metrics'] = run_metrics.get_summary()
+  if args.statsd:
+    run_metrics.send_statsd(args.statsd)
+  logger.info("Batch job %s: %s in %.1fs" % (job_name, status['status'], status['seconds']))
+  return status
+
+
+def run_batch(jobs, shared_arguments, concurrent_jobs=DEFAULT_CONCURRENT_JOBS):
+  """
+  Runs every job of a batch in this process, and returns the status of each job.
+  * Every job is validated with the same rules as a single command line run
+  * All jobs share one OCR worker pool and result cache, built from the shared arguments
+  * Up to concurrent_jobs jobs run at once, so their pages are queued on the shared
+    pool together and the workers stay busy while a job is rendering or writing
+  """
+  statuses = [None] * len(jobs)
+  valid_jobs = []
+  for job_number, job in enumerate(jobs):
+    job_name = get_job_name(job)
+    try:
+      valid_jobs.append((job_number, job_name, argument_handler.get_valid_arguments(get_job_arguments(job, shared_arguments))))
+    except SystemExit:
+      logger.error("Batch job %s has invalid arguments. Skipping." % job_name)
+      statuses[job_number] = {'name': job_name, 'status': 'invalid', 'output': None, 'error': 'Invalid arguments', 'seconds': 0}
+
+  if valid_jobs:
+    shared_args = valid_jobs[0][2]
+    cache = pipeline.create_cache(shared_args)
+    with ocr_pool.OcrWorkerPool(shared_args.workers, pipeline.get_page_budget(shared_args), shared_args.ocr_backend) as pool:
+      with ThreadPoolExecutor(max_workers=concurrent_jobs) as executor:
+        futures = {job_number: executor.submit(run_batch_job, job_name, args, pool, cache) for job_number, job_name, args in valid_jobs}
+        for job_number, future in futures.items():
+          statuses[job_number] = future.result()
+
+  return statuses
+
+
+def write_batch_summary(manifest_path, statuses, seconds, summary_path):
+  """ Saves the status of every job, and totals, as JSON """
+  summary = {
+    'manifest': manifest_path,
+    'jobs': statuses,
+    'succeeded': sum(1 for status in statuses if status['status'] == 'success'),
+    'failed': sum(1 for status in statuses if status['status'] != 'success'),
+    'seconds': round(seconds, 3)
+  }
+  with open(summary_path, 'w') as summary_file:
+    json.dump(summary, summary_file, indent=2)
+  return summary
+
+
+def get_batch_arguments(args):
+  """
+  Parses the batch command line. Any argument that is not batch specific is
+  applied to every job of the manifest, eg. --dpi, --workers or --override.
+  """
+  parser = argparse.ArgumentParser(prog='pdf_sorter batch',
+      description='Re-sort many image-based PDFs in one process, from a manifest of jobs')
+
+  parser.add_argument('manifest', type=str,
+                      help='<Required> .json or .csv manifest of jobs, each with files, sort, output and criteria (and optionally index, quadrant, multipage, reverse, explore and name).')
+
+  parser.add_argument('-j', '--jobs', action=argument_handler.PositiveIntegerValidator, type=int, required=False,
+                      default=DEFAULT_CONCURRENT_JOBS,
+                      help='Optional (default = %d): Number of jobs to run at once. All jobs share the same OCR workers.' % DEFAULT_CONCURRENT_JOBS)
+
+  parser.add_argument('--debug', action="store_const", required=False,
+                      dest="loglevel", const=logging.DEBUG, default=logging.WARNING,
+                      help='[FLAG] Include debug logs in logging output (lowest log level, captures all logs)')
+
+  parser.add_argument('--verbose', action="store_const", required=False,
+                      dest="loglevel", const=logging.INFO, default=logging.WARNING,
+                      help='[FLAG] Include descriptive statements in logging output (excludes debug logging statements)')
+
+  return parser.parse_known_args(args)
+
+
+def main(args):
+  batch_args, shared_arguments = get_batch_arguments(args)
+  logging_path = fs_helper.setup_logging(False, batch_args.loglevel, 'batch')
+
+  start_time = time.time()
+  jobs = read_manifest(batch_args.manifest)
+  logger.info("Running %d batch jobs from %s" % (len(jobs), batch_args.manifest))
+  statuses = run_batch(jobs, shared_arguments, batch_args.jobs)
+
+  summary_path = os.path.splitext(logging_path)[0] + '_summary.json'
+  summary = write_batch_summary(batch_args.manifest, statuses, time.time() - start_time, summary_path)
+  logger.info("Batch complete: %d succeeded, %d failed. Summary saved to %s" % (summary['succeeded'], summary['failed'], summary_path))
+  exit(0 if summary['failed'] == 0 else 1)
@@ -0,0 +1,277 @@
+import argparse
+from contextlib import contextmanager
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+from pdf_sorter import argument_handler
+from pdf_sorter import data_explorer
+from pdf_sorter import fs_helper
+from pdf_sorter import metrics
+from pdf_sorter import ocr_backend
+from pdf_sorter import ocr_pool
+from pdf_sorter import pdf_image_sorter
+from pdf_sorter import rasterizer
+from pdf_sorter import synthetic_documents
+from pdf_sorter import virtual_document
+
+logger = logging.getLogger('pdf_sorter')
+
+BENCHMARK_SUBDIRECTORY = 'output/benchmarks'
+DEFAULT_PAGES = 20
+DEFAULT_DOCUMENT_DPI = 150
+DEFAULT_REGRESSION_THRESHOLD = 0.1
+STAGES = ['extract', 'key extraction', 'explore matrix', 'write']
+
+@contextmanager
+def timed_stage(results, stage, page_count):
+  """
+  Records the duration, pages/sec and peak memory of the stage in results['stages'].
+  * The peak memory of this process is reset when the stage starts, so each stage
+      reports its own peak (results['peak_rss_per_stage'] is False where it can't be reset)
+  * The peak of finished child processes (eg. poppler) can't be reset, so it is the
+      largest of any child finished by the end of the stage
+  """
+  results['peak_rss_per_stage'] = metrics.reset_peak_rss() and results.get('peak_rss_per_stage', True)
+  start_time = time.perf_counter()
+  yield
+  seconds = time.perf_counter() - start_time
+  peak_rss_mb, peak_children_rss_mb = metrics.get_peak_rss_mb()
+  results['stages'][stage] = {
+    'seconds': round(seconds, 4),
+    'pages_per_second': round(page_count / seconds, 2) if seconds else None,
+    'peak_rss_mb': peak_rss_mb,
+    'peak_children_rss_mb': peak_children_rss_mb
+  }
+  logger.info("Benchmark %s: %.2fs (%.1f pages/sec)" % (stage, seconds, page_count / seconds if seconds else 0))
+
+
+def get_accuracy(value_page_lookup, page_values):
+  """
+  Compares the extracted values against the ground truth of the synthetic document.
+  * page_accuracy: fraction of pages attached to their correct value
+  * order_accuracy: fraction of orders whose value was found with exactly the right pages
+  """
+  extracted_page_values = {}
+  for value, page_indexes in value_page_lookup.items():
+    for page_index in page_indexes:
+      extracted_page_values[page_index] = value
+
+  expected_orders = {}
+  for page_index, value in enumerate(page_values):
+    expected_orders.setdefault(value, []).append(page_index)
+
+  correct_pages = sum(1 for page_index, value in enumerate(page_values) if extracted_page_values.get(page_index) == value)
+  correct_orders = sum(1 for value, page_indexes in expected_orders.items() if value_page_lookup.get(value) == page_indexes)
+  return {
+    'page_accuracy': round(correct_pages / len(page_values), 4),
+    'order_accuracy': round(correct_orders / len(expected_orders), 4),
+    'orders_expected': len(expected_orders),
+    'orders_found': len(value_page_lookup)
+  }
+
+
+def get_extract_metrics(run_metrics):
+  """ Breakdown of the extract stage: time in each of its stages, total render and OCR time, and utilization """
+  summary = run_metrics.get_summary()
+  return {measure: summary[measure] for measure in ['stages', 'pages', 'render_seconds', 'ocr_seconds', 'utilization', 'max_queue_depth']}
+
+
+def run_benchmark(config, working_directory, pool):
+  """
+  Generates a synthetic packing list for config, then runs and times each stage of a sort
+  on it in turn. Each stage runs to completion before the next so its time and memory
+  are measured on their own.
+  * Pages are extracted by the same PageTextExtractor as a sort, so rendering is streamed
+    in page budget windows on a background thread, overlapping OCR (without the OCR cache,
+    so every run does the same work)
+  * The render and OCR time, and utilization, within extraction are saved as extract_metrics
+  * The explore matrix is written through the same column store as explore mode
+  """
+  page_count = config['pages']
+  criteria_key = synthetic_documents.DEFAULT_CRITERIA_KEY
+  pdf_path = os.path.join(working_directory, 'benchmark.pdf')
+  results = {'config': config, 'stages': {}}
+
+  with timed_stage(results, 'generate', page_count):
+    page_values, sort_values = synthetic_documents.generate_packing_list(pdf_path, page_count, config['document_dpi'],
+      config['noise'], config['layout'], config['multipage_ratio'], criteria_key, config['seed'])
+
+  document = virtual_document.VirtualDocument([pdf_path], [page_count])
+  run_metrics = metrics.RunMetrics()
+  with timed_stage(results, 'extract', page_count):
+    extractor = pdf_image_sorter.PageTextExtractor(pool, config['dpi'], config['quadrant'], criteria_key, page_budget=config['page_budget'],
+      render_threads=config['render_threads'], run_metrics=run_metrics, deduplicate=True)
+    extracted_text = list(extractor.extract(document))
+  results['extract_metrics'] = get_extract_metrics(run_metrics)
+
+  with timed_stage(results, 'key extraction', page_count):
+    extracted_values = (pdf_image_sorter.get_page_values(page_text, [argument_handler.SortTarget(criteria_key, 1, None, None)]) for page_text in extracted_text)
+    value_page_lookup, = pdf_image_sorter.build_value_page_maps(extracted_values, [criteria_key], True)
+
+  with timed_stage(results, 'explore matrix', page_count):
+    explore_file = os.path.join(working_directory, 'explore.csv')
+    with data_explorer.ExploreColumnStore(data_explorer.get_explore_store_path(explore_file)) as column_store:
+      for page_text in extracted_text:
+        column_store.add_page(page_text, criteria_key)
+      column_store.write_explore_file(explore_file)
+
+  with timed_stage(results, 'write', page_count):
+    pdf_image_sorter.generate_sorted_document(document, value_page_lookup, sort_values, os.path.join(working_directory, 'sorted.pdf'))
+
+  total_seconds = sum(results['stages'][stage]['seconds'] for stage in STAGES)
+  results['total'] = {
+    'seconds': round(total_seconds, 4),
+    'pages_per_second': round(page_count / total_seconds, 2) if total_seconds else None,
+    'peak_rss_mb': max(results['stages'][stage]['peak_rss_mb'] for stage in STAGES),
+    'peak_children_rss_mb': max(results['stages'][stage]['peak_children_rss_mb'] for stage in STAGES)
+  }
+  results['accuracy'] = get_accuracy(value_page_lookup, page_values)
+  return results
+
+
+def get_environment(backend=ocr_backend.PYTESSERACT):
+  return {
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'cpu_count': os.cpu_count(),
+    'tesseract': pdf_image_sorter.get_tesseract_version(backend)
+  }
+
+
+def compare_results(results, previous_results, threshold=DEFAULT_REGRESSION_THRESHOLD):
+  """
+  Returns the regressions of results against a previous run: any stage (or the total)
+  more than threshold slower, and any drop in accuracy
+  """
+  regressions = []
+  for stage in STAGES + ['total']:
+    current = results['total'] if stage == 'total' else results['stages'].get(stage)
+    previous = previous_results['total'] if stage == 'total' else previous_results['stages'].get(stage)
+    if not current or not previous or not previous['seconds']:
+      continue
+    change = current['seconds'] / previous['seconds'] - 1
+    logger.info("Benchmark %s: %.2fs vs %.2fs (%+.0f%%)" % (stage, current['seconds'], previous['seconds'], change * 100))
+    if change > threshold:
+      regressions.append('%s is %.0f%% slower (%.2fs vs %.2fs)' % (stage, change * 100, current['seconds'], previous['seconds']))
+
+  for measure in ['page_accuracy', 'order_accuracy']:
+    current, previous = results['accuracy'][measure], previous_results['accuracy'][measure]
+    if current < previous:
+      regressions.append('%s dropped from %.4f to %.4f' % (measure, previous, current))
+  return regressions
+
+
+def get_benchmark_arguments(args):
+  parser = argparse.ArgumentParser(prog='pdf_sorter benchmark',
+      description='Time each stage of a sort on a synthetic image-only packing list, and save the results as JSON')
+
+  parser.add_argument('-p', '--pages', action=argument_handler.PositiveIntegerValidator, type=int, required=False, default=DEFAULT_PAGES,
+                      help='Optional (default = %d): Number of pages in the synthetic document.' % DEFAULT_PAGES)
+
+  parser.add_argument('--document-dpi', action=argument_handler.PositiveIntegerValidator, type=int, required=False, default=DEFAULT_DOCUMENT_DPI,
+                      help='Optional (default = %d): Resolution of the page images in the synthetic document.' % DEFAULT_DOCUMENT_DPI)
+
+  parser.add_argument('--noise', type=float, required=False, default=0.0,
+                      help='Optional (default = 0): Fraction of pixels flipped on each synthetic page, like scanner speckle.')
+
+  parser.add_argument('--layout', type=int, choices=[1, 2, 3, 4], required=False, default=1,
+                      help='Optional (default = 1): Quadrant of the synthetic pages the criteria key is printed in.')
+
+  parser.add_argument('--multipage-ratio', type=float, required=False, default=0.2,
+                      help='Optional (default = 0.2): Fraction of synthetic orders that span more than one page.')
+
+  parser.add_argument('--seed', type=int, required=False, default=0,
+                      help='Optional (default = 0): Random seed of the synthetic document, so runs can be compared.')
+
+  parser.add_argument('-d', '--dpi', action=argument_handler.DPIValidator, type=int, required=False, default=300,
+                      help='Optional (default = 300): DPI the document is rasterized at for OCR.')
+
+  parser.add_argument('-q', '--quadrant', action=argument_handler.QuadrantValidator, nargs='+', type=int, required=False,
+                      default=[0],
+                      help='Optional (default = 0): Quadrant(s) of each page to OCR, as for a sort.')
+
+  parser.add_argument('-w', '--workers', action=argument_handler.PositiveIntegerValidator, type=int, required=False,
+                      default=ocr_pool.default_worker_count(),
+                      help='Optional (default = number of cores): Number of OCR worker processes.')
+
+  parser.add_argument('--ocr-backend', action=argument_handler.OcrBackendValidator, type=str, required=False, default=ocr_backend.AUTO,
+                      help='Optional (default = auto): OCR backend, pytesseract or tesserocr, as for a sort.')
+
+  parser.add_argument('--page-budget', action=argument_handler.PositiveIntegerValidator, type=int, required=False, default=None,
+                      help='Optional (default = 2 x workers): Maximum number of rendered pages held in memory at once.')
+
+  parser.add_argument('--render-threads', action=argument_handler.PositiveIntegerValidator, type=int, required=False,
+                      default=rasterizer.DEFAULT_RENDER_THREADS,
+                      help='Optional (default = %d): Number of pdftoppm threads used to render pages.' % rasterizer.DEFAULT_RENDER_THREADS)
+
+  parser.add_argument('--results', type=str, required=False, default=None,
+                      help='Optional (default = ./output/benchmarks/<time>_benchmark.json): Path to save the JSON results to.')
+
+  parser.add_argument('--compare', type=str, required=False, default=None,
+                      help='Optional: JSON results of a previous run to compare against. Exits with an error on a regression.')
+
+  parser.add_argument('--threshold', type=float, required=False, default=DEFAULT_REGRESSION_THRESHOLD,
+                      help='Optional (default = %.1f): Fraction a stage can slow down by before it counts as a regression.' % DEFAULT_REGRESSION_THRESHOLD)
+
+  parser.add_argument('--keep', action="store_true", required=False,
+                      help='[FLAG] Keep the synthetic and sorted PDFs in ./output/benchmarks')
+
+  parser.add_argument('--debug', action="store_const", required=False,
+                      dest="loglevel", const=logging.DEBUG, default=logging.WARNING,
+                      help='[FLAG] Include debug logs in logging output (lowest log level, captures all logs)')
+
+  parser.add_argument('--verbose', action="store_const", required=False,
+                      dest="loglevel", const=logging.INFO, default=logging.WARNING,
+                      help='[FLAG] Include descriptive statements in logging output (excludes debug logging statements)')
+
+  return parser.parse_args(args)
+
+
+def get_config(args):
+  return {
+    'pages': args.pages,
+    'document_dpi': args.document_dpi,
+    'noise': args.noise,
+    'layout': args.layout,
+    'multipage_ratio': args.multipage_ratio,
+    'seed': args.seed,
+    'dpi': args.dpi,
+    'quadrant': args.quadrant,
+    'workers': args.workers,
+    'page_budget': args.page_budget or args.workers * 2,
+    'render_threads': args.render_threads,
+    'ocr_backend': ocr_backend.resolve_backend_name(args.ocr_backend)
+  }
+
+
+def main(args):
+  args = get_benchmark_arguments(args)
+  fs_helper.setup_logging(False, args.loglevel, 'benchmark')
+  run_name = '%d_benchmark' % time.time()
+  subdirectory = fs_helper.create_subdirectory_if_needed(BENCHMARK_SUBDIRECTORY)
+
+  config = get_config(args)
+  with ocr_pool.OcrWorkerPool(config['workers'], config['page_budget'], config['ocr_backend']) as pool:
+    if args.keep:
+      results = run_benchmark(config, fs_helper.create_subdirectory_if_needed(os.path.join(BENCHMARK_SUBDIRECTORY, run_name)), pool)
+    else:
+      with tempfile.TemporaryDirectory() as working_directory:
+        results = run_benchmark(config, working_directory, pool)
+  results['environment'] = get_environment(config['ocr_backend'])
+
+  results_path = args.results or subdirectory + run_name + '.json'
+  with open(results_path, 'w') as results_file:
+    json.dump(results, results_file, indent=2)
+  logger.warning("Benchmark of %d pages: %.1f pages/sec, %.1f%% pages correct. Results saved to %s" % (
+    config['pages'], results['total']['pages_per_second'] or 0, results['accuracy']['page_accuracy'] * 100, results_path))
+
+  regressions = []
+  if args.compare:
+    with open(args.compare, 'r') as previous_file:
+      regressions = compare_results(results, json.load(previous_file), args.threshold)
+    for regression in regressions:
+      logger.error("Regression: %s" % regression)
+  exit(1 if regressions else 0)
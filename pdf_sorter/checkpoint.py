@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import os
+from pdf_sorter import fs_helper
+
+logger = logging.getLogger('pdf_sorter')
+
+JOURNAL_VERSION = 2
+JOURNAL_SUBDIRECTORY = 'output/journals'
+JOURNAL_EXTENSION = '.journal.jsonl'
+
+def get_journal_header(pdf_paths, output, settings):
+  """
+  Identifies a sort job: its input files (by path, size and modified time, so a
+  journal is never replayed against a changed file), output and extraction settings
+  """
+  files = []
+  for pdf_path in pdf_paths:
+    stat = os.stat(pdf_path)
+    files.append({'path': os.path.abspath(pdf_path), 'size': stat.st_size, 'modified': stat.st_mtime_ns})
+  return {'version': JOURNAL_VERSION, 'files': files, 'output': output, 'settings': settings}
+
+
+def get_journal_path(header, extension=JOURNAL_EXTENSION):
+  """ Journal of a job, eg. ./output/journals/3f2a9c0b1d4e5f67.journal.jsonl, or another file of the job with extension """
+  job_hash = hashlib.sha256(json.dumps(header, sort_keys=True).encode()).hexdigest()[:16]
+  return fs_helper.create_subdirectory_if_needed(JOURNAL_SUBDIRECTORY) + job_hash + extension
+
+
+def load_journal(journal_path, header):
+  """
+  Returns the values of each page already extracted by an earlier run of the same
+  job (a list with the value, or None, of each criteria key), in page order, or an empty list if there is no journal for it.
+  A line left half-written by a killed run, and anything after it, is ignored.
+  """
+  try:
+    with open(journal_path, 'r') as journal:
+      lines = journal.read().split('\n')
+  except OSError:
+    logger.warning("No journal found at %s. Extracting every page" % journal_path)
+    return []
+
+  try:
+    if json.loads(lines[0]) != header:
+      logger.warning("Journal %s is from a different job. Extracting every page" % journal_path)
+      return []
+  except ValueError:
+    return []
+
+  page_values = []
+  # The last item is either empty or a half-written line
+  for line in lines[1:-1]:
+    try:
+      page_index, page_value = json.loads(line)
+    except ValueError:
+      break
+    if page_index != len(page_values):
+      break
+    page_values.append(page_value)
+  logger.info("Resuming from journal %s after %d pages" % (journal_path, len(page_values)))
+  return page_values
+
+
+class ExtractionJournal:
+  """
+  Append-only journal of the criteria values found on each page of a sort job.
+  * The first line is the job header, then one [page index, values] line per page,
+    with the value (or None) of each criteria key of the job
+  * Each page is flushed to disk as soon as its value is extracted, so a run
+    that dies part way keeps every page extracted so far
+  * Values resumed from an earlier run are written again when the journal is
+    opened, which drops any half-written line
+  * The journal is removed once the job finishes
+  """
+
+  def __init__(self, journal_path, header, resumed_values=None):
+    self.journal_path = journal_path
+    self.page_count = 0
+    self._journal = open(journal_path, 'w')
+    self._journal.write(json.dumps(header) + '\n')
+    for page_value in resumed_values or []:
+      self.write(page_value)
+    self._journal.flush()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def write(self, page_value):
+    self._journal.write(json.dumps([self.page_count, page_value]) + '\n')
+    self.page_count += 1
+
+  def record(self, page_values):
+    """ Passes on each page value, writing it to the journal first """
+    for page_value in page_values:
+      self.write(page_value)
+      self._journal.flush()
+      yield page_value
+
+  def close(self):
+    self._journal.close()
+
+  def remove(self):
+    self.close()
+    os.remove(self.journal_path)
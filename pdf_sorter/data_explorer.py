@@ -1,9 +1,20 @@
 import csv
+from itertools import islice
+import json
 import logging
+import os
 import time
 
 logger = logging.getLogger('pdf_sorter')
 
+CSV_FORMAT = 'csv'
+PARQUET_FORMAT = 'parquet'
+EXPLORE_FORMATS = [CSV_FORMAT, PARQUET_FORMAT]
+EXPLORE_STORE_EXTENSION = '.columns.jsonl'
+# Maximum number of cells of the explore matrix held in memory while its file is written
+EXPLORE_CELL_BUDGET = 1000000
+PARQUET_ROW_GROUP_SIZE = 1000
+
 def build_relative_index_matrix(extracted_text_pages, criteria_key):
     """
     Builds a matrix of positional indexes for all document pages relative
@@ -17,31 +28,33 @@ def build_relative_index_matrix(extracted_text_pages, criteria_key):
     * Index of criteria key is 0
     * Items found in page before criteria key are negative indexed relative
         to criteria key
+    * Each row is allocated once, for every page, the first time its index is seen, and
+        filled in a single pass over the pages, so pages never pad rows they don't use
     """
+    extracted_text_pages = list(extracted_text_pages)
+    page_count = len(extracted_text_pages)
     all_relative_indexes = {}
 
     for page_index, page_text in enumerate(extracted_text_pages):
-        criteria_index = -1
-        for t, text in enumerate(page_text):
-            if text == criteria_key:
-                criteria_index = t
-                break
-
-        relative_index = get_relative_indexes_for_page(page_text, criteria_index)
-
-        for index in relative_index:
-            if index in all_relative_indexes:
-                all_relative_indexes[index].append(relative_index[index])
-            else:
-                all_relative_indexes[index] = [""]*page_index
-                all_relative_indexes[index].append(relative_index[index])
-
-        empty_indexes = [key for key in all_relative_indexes if key not in relative_index]
-        for empty in empty_indexes:
-            all_relative_indexes[empty].append("")
-            
+        criteria_index = get_criteria_index(page_text, criteria_key)
+        if criteria_index == -1:
+            continue
+        for index, value in enumerate(page_text, -criteria_index):
+            row = all_relative_indexes.get(index)
+            if row is None:
+                row = all_relative_indexes[index] = [""]*page_count
+            row[page_index] = value
+
     return all_relative_indexes
 
+
+def get_criteria_index(page_text, criteria_key):
+    """ Position of the first criteria key in the text of a page, or -1 if it isn't found """
+    for t, text in enumerate(page_text):
+        if text == criteria_key:
+            return t
+    return -1
+
         
 def get_relative_indexes_for_page(page_text, criteria_index):
     """
@@ -62,25 +75,132 @@ def get_relative_indexes_for_page(page_text, criteria_index):
     
     return relative_indexes
 
-def generate_explore_csv(relative_indexes):
-    """ 
-    Builds CSV based on scraped data from documents. File is saved to output/data.
-    Left-most column is relative index (-x > criteria index < +y). Each column
-    represents page in document.
-    """
-    indexes = relative_indexes.keys()
-    headers = ['Relative Index'] + ['Page ' + str(i) for i in range(1, len(relative_indexes[0])+1)]
-    min_index = min(indexes)
-    max_index = max(indexes)
-    curr_index = min_index
 
+def get_default_explore_file(explore_format=CSV_FORMAT):
     curr_time = time.time()
-    explore_file = ('./output/data/pdf_sorter_explore_data_%d.csv' % curr_time)
+    return './output/data/pdf_sorter_explore_data_%d.%s' % (curr_time, explore_format)
+
+
+def write_explore_csv_rows(headers, rows, explore_file):
     with open(explore_file, 'w') as explore_data:
         writer = csv.writer(explore_data)
         writer.writerow(headers)
-        while curr_index <= max_index:
-            row = [curr_index] + relative_indexes[curr_index]
-            writer.writerow(row)
-            curr_index += 1
-    explore_data.close()
\ No newline at end of file
+        writer.writerows(rows)
+
+
+def write_explore_parquet_rows(headers, rows, explore_file):
+    """ Writes explore rows to a Parquet file in row groups, so only one group is held in memory. Requires pyarrow """
+    import pyarrow
+    from pyarrow import parquet
+
+    schema = pyarrow.schema([(headers[0], pyarrow.int64())] + [(header, pyarrow.string()) for header in headers[1:]])
+    rows = iter(rows)
+    with parquet.ParquetWriter(explore_file, schema) as writer:
+        for row_group in iter(lambda: list(islice(rows, PARQUET_ROW_GROUP_SIZE)), []):
+            columns = zip(*row_group)
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+
+
+def get_explore_file_path(explore_file, explore_format):
+    """ explore_file with the extension of the explore format, eg. ./output/data/route1.parquet """
+    return os.path.splitext(explore_file)[0] + '.' + explore_format
+
+
+class ExploreColumnStore:
+    """
+    On-disk store of explore data, appended to one page at a time as its text is
+    extracted, so the text of the whole document is never held in memory.
+    * Each line of the store is a JSON list of one page: the relative index of its
+        first value and its values, or [null, []] if the criteria key isn't on the page
+    * Every line is flushed as it is written, so a run that is killed still leaves
+        the store of every page extracted so far. ExploreColumnStore.load opens a
+        partial store to add the remaining pages (--resume) and write its explore file
+    * Only the page count and lowest and highest relative index are kept in memory
+    """
+
+    def __init__(self, store_path, append=False):
+        self.store_path = store_path
+        self.page_count = 0
+        self.min_index = None
+        self.max_index = None
+        self._store = open(store_path, 'a' if append else 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @classmethod
+    def load(cls, store_path):
+        """ Opens an existing (eg. partial) store to add more pages, or write its explore file """
+        with open(store_path, 'r') as store:
+            lines = [line for line in store if line.endswith('\n')]
+        # Drop the last line if the run was killed while writing it
+        os.truncate(store_path, sum(len(line) for line in lines))
+        column_store = cls(store_path, append=True)
+        pages = [json.loads(line) for line in lines]
+        for first_index, values in pages:
+            column_store.add_column(first_index, values, write=False)
+        return column_store
+
+    def add_page(self, page_text, criteria_key):
+        """ Appends the relative indexes of the text of the next page """
+        criteria_index = get_criteria_index(page_text, criteria_key)
+        if criteria_index == -1:
+            logger.debug("Criteria not found on page (criteria_index = -1)")
+            self.add_column(None, [])
+        else:
+            self.add_column(-criteria_index, list(page_text))
+
+    def add_column(self, first_index, values, write=True):
+        if write:
+            self._store.write(json.dumps([first_index, values]) + '\n')
+            self._store.flush()
+        self.page_count += 1
+        if first_index is not None:
+            last_index = first_index + len(values) - 1
+            self.min_index = first_index if self.min_index is None else min(self.min_index, first_index)
+            self.max_index = last_index if self.max_index is None else max(self.max_index, last_index)
+
+    def get_rows(self):
+        """
+        Rows of the explore matrix, from the lowest to the highest relative index.
+        Rows are filled in blocks of at most EXPLORE_CELL_BUDGET cells, reading the
+        store once per block, so memory is bounded however long the document is
+        """
+        self._store.flush()
+        if self.min_index is None:
+            return
+        block_size = max(1, EXPLORE_CELL_BUDGET // max(1, self.page_count))
+        for block_start in range(self.min_index, self.max_index + 1, block_size):
+            block_end = min(block_start + block_size, self.max_index + 1)
+            block = [[""]*self.page_count for _ in range(block_start, block_end)]
+            with open(self.store_path, 'r') as store:
+                for page_index, line in zip(range(self.page_count), store):
+                    first_index, values = json.loads(line)
+                    if first_index is None:
+                        continue
+                    for index in range(max(block_start, first_index), min(block_end, first_index + len(values))):
+                        block[index - block_start][page_index] = values[index - first_index]
+            for index, row in enumerate(block, block_start):
+                yield [index] + row
+
+    def write_explore_file(self, explore_file, explore_format=CSV_FORMAT):
+        """ Saves the explore matrix of every page in the store as CSV or Parquet. Returns the path of the file """
+        explore_file = get_explore_file_path(explore_file, explore_format)
+        headers = ['Relative Index'] + ['Page ' + str(i) for i in range(1, self.page_count+1)]
+        if explore_format == PARQUET_FORMAT:
+            write_explore_parquet_rows(headers, self.get_rows(), explore_file)
+        else:
+            write_explore_csv_rows(headers, self.get_rows(), explore_file)
+        return explore_file
+
+    def close(self):
+        self._store.close()
+
+
+def get_explore_store_path(explore_file):
+    """ Path of the column store of an explore file, eg. ./output/data/route1.columns.jsonl """
+    return os.path.splitext(explore_file)[0] + EXPLORE_STORE_EXTENSION
@@ -1,6 +1,5 @@
 from collections import Counter
 import time
-from PyPDF2 import PdfFileMerger, PdfFileReader
 import os
 import logging
 
@@ -28,15 +27,6 @@ def get_sort_list(sort_filename,reverse = False):
   
   return sorted_values
 
-def merge_documents(documents):
-  """ Merge input pdf documents into single file based on original input order """
-  merged_pdf_filename = "./output/_merged.pdf"
-  merger = PdfFileMerger()
-  (merger.append(PdfFileReader(open(doc), 'rb')) for doc in documents)
-  merger.write(merged_pdf_filename)
-  logger.info("Merged documents into file %s" % merged_pdf_filename)
-  return merged_pdf_filename
-
 
 class ColorLoggingFormatter(logging.Formatter):
 
@@ -64,9 +54,9 @@ class ColorLoggingFormatter(logging.Formatter):
 
 
 
-def setup_logging(explore, log_level):
+def setup_logging(explore, log_level, mode=None):
   """ Log based on input setings. Logs print to console and save to file in /output/logs"""
-  mode = 'explore' if explore else 'sort'
+  mode = mode or ('explore' if explore else 'sort')
   print_format = '%(asctime)s.%(msecs)d %(levelname)s %(message)s'
 
   logging_subdirectory = 'output/logs'
@@ -82,6 +72,7 @@ def setup_logging(explore, log_level):
   file_logger = logging.FileHandler(logging_path)
   file_logger.setFormatter(logging.Formatter(print_format))
   logger.addHandler(file_logger)
+  return logging_path
   
 
   
\ No newline at end of file
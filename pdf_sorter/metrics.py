@@ -0,0 +1,248 @@
+from collections import Counter
+from contextlib import contextmanager
+import csv
+import json
+import logging
+import resource
+import socket
+import threading
+import time
+
+logger = logging.getLogger('pdf_sorter')
+
+METRIC_PREFIX = 'pdf_sorter'
+PAGE_REPORT_FIELDS = ['page', 'source', 'dpi', 'render_seconds', 'ocr_seconds', 'width', 'height', 'confidence', 'duplicate_of']
+# Peak memory of this process (VmHWM), and how it is reset on Linux (see proc(5))
+PROCESS_STATUS_PATH = '/proc/self/status'
+CLEAR_REFS_PATH = '/proc/self/clear_refs'
+RESET_PEAK_RSS = '5'
+
+def timed_call(func, item):
+  """ Returns func(item) and how long it took in seconds. Runs on the OCR workers, so it is module level """
+  start_time = time.perf_counter()
+  result = func(item)
+  return result, time.perf_counter() - start_time
+
+
+def get_mean_confidence(confidences):
+  """ Mean tesseract confidence of the recognised words on a page (non-words are -1), or None if there were none """
+  word_confidences = [confidence for confidence in confidences if confidence >= 0]
+  if not word_confidences:
+    return None
+  return sum(word_confidences) / len(word_confidences)
+
+
+def reset_peak_rss():
+  """
+  Resets the peak resident memory of this process, so get_peak_rss_mb measures from now,
+  eg. for one stage of a benchmark. Only Linux can reset it, through /proc/self/clear_refs.
+  Returns False if the peak was not reset.
+  """
+  try:
+    with open(CLEAR_REFS_PATH, 'w') as clear_refs:
+      clear_refs.write(RESET_PEAK_RSS)
+  except OSError:
+    return False
+  return True
+
+
+def get_own_peak_rss_kb():
+  """ Peak resident memory of this process in KB, since it started or since reset_peak_rss """
+  try:
+    with open(PROCESS_STATUS_PATH, 'r') as status:
+      for line in status:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])
+  except OSError:
+    pass
+  # Also the peak since it started where the peak can't be reset
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def get_peak_rss_mb():
+  """
+  Peak resident memory of this process and of its finished children (OCR workers, poppler, tesseract), in MB.
+  The peak of the children can't be reset, so it is the largest of any child finished so far.
+  """
+  children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  return round(get_own_peak_rss_kb() / 1024, 1), round(children / 1024, 1)
+
+
+def get_metric_name(name):
+  return name.replace(' ', '_').replace('-', '_')
+
+
+class RunMetrics:
+  """
+  Timings and counts of a run, cheap enough to always collect.
+  * Stage totals in seconds, eg. extract, explore matrix and write. Stages can nest,
+    eg. the text layer and cache lookup happen during extract
+  * One row per OCR'd page (per pass for adaptive dpi) with its render time, OCR time,
+    rendered size and mean tesseract confidence; text layer and cached pages only
+    record their source, and duplicate pages the earlier page whose text they reuse
+  * The deepest and average OCR pool queue while pages were submitted
+  * Utilization of the render and OCR stages: the share of their available time
+    (a thread, or every OCR worker) spent working, so the saturated stage stands out
+  * Thread-safe, so batch and service jobs can each collect their own while sharing
+    a pool, and be merged into totals
+  """
+
+  def __init__(self):
+    self.started = time.time()
+    self.stages = Counter()
+    self.page_sources = Counter()
+    self.totals = Counter()
+    self.max_queue_depth = 0
+    self.busy_seconds = Counter()
+    self.available_seconds = Counter()
+    self.pages = []
+    self.duplicate_pages = []
+    self._lock = threading.Lock()
+
+  @contextmanager
+  def stage(self, stage_name):
+    start_time = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add_stage_time(stage_name, time.perf_counter() - start_time)
+
+  def add_stage_time(self, stage_name, seconds):
+    with self._lock:
+      self.stages[stage_name] += seconds
+
+  def record_queue_depth(self, queue_depth):
+    with self._lock:
+      self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+      self.totals['queue_depth'] += queue_depth
+      self.totals['queue_samples'] += 1
+
+  def record_utilization(self, stage_name, busy_seconds, available_seconds):
+    with self._lock:
+      self.busy_seconds[stage_name] += busy_seconds
+      self.available_seconds[stage_name] += available_seconds
+
+  def record_page(self, page, source, dpi=None, render_seconds=None, ocr_seconds=None, size=None, confidence=None, duplicate_of=None):
+    width, height = size or (None, None)
+    with self._lock:
+      self.page_sources[source] += 1
+      self.pages.append([page, source, dpi, render_seconds, ocr_seconds, width, height, confidence, duplicate_of])
+      if duplicate_of is not None:
+        self.duplicate_pages.append([page, duplicate_of])
+      self.totals['render_seconds'] += render_seconds or 0
+      self.totals['ocr_seconds'] += ocr_seconds or 0
+      if ocr_seconds is not None:
+        self.totals['ocr_passes'] += 1
+      if confidence is not None:
+        self.totals['confidence'] += confidence
+        self.totals['confidence_samples'] += 1
+
+  def time_images(self, images, render_info):
+    """
+    Yields the images, appending (render seconds, image size) of each to render_info.
+    Pages are rendered in windows as they are pulled, so the first page of a
+    window carries the time of rendering the whole window.
+    """
+    images = iter(images)
+    while True:
+      start_time = time.perf_counter()
+      try:
+        image = next(images)
+      except StopIteration:
+        return
+      render_info.append((time.perf_counter() - start_time, getattr(image, 'size', None)))
+      yield image
+
+  def merge(self, other):
+    """ Adds the totals of another run (but not its page rows or duplicate pages) to this one """
+    with self._lock:
+      self.stages.update(other.stages)
+      self.page_sources.update(other.page_sources)
+      self.totals.update(other.totals)
+      self.max_queue_depth = max(self.max_queue_depth, other.max_queue_depth)
+      self.busy_seconds.update(other.busy_seconds)
+      self.available_seconds.update(other.available_seconds)
+
+  def get_summary(self):
+    with self._lock:
+      totals = Counter(self.totals)
+      summary = {
+        'started': self.started,
+        'seconds': round(time.time() - self.started, 3),
+        'stages': {stage_name: round(seconds, 4) for stage_name, seconds in self.stages.items()},
+        'pages': dict(self.page_sources),
+        'duplicate_pages': list(self.duplicate_pages),
+        'max_queue_depth': self.max_queue_depth,
+        'utilization': {stage_name: round(min(1, self.busy_seconds[stage_name] / seconds), 3)
+          for stage_name, seconds in self.available_seconds.items() if seconds > 0}
+      }
+    ocr_passes = totals['ocr_passes']
+    peak_rss_mb, peak_children_rss_mb = get_peak_rss_mb()
+    summary.update({
+      'render_seconds': round(totals['render_seconds'], 4),
+      'ocr_seconds': round(totals['ocr_seconds'], 4),
+      'mean_render_seconds': round(totals['render_seconds'] / ocr_passes, 4) if ocr_passes else None,
+      'mean_ocr_seconds': round(totals['ocr_seconds'] / ocr_passes, 4) if ocr_passes else None,
+      'mean_confidence': round(totals['confidence'] / totals['confidence_samples'], 2) if totals['confidence_samples'] else None,
+      'mean_queue_depth': round(totals['queue_depth'] / totals['queue_samples'], 2) if totals['queue_samples'] else None,
+      'peak_rss_mb': peak_rss_mb,
+      'peak_children_rss_mb': peak_children_rss_mb
+    })
+    return summary
+
+  def write_report(self, report_path):
+    """
+    Saves the summary as <report_path>_report.json and the page rows as <report_path>_pages.csv.
+    Returns the path of the JSON report.
+    """
+    summary_path = report_path + '_report.json'
+    with open(summary_path, 'w') as summary_file:
+      json.dump(self.get_summary(), summary_file, indent=2)
+    with self._lock:
+      pages = list(self.pages)
+    with open(report_path + '_pages.csv', 'w', newline='') as pages_file:
+      writer = csv.writer(pages_file)
+      writer.writerow(PAGE_REPORT_FIELDS)
+      writer.writerows(pages)
+    logger.info("Run report saved to %s" % summary_path)
+    return summary_path
+
+  def to_prometheus(self):
+    """ Summary in the Prometheus text exposition format """
+    summary = self.get_summary()
+    lines = ['# TYPE %s_stage_seconds_total counter' % METRIC_PREFIX]
+    lines += ['%s_stage_seconds_total{stage="%s"} %s' % (METRIC_PREFIX, get_metric_name(stage_name), seconds)
+      for stage_name, seconds in sorted(summary['stages'].items())]
+    lines += ['# TYPE %s_pages_total counter' % METRIC_PREFIX]
+    lines += ['%s_pages_total{source="%s"} %d' % (METRIC_PREFIX, get_metric_name(source), count)
+      for source, count in sorted(summary['pages'].items())]
+    lines += ['# TYPE %s_stage_utilization gauge' % METRIC_PREFIX]
+    lines += ['%s_stage_utilization{stage="%s"} %s' % (METRIC_PREFIX, get_metric_name(stage_name), utilization)
+      for stage_name, utilization in sorted(summary['utilization'].items())]
+    for name in ['render_seconds', 'ocr_seconds']:
+      lines += ['# TYPE %s_%s_total counter' % (METRIC_PREFIX, name), '%s_%s_total %s' % (METRIC_PREFIX, name, summary[name])]
+    for name in ['max_queue_depth', 'peak_rss_mb', 'peak_children_rss_mb']:
+      lines += ['# TYPE %s_%s gauge' % (METRIC_PREFIX, name), '%s_%s %s' % (METRIC_PREFIX, name, summary[name])]
+    return '\n'.join(lines) + '\n'
+
+  def to_statsd(self):
+    """ Summary as StatsD lines: stage and per-page times in ms, page counts, and stage utilization and other gauges """
+    summary = self.get_summary()
+    lines = ['%s.stage.%s:%d|ms' % (METRIC_PREFIX, get_metric_name(stage_name), seconds * 1000) for stage_name, seconds in summary['stages'].items()]
+    lines += ['%s.pages.%s:%d|c' % (METRIC_PREFIX, get_metric_name(source), count) for source, count in summary['pages'].items()]
+    lines += ['%s.utilization.%s:%s|g' % (METRIC_PREFIX, get_metric_name(stage_name), utilization) for stage_name, utilization in summary['utilization'].items()]
+    for name in ['mean_render_seconds', 'mean_ocr_seconds']:
+      if summary[name] is not None:
+        lines.append('%s.%s:%d|ms' % (METRIC_PREFIX, name.replace('_seconds', ''), summary[name] * 1000))
+    for name in ['mean_confidence', 'max_queue_depth', 'peak_rss_mb']:
+      if summary[name] is not None:
+        lines.append('%s.%s:%s|g' % (METRIC_PREFIX, name, summary[name]))
+    return lines
+
+  def send_statsd(self, address):
+    """ Sends the summary to a StatsD server at (host, port) over UDP. Failures are logged, never raised """
+    try:
+      with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as statsd_socket:
+        statsd_socket.sendto('\n'.join(self.to_statsd()).encode(), address)
+    except OSError as error:
+      logger.warning("Could not send metrics to StatsD at %s:%d: %s" % (address[0], address[1], error))
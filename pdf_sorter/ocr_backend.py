@@ -0,0 +1,158 @@
+from functools import partial
+import logging
+import threading
+import pytesseract
+from pytesseract import Output
+from pdf_sorter import rasterizer
+
+logger = logging.getLogger('pdf_sorter')
+
+OCR_LANGUAGE = 'eng'
+
+AUTO = 'auto'
+PYTESSERACT = 'pytesseract'
+TESSEROCR = 'tesserocr'
+OCR_BACKENDS = [AUTO, PYTESSERACT, TESSEROCR]
+
+# Backend used by get_backend in this process, set in each OCR worker when it starts
+_selected_backend = PYTESSERACT
+# Engines are not thread safe, so each thread (eg. inline batch jobs) keeps its own
+_engines = threading.local()
+
+# Columns of pytesseract's image_to_data output
+OCR_DATA_COLUMNS = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num', 'left', 'top', 'width', 'height', 'conf', 'text']
+
+def is_tesserocr_available():
+  try:
+    import tesserocr
+  except ImportError:
+    return False
+  return True
+
+
+def resolve_backend_name(name=AUTO):
+  """ Backend to use for the requested name. auto is tesserocr when it is installed, otherwise pytesseract """
+  if name in (None, AUTO):
+    return TESSEROCR if is_tesserocr_available() else PYTESSERACT
+  return name
+
+
+def add_ocr_data_row(data, level, numbers, box, confidence=-1, text=''):
+  """ Appends a row to OCR data. numbers are the block, paragraph, line and word numbers, and box is (left, top, right, bottom) """
+  left, top, right, bottom = box
+  values = [level, 1] + numbers + [left, top, right - left, bottom - top, confidence, text]
+  for column, value in zip(OCR_DATA_COLUMNS, values):
+    data[column].append(value)
+
+
+class PytesseractBackend:
+  """
+  Runs the tesseract command for every image. Each call writes the image to a
+  temporary file, starts a new tesseract process and loads the language model.
+  A whole rendered page (a rasterizer.MappedPage) is read by tesseract from its
+  file instead, with no temporary copy.
+  """
+
+  name = PYTESSERACT
+
+  def image_to_data(self, image):
+    """ OCR data of the image (a PIL image or MappedPage) as a dict of columns (text, conf, block_num, left, ...) """
+    if isinstance(image, rasterizer.MappedPage) and image.whole_file:
+      return pytesseract.image_to_data(image.path, lang=OCR_LANGUAGE, output_type=Output.DICT)
+    with rasterizer.open_image(image) as pil_image:
+      return pytesseract.image_to_data(pil_image, lang=OCR_LANGUAGE, output_type=Output.DICT)
+
+  @staticmethod
+  def get_version():
+    try:
+      return str(pytesseract.get_tesseract_version())
+    except pytesseract.TesseractNotFoundError:
+      return 'unknown'
+
+
+class TesserocrBackend:
+  """
+  Keeps one initialized tesseract API in memory and reuses it for every image.
+  * The language model is loaded once, when the backend is created
+  * Images are passed to tesseract as raw pixel buffers, with no temporary files
+  * image_to_data returns the same rows as pytesseract: a row for the page, and for
+    the start of each block, paragraph and line (with empty text and a confidence
+    of -1), then one row per word. Text positions, and so criteria value indexes,
+    are the same with either backend
+  """
+
+  name = TESSEROCR
+
+  def __init__(self):
+    import tesserocr
+    self.tesserocr = tesserocr
+    self.api = tesserocr.PyTessBaseAPI(lang=OCR_LANGUAGE)
+
+  def set_image(self, image):
+    if image.mode not in ('L', 'RGB'):
+      image = image.convert('L')
+    bytes_per_pixel = 1 if image.mode == 'L' else 3
+    self.api.SetImageBytes(image.tobytes(), image.width, image.height, bytes_per_pixel, image.width * bytes_per_pixel)
+    dpi = image.info.get('dpi')
+    if dpi:
+      self.api.SetSourceResolution(int(dpi[0]))
+
+  def image_to_data(self, image):
+    """ OCR data of the image (a PIL image or MappedPage) as a dict of columns (text, conf, block_num, left, ...) """
+    RIL = self.tesserocr.RIL
+    data = {column: [] for column in OCR_DATA_COLUMNS}
+    add_row = partial(add_ocr_data_row, data)
+
+    with rasterizer.open_image(image) as pil_image:
+      self.set_image(pil_image)
+    self.api.Recognize()
+    add_row(1, [0, 0, 0, 0], (0, 0, image.width, image.height))
+    block_num = par_num = line_num = word_num = 0
+    for word in self.tesserocr.iterate_level(self.api.GetIterator(), RIL.WORD):
+      if word.Empty(RIL.WORD):
+        continue
+      if word.IsAtBeginningOf(RIL.BLOCK):
+        block_num, par_num, line_num = block_num + 1, 0, 0
+        add_row(2, [block_num, 0, 0, 0], word.BoundingBox(RIL.BLOCK))
+      if word.IsAtBeginningOf(RIL.PARA):
+        par_num, line_num = par_num + 1, 0
+        add_row(3, [block_num, par_num, 0, 0], word.BoundingBox(RIL.PARA))
+      if word.IsAtBeginningOf(RIL.TEXTLINE):
+        line_num, word_num = line_num + 1, 0
+        add_row(4, [block_num, par_num, line_num, 0], word.BoundingBox(RIL.TEXTLINE))
+      word_num += 1
+      add_row(5, [block_num, par_num, line_num, word_num], word.BoundingBox(RIL.WORD), word.Confidence(RIL.WORD), word.GetUTF8Text(RIL.WORD))
+    self.api.Clear()
+    return data
+
+  @staticmethod
+  def get_version():
+    import tesserocr
+    return tesserocr.tesseract_version().splitlines()[0]
+
+
+BACKEND_CLASSES = {PYTESSERACT: PytesseractBackend, TESSEROCR: TesserocrBackend}
+
+def set_backend(name):
+  """ Selects the backend get_backend returns in this process """
+  global _selected_backend
+  _selected_backend = resolve_backend_name(name)
+
+
+def get_backend():
+  """ The selected backend of this thread, created (eg. loading the language model) the first time it is used """
+  engines = _engines.__dict__
+  if _selected_backend not in engines:
+    logger.debug("Starting %s OCR backend" % _selected_backend)
+    engines[_selected_backend] = BACKEND_CLASSES[_selected_backend]()
+  return engines[_selected_backend]
+
+
+def start_worker(name):
+  """ OCR worker process initializer: selects the backend and starts it before the first page arrives """
+  set_backend(name)
+  get_backend()
+
+
+def get_version(name):
+  return BACKEND_CLASSES[resolve_backend_name(name)].get_version()
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger('pdf_sorter')
+
+DEFAULT_CACHE_DIRECTORY = 'output/cache'
+DEFAULT_CACHE_SIZE_MB = 512
+# Eviction frees a little more than needed so it doesn't run again on the next write
+EVICTION_TARGET_RATIO = 0.9
+
+class OcrCache:
+  """
+  Persistent, content-addressed cache of the text extracted from document pages.
+  * Entries are keyed by the page content fingerprint plus every setting that
+    changes the OCR output (eg. dpi, quadrants, tesseract language and version)
+  * Each entry is a small JSON file, sharded into subdirectories by key prefix
+  * Reading an entry marks it as recently used; once the cache grows past
+    max_size_mb the least recently used entries are evicted
+  * One cache can be shared by several threads (eg. batch jobs)
+  """
+
+  def __init__(self, cache_directory=DEFAULT_CACHE_DIRECTORY, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+    self.cache_directory = cache_directory
+    self.max_size_bytes = max_size_mb * 1024 * 1024
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+    os.makedirs(cache_directory, exist_ok=True)
+    self._entry_sizes = {path: os.path.getsize(path) for path in self.get_entry_paths()}
+    self._size_bytes = sum(self._entry_sizes.values())
+
+  @staticmethod
+  def get_key(page_fingerprint, ocr_settings):
+    """ ocr_settings is a JSON serializable dict of every setting that changes the OCR output """
+    settings = json.dumps([page_fingerprint, ocr_settings], sort_keys=True)
+    return hashlib.sha256(settings.encode()).hexdigest()
+
+  def get_entry_path(self, key):
+    return os.path.join(self.cache_directory, key[:2], key + '.json')
+
+  def get_entry_paths(self):
+    for directory, _, filenames in os.walk(self.cache_directory):
+      for filename in filenames:
+        if filename.endswith('.json'):
+          yield os.path.join(directory, filename)
+
+  def get(self, key):
+    """ Returns the cached page text for the key, or None if it is not cached """
+    entry_path = self.get_entry_path(key)
+    try:
+      with open(entry_path, 'r') as entry:
+        page_text = json.load(entry)
+      os.utime(entry_path)
+    except (OSError, ValueError):
+      self.misses += 1
+      return None
+    self.hits += 1
+    return page_text
+
+  def put(self, key, page_text):
+    entry_path = self.get_entry_path(key)
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    # Write to a temporary file first so an interrupted run never leaves a partial entry
+    temp_path = '%s.%d.tmp' % (entry_path, threading.get_ident())
+    with open(temp_path, 'w') as entry:
+      json.dump(page_text, entry)
+    os.replace(temp_path, entry_path)
+
+    entry_size = os.path.getsize(entry_path)
+    with self._lock:
+      self._size_bytes += entry_size - self._entry_sizes.get(entry_path, 0)
+      self._entry_sizes[entry_path] = entry_size
+      if self._size_bytes > self.max_size_bytes:
+        self.evict()
+
+  def evict(self):
+    """
+    Removes least recently used entries until the cache is back under its size limit.
+    Called with the cache lock held.
+    """
+    target_size = self.max_size_bytes * EVICTION_TARGET_RATIO
+    entries = sorted(self._entry_sizes, key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+    for entry_path in entries:
+      if self._size_bytes <= target_size:
+        break
+      logger.debug("Evicting OCR cache entry %s" % entry_path)
+      if os.path.exists(entry_path):
+        os.remove(entry_path)
+      self._size_bytes -= self._entry_sizes.pop(entry_path)
@@ -0,0 +1,75 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import threading
+from pdf_sorter import ocr_backend
+
+logger = logging.getLogger('pdf_sorter')
+
+def default_worker_count():
+  """ Number of OCR workers to use when none is requested: one per available core """
+  return os.cpu_count() or 1
+
+
+class OcrWorkerPool:
+  """
+  Ordered pool of OCR worker processes.
+  * Pages are submitted to the workers as they arrive from the input iterable
+  * At most max_in_flight pages are queued or running at any time, so a slow
+    OCR stage does not cause the whole document to be pulled into memory
+  * Results are always yielded in the original page order
+  * A pool with a single worker runs inline in the calling process
+  * Several threads (eg. batch jobs) can map over the same pool at once, sharing its workers
+  * Each worker selects and starts the OCR backend (see ocr_backend) when it starts,
+    and keeps it for every page it OCRs
+  """
+
+  def __init__(self, workers=None, max_in_flight=None, backend=ocr_backend.AUTO):
+    self.workers = workers or default_worker_count()
+    self.max_in_flight = max_in_flight or self.workers * 2
+    self.ocr_backend = ocr_backend.resolve_backend_name(backend)
+    self._executor = None
+    self._lock = threading.Lock()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def _get_executor(self):
+    with self._lock:
+      if self._executor is None:
+        logger.debug("Starting OCR pool with %d workers using %s" % (self.workers, self.ocr_backend))
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=ocr_backend.start_worker, initargs=(self.ocr_backend,))
+      return self._executor
+
+  def map(self, func, items, run_metrics=None):
+    """
+    Apply func to every item using the pool, yielding results in input order.
+    If run_metrics are provided, the queue depth is recorded as each item is submitted.
+    """
+    if self.workers == 1:
+      ocr_backend.set_backend(self.ocr_backend)
+      for item in items:
+        yield func(item)
+      return
+
+    executor = self._get_executor()
+    pending = deque()
+    for item in items:
+      pending.append(executor.submit(func, item))
+      if run_metrics is not None:
+        run_metrics.record_queue_depth(len(pending))
+      if len(pending) >= self.max_in_flight:
+        yield pending.popleft().result()
+
+    while pending:
+      yield pending.popleft().result()
+
+  def close(self):
+    with self._lock:
+      if self._executor is not None:
+        self._executor.shutdown()
+        self._executor = None
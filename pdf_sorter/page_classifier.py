@@ -0,0 +1,30 @@
+import logging
+from pdf_sorter import rasterizer
+
+logger = logging.getLogger('pdf_sorter')
+
+# Gray level (0-255) below which a pixel counts as ink
+INK_LEVEL = 128
+# Share of ink pixels at or below which a page is blank when --drop-blank is used without --blank-ink.
+# A single short line of text on a letter page at 300 dpi is around 0.1%
+DEFAULT_BLANK_INK_RATIO = 0.0005
+
+def get_ink_ratio(image):
+  """
+  Share of the pixels of a rendered page (a PIL image or rasterizer.MappedPage) darker
+  than INK_LEVEL. Counted from the grayscale histogram of the full resolution image, as
+  shrinking the page first would fade thin strokes of text below the ink level.
+  """
+  with rasterizer.open_image(image) as pil_image:
+    if pil_image.mode != 'L':
+      pil_image = pil_image.convert('L')
+    histogram = pil_image.histogram()
+  pixel_count = sum(histogram)
+  if not pixel_count:
+    return 0
+  return sum(histogram[:INK_LEVEL]) / pixel_count
+
+
+def is_blank_page(image, max_ink_ratio=DEFAULT_BLANK_INK_RATIO):
+  """ Whether a rendered page has too little ink to hold any text worth OCRing, eg. a separator page """
+  return get_ink_ratio(image) <= max_ink_ratio
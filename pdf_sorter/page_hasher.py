@@ -0,0 +1,107 @@
+import hashlib
+from io import BytesIO
+import logging
+from PyPDF2 import PdfFileReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+from pdf_sorter.pdf_writer import OBJECT_HEADER, RawSource, scan_object_body
+
+logger = logging.getLogger('pdf_sorter')
+
+# Page attributes that determine how a page looks once rendered
+FINGERPRINT_PAGE_KEYS = ['/Contents', '/Resources', '/MediaBox', '/CropBox', '/Rotate']
+
+class PageHasher:
+  """
+  Computes content fingerprints of PDF pages from their raw objects, without rendering.
+  * Pages with identical content streams, images, fonts and page boxes have the
+    same fingerprint, even across different files
+  * Stream data is hashed as stored in the file (no decoding of image streams)
+  * Indirect objects shared between pages (eg. fonts) are only hashed once per document
+  * Given a RawSource, objects are hashed straight from the memory map of the file,
+    like pdf_writer copies them, so image streams are never parsed or cached by the reader
+  """
+
+  def __init__(self, source=None):
+    self._object_digests = {}
+    self._source = source
+
+  def get_object_digest(self, obj):
+    if isinstance(obj, IndirectObject):
+      object_id = (obj.idnum, obj.generation)
+      if object_id not in self._object_digests:
+        # Placeholder guards against reference cycles while the object is hashed
+        self._object_digests[object_id] = b''
+        if self._source is not None and self._source.has_object(obj.idnum, obj.generation):
+          self._object_digests[object_id] = self.get_raw_object_digest(obj.idnum, obj.generation)
+        else:
+          self._object_digests[object_id] = self.get_object_digest(obj.getObject())
+      return self._object_digests[object_id]
+
+    digest = hashlib.sha256(type(obj).__name__.encode())
+    if isinstance(obj, StreamObject):
+      digest.update(obj._data)
+    if isinstance(obj, DictionaryObject):
+      for key in sorted(obj.keys()):
+        digest.update(key.encode())
+        digest.update(self.get_object_digest(obj.raw_get(key)))
+    elif isinstance(obj, ArrayObject):
+      for item in obj:
+        digest.update(self.get_object_digest(item))
+    else:
+      serialized = BytesIO()
+      obj.writeToStream(serialized, None)
+      digest.update(serialized.getvalue())
+    return digest.digest()
+
+  def get_raw_object_digest(self, idnum, generation):
+    """ Digest of the bytes of a source object, with the digest of each object it references in place of the reference """
+    source = self._source
+    body_start = OBJECT_HEADER.match(source.data, source.offsets[(idnum, generation)]).end()
+    body_end, keyword, references = scan_object_body(source.data, body_start)
+
+    digest = hashlib.sha256(b'RawObject')
+    position = body_start
+    for start, end, reference_idnum, reference_generation in references:
+      digest.update(source.view[position:start])
+      # References back to the page tree (eg. an annotation's page) would pull in every page
+      if (reference_idnum, reference_generation) not in source.page_tree:
+        digest.update(self.get_object_digest(IndirectObject(reference_idnum, reference_generation, source.reader)))
+      position = end
+    digest.update(source.view[position:body_end])
+    if keyword == b'stream':
+      stream_start, stream_end = source.get_stream_range(source.data[body_start:body_end], body_end)
+      digest.update(source.view[stream_start:stream_end])
+    return digest.digest()
+
+  def get_page_fingerprint(self, page):
+    digest = hashlib.sha256()
+    for key in FINGERPRINT_PAGE_KEYS:
+      if key in page:
+        digest.update(key.encode())
+        digest.update(self.get_object_digest(page.raw_get(key)))
+    return digest.hexdigest()
+
+
+def get_page_fingerprints(pdf_path, first_page=0, last_page=None):
+  """
+  Returns the content fingerprint of each page of the document, in page order.
+  Only pages first_page to last_page (0-based, exclusive) are hashed if given, eg. for a shard.
+  * Memory use is bounded by the largest page, not by the document: objects are hashed
+      from a memory map of the file, and anything the reader did parse (eg. the streams
+      of an encrypted file) is dropped from its cache after each page
+  """
+  with open(pdf_path, 'rb') as pdf_file:
+    reader = PdfFileReader(pdf_file, strict=False)
+    source = RawSource.open(reader)
+    hasher = PageHasher(source)
+    last_page = reader.getNumPages() if last_page is None else min(last_page, reader.getNumPages())
+    fingerprints = []
+    try:
+      for page_index in range(first_page, last_page):
+        fingerprints.append(hasher.get_page_fingerprint(reader.getPage(page_index)))
+        # Every object of the page is hashed, and its digest kept, so none is read again
+        reader.resolvedObjects.clear()
+    finally:
+      if source is not None:
+        source.close()
+    return fingerprints
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import os
+from typing import OrderedDict
+
+logger = logging.getLogger('pdf_sorter')
+
+INDEX_VERSION = 2
+INDEX_EXTENSION = '.sort_index.json'
+FILE_HASH_CHUNK_SIZE = 1024 * 1024
+
+def get_index_path(pdf_paths):
+  """ Sidecar index of the input file(s), saved next to the first input PDF """
+  return os.path.splitext(pdf_paths[0])[0] + INDEX_EXTENSION
+
+
+def get_file_fingerprint(pdf_path):
+  file_hash = hashlib.sha256()
+  with open(pdf_path, 'rb') as pdf_file:
+    for chunk in iter(lambda: pdf_file.read(FILE_HASH_CHUNK_SIZE), b''):
+      file_hash.update(chunk)
+  return file_hash.hexdigest()
+
+
+def get_indexed_files(pdf_paths, page_counts=None, indexed_files=None):
+  """
+  Name, size, modified time, sha256 (and page count, if provided) of each input file, as saved in the index.
+  * The sha256 of a file already in indexed_files with the same name, size and modified time
+      is reused, like the journal header does, so unchanged files are never read
+  * Only new or changed files are hashed
+  """
+  indexed_files = indexed_files or []
+  files = []
+  for position, pdf_path in enumerate(pdf_paths):
+    stat = os.stat(pdf_path)
+    indexed_file = {'name': os.path.basename(pdf_path), 'size': stat.st_size, 'modified': stat.st_mtime_ns}
+    previous_file = indexed_files[position] if position < len(indexed_files) else {}
+    if previous_file.get('sha256') and all(previous_file.get(key) == value for key, value in indexed_file.items()):
+      indexed_file['sha256'] = previous_file['sha256']
+    else:
+      indexed_file['sha256'] = get_file_fingerprint(pdf_path)
+    if page_counts is not None:
+      indexed_file['page_count'] = page_counts[position]
+    files.append(indexed_file)
+  return files
+
+
+def get_index_settings(args, sort_target=None):
+  """
+  Every argument the extracted values depend on. An index is only reused with the same settings.
+  The criteria key and value index are those of the sort target, if one is provided.
+  """
+  settings = {
+    'criteria': sort_target.criteria if sort_target else args.criteria,
+    'index': sort_target.index if sort_target else args.index,
+    'multipage': args.multipage,
+    'quadrant': sorted(args.quadrant),
+    'dpi': args.dpi,
+    'adaptive_dpi': args.adaptive_dpi,
+    'min_confidence': args.min_confidence,
+    'text_layer': args.text_layer,
+    'targeted': args.targeted
+  }
+  if args.blank_ink is not None or args.drop_blank:
+    settings.update({'blank_ink': args.blank_ink, 'drop_blank': args.drop_blank})
+  return settings
+
+
+def read_index(index_path):
+  try:
+    with open(index_path, 'r') as index_file:
+      return json.load(index_file)
+  except (OSError, ValueError):
+    return None
+
+
+def save_index(document, value_page_lookup, settings):
+  """ Saves the values extracted from a document with the given settings. See save_indexes """
+  return save_indexes(document, [(settings, value_page_lookup)])
+
+
+def save_indexes(document, lookups):
+  """
+  Saves the values extracted from a document, mapped to their (global, 0-based) pages,
+  as a sidecar index next to the input. lookups are (settings, value_page_lookup) of
+  each sort, eg. one per criteria key.
+  * Values saved by an earlier sort of the same files with other settings (eg. another
+    criteria key) are kept, so the index can serve either sort
+  * Failing to save (eg. a read-only input directory) only logs a warning
+  Returns the index path.
+  """
+  index_path = get_index_path(document.pdf_paths)
+  previous_index = read_index(index_path) or {}
+  sources = document.get_sources()
+  files = get_indexed_files([pdf_path for pdf_path, _, _ in sources], [page_count for _, _, page_count in sources],
+    previous_index.get('files') if previous_index.get('version') == INDEX_VERSION else None)
+  saved_lookups = [{'settings': settings, 'values': list(value_page_lookup.items())} for settings, value_page_lookup in lookups]
+
+  if previous_index.get('version') == INDEX_VERSION and previous_index.get('files') == files:
+    new_settings = [settings for settings, _ in lookups]
+    saved_lookups += [lookup for lookup in previous_index['lookups'] if lookup['settings'] not in new_settings]
+
+  index = {
+    'version': INDEX_VERSION,
+    'files': files,
+    'lookups': saved_lookups
+  }
+  try:
+    with open(index_path, 'w') as index_file:
+      json.dump(index, index_file)
+  except OSError as error:
+    logger.warning("Could not save sort index %s: %s" % (index_path, error))
+    return None
+  logger.info("Saved sort index %s" % index_path)
+  return index_path
+
+
+def load_index(pdf_paths, settings):
+  """ Returns (value_page_lookup, page_counts) of one sort from the sidecar index, or None. See load_indexes """
+  return load_indexes(pdf_paths, [settings])[0]
+
+
+def load_indexes(pdf_paths, settings_list):
+  """
+  Returns (value_page_lookup, page_counts) from the sidecar index of the input file(s) for
+  each of settings_list, eg. one per criteria key.
+  * None for settings the index has no values for, or for every settings if there is
+      no index, or it was built from different files
+  * The index is read and the input files checked against it once, however many settings
+  """
+  index_path = get_index_path(pdf_paths)
+  index = read_index(index_path)
+  if index is None:
+    logger.warning("No sort index found at %s" % index_path)
+    return [None] * len(settings_list)
+
+  index_lookups = index.get('lookups', []) if index.get('version') == INDEX_VERSION else []
+  lookups = [next((lookup for lookup in index_lookups if lookup['settings'] == settings), None) for settings in settings_list]
+  if None in lookups:
+    logger.warning("Sort index %s was built with different settings" % index_path)
+  if not any(lookups):
+    return [None] * len(settings_list)
+  same_files = len(index['files']) == len(pdf_paths)
+  if same_files:
+    input_files = get_indexed_files(pdf_paths, indexed_files=index['files'])
+    same_files = [indexed_file['sha256'] for indexed_file in index['files']] == [input_file['sha256'] for input_file in input_files]
+  if not same_files:
+    logger.warning("Sort index %s was built from different input files" % index_path)
+    return [None] * len(settings_list)
+
+  logger.info("Loaded sort index %s" % index_path)
+  page_counts = [indexed_file['page_count'] for indexed_file in index['files']]
+  return [(OrderedDict((value, page_indexes) for value, page_indexes in lookup['values']), page_counts) if lookup else None
+    for lookup in lookups]
@@ -1,12 +1,37 @@
+from collections import Counter, deque
+from contextlib import ExitStack
+from functools import partial
 import logging
-import pytesseract
-from pdf2image import pdfinfo_from_path, convert_from_path
-from PyPDF2 import PdfFileWriter, PdfFileReader
-from pytesseract import Output
+import tempfile
+import time
+from PyPDF2 import PdfFileReader
+from pdf_sorter import metrics
+from pdf_sorter import ocr_backend
+from pdf_sorter import ocr_pool
+from pdf_sorter import page_classifier
+from pdf_sorter import page_hasher
+from pdf_sorter import pdf_writer
+from pdf_sorter import rasterizer
+from pdf_sorter import stage_queue
+from pdf_sorter import text_layer
+from pdf_sorter import virtual_document
 from typing import OrderedDict
 
 logger = logging.getLogger('pdf_sorter')
 
+OCR_LANGUAGE = ocr_backend.OCR_LANGUAGE
+DEFAULT_MIN_CONFIDENCE = 60
+# Padding around a learned key region, as a ratio of the page size
+KEY_REGION_PADDING = 0.02
+# Stages a rendered page is held in, each bounded by the page budget: the window being
+# rendered, the queue waiting for the OCR pool, and the pool's pages in flight
+RENDERED_PAGE_STAGES = 3
+
+def get_max_rendered_pages(page_budget):
+  """ Most rendered pages one extraction holds at once (see PageTextExtractor.ocr_pages) """
+  return RENDERED_PAGE_STAGES * page_budget
+
+
 def get_crop_height_ratio(quadrants):
   top = False
   bottom = False
@@ -41,29 +66,93 @@ def get_crop_width_ratio(quadrants):
     return (0 if left else 0.5, 1 if right else 0.5)
 
 
-def convert_document_to_images(pdf_path, dpi, quadrants):
-  page_count = pdfinfo_from_path(pdf_path)["Pages"]
+def convert_document_to_images(pdf_path, dpi, quadrants, page_budget=rasterizer.DEFAULT_PAGE_BUDGET, render_threads=rasterizer.DEFAULT_RENDER_THREADS, page_numbers=None):
+  """
+  Returns a generator of the document pages as cropped images. Pages are rendered
+  in bounded windows as they are consumed, rather than all at once. When quadrants
+  are selected only that region of each page is rendered. If page_numbers (1-based)
+  are provided only those pages are rendered.
+  """
   crop_height = get_crop_height_ratio(quadrants)
   crop_width = get_crop_width_ratio(quadrants)
-  return (page.crop((page.width*crop_width[0], page.height*crop_height[0], page.width*crop_width[1], page.height*crop_height[1])) for page in convert_from_path(pdf_path,dpi=dpi, thread_count=page_count))
+  if crop_height == (0, 1) and crop_width == (0, 1):
+    return rasterizer.render_pages(pdf_path, dpi, page_budget, render_threads, page_numbers)
+  return rasterizer.render_page_regions(pdf_path, dpi, crop_width, crop_height, page_budget, render_threads, page_numbers)
+
 
+def convert_document_to_mapped_pages(pdf_path, dpi, quadrants, raster_directory, page_budget=rasterizer.DEFAULT_PAGE_BUDGET,
+    render_threads=rasterizer.DEFAULT_RENDER_THREADS, page_numbers=None):
+  """
+  Same as convert_document_to_images, but yields each page as a grayscale rasterizer.MappedPage
+  in raster_directory, which OCR worker processes open without it being copied or pickled
+  """
+  return rasterizer.render_mapped_pages(pdf_path, dpi, get_crop_width_ratio(quadrants), get_crop_height_ratio(quadrants),
+    raster_directory, page_budget, render_threads, page_numbers)
 
-def extract_key_values_from_images(images, criteria_key, value_index, multi_page):
+
+def extract_key_values_from_images(images, criteria_key, value_index, multi_page, pool=None):
     """
-    Returns a dict of extracted values mapped to their page number
+    Returns a dict of extracted values mapped to their page number.
+    Pages are OCR'd in parallel by the worker pool; results come back in
+    page order so multi-page values are attached to the correct previous page.
     """
     logger.info("Extracting %s from images" % criteria_key)
-    value_page_map = OrderedDict()
-    previous_value = ''
+    return extract_key_values_from_text(extract_text_from_images(images, pool), criteria_key, value_index, multi_page)
 
-    for page_index, page in enumerate(images):
-        extracted_text = extract_text_from_image(page)
-        
-        if criteria_key in extracted_text:
-            criteria_index = extracted_text.index(criteria_key)
-            criteria_value = extracted_text[criteria_index + value_index]
-            
-            logger.info("%d: Extracted %s value %s from image" % (page_index, criteria_key, criteria_value))
+
+def extract_key_values_from_text(extracted_text_pages, criteria_key, value_index, multi_page):
+    """
+    Returns a dict of extracted values mapped to their page number, from the
+    text of each page in page order (OCR or text layer)
+    """
+    page_values = (get_page_value(extracted_text, criteria_key, value_index) for extracted_text in extracted_text_pages)
+    return build_value_page_map(page_values, criteria_key, multi_page)
+
+
+def get_page_value(extracted_text, criteria_key, value_index):
+    """ The criteria value in the text of a page, or None if the criteria key isn't found """
+    if criteria_key not in extracted_text:
+        return None
+    criteria_index = extracted_text.index(criteria_key)
+    return extracted_text[criteria_index + value_index]
+
+
+def build_value_page_map(page_values, criteria_key, multi_page):
+    """
+    Returns a dict of values mapped to their page number, from the criteria value
+    (or None) of each page in page order
+    """
+    return build_value_page_maps(([criteria_value] for criteria_value in page_values), [criteria_key], multi_page)[0]
+
+
+def get_page_values(extracted_text, sort_targets, drop_blank=False):
+    """
+    The value (or None) of each sort target's criteria key in the text of a page.
+    If drop_blank is set, a blank page (with no text at all) is None instead, to leave it out of every output
+    """
+    if drop_blank and not extracted_text:
+      return None
+    return [get_page_value(extracted_text, target.criteria, target.index) for target in sort_targets]
+
+
+def build_value_page_maps(page_values, criteria_keys, multi_page):
+    """
+    Returns a dict of values mapped to their page number for each criteria key, in a single
+    pass over the values of each page in page order. page_values yields a list per page,
+    with the value (or None) of each criteria key on that page, or None for a page to
+    leave out of every map (eg. a dropped blank page).
+    """
+    value_page_maps = [OrderedDict() for _ in criteria_keys]
+    previous_values = [''] * len(criteria_keys)
+
+    for page_index, criteria_values in enumerate(page_values):
+      if criteria_values is None:
+        logger.info("Dropping blank page %d" % page_index)
+        continue
+      for key_number, (criteria_key, criteria_value, value_page_map) in enumerate(zip(criteria_keys, criteria_values, value_page_maps)):
+
+        if criteria_value is not None:
+            logger.info("%d: Extracted %s value %s from page" % (page_index, criteria_key, criteria_value))
             
             if value_page_map.get(criteria_value):
                 logger.info("Found duplicate %s value %s, including page %d" % (criteria_key, criteria_value, page_index))
@@ -71,59 +160,494 @@ def extract_key_values_from_images(images, criteria_key, value_index, multi_page
             
             else:
                 value_page_map[criteria_value]= [page_index]
-            previous_value = criteria_value
+            previous_values[key_number] = criteria_value
         
         elif not multi_page or page_index == 0:
           logger.warning("Could not find %s on page %d. Discarding page." % (criteria_key, page_index))
         
         elif multi_page:
-            logger.info("Detected possible multi-page. Assuming page %d is connected to order %s" %
-                  (page_index, previous_value))
-            value_page_map[previous_value].append(page_index)
+            logger.info("Detected possible multi-page. Assuming page %d is connected to %s %s" %
+                  (page_index, criteria_key, previous_values[key_number]))
+            value_page_map[previous_values[key_number]].append(page_index)
       
-    return value_page_map
+    return value_page_maps
 
 
-def generate_sorted_document(pdf_path, value_page_lookup, new_sort_list, output_filename): 
+def generate_sorted_document(document, value_page_lookup, new_sort_list, output_filename, chunk_size=None):
     """
     Sorts the original document(s) based on the provided sort list, and the map of values to
-    page numbers scraped from the document. Saves the newly sorted file to '/output' directory
+    page numbers scraped from the document. Saves the newly sorted file to '/output' directory.
+    document is either a VirtualDocument of several files, or the path of a single PDF. Pages
+    are copied straight from the original files and streamed to the output as they are placed.
+    With chunk_size, a new output file is started every chunk_size pages.
+    Returns the path(s) of the sorted file(s).
     """
-    current_value_order = value_page_lookup.keys()
-    
-    logger.info("Current Order List:")
-    logger.info(current_value_order)
-    logger.info("Modified Order List:")
-    logger.info(new_sort_list)
-
-    if len(new_sort_list) != len(current_value_order):
-        logger.warning("The number of criteria values in the sorted list doesn't match the PDF(s). Is that expected? PDF Order Count = %d; Text File Order Count = %d" % (
-            len(current_value_order), len(new_sort_list)))
-
-    with open(pdf_path, "rb") as original_pdf:
-      unsorted_pdf_file = PdfFileReader(original_pdf)
-      pdf_writer = PdfFileWriter()
-
-      for value in new_sort_list:
-          matched_pages = value_page_lookup.get(value)
-          
-          if matched_pages:
-          
-              for page_number in matched_pages:
-                  pdf_writer.addPage(unsorted_pdf_file.getPage(page_number))
-          
-          else:
-              logger.warning("Missing value # %s in PDF file" % (value))
-
-      with open(output_filename, 'wb') as sorted_pdf_file:
-          pdf_writer.write(sorted_pdf_file)
-      
-      sorted_pdf_file.close()
-    original_pdf.close()
+    return generate_sorted_documents(document, [(value_page_lookup, new_sort_list, output_filename)], chunk_size)[0]
+
+
+def generate_sorted_documents(document, sorted_outputs, chunk_size=None):
+    """
+    Writes several sorted copies of the original document(s), one per (value_page_lookup,
+    new_sort_list, output_filename) in sorted_outputs, as generate_sorted_document does.
+    The original files are opened and parsed once, and every output is copied from them.
+    Returns the path(s) of the sorted file(s) of each output.
+    """
+    document = virtual_document.as_virtual_document(document)
+    output_paths = []
+
+    with ExitStack() as original_pdfs:
+      unsorted_pdf_files = {pdf_path: PdfFileReader(original_pdfs.enter_context(open(pdf_path, "rb"))) for pdf_path in document.pdf_paths}
+
+      for value_page_lookup, new_sort_list, output_filename in sorted_outputs:
+        current_value_order = value_page_lookup.keys()
+
+        logger.info("Current Order List:")
+        logger.info(current_value_order)
+        logger.info("Modified Order List:")
+        logger.info(new_sort_list)
+
+        if len(new_sort_list) != len(current_value_order):
+            logger.warning("The number of criteria values in the sorted list doesn't match the PDF(s). Is that expected? PDF Order Count = %d; Text File Order Count = %d" % (
+                len(current_value_order), len(new_sort_list)))
+
+        with pdf_writer.ChunkedPdfWriter(output_filename, chunk_size) as sorted_pdf_writer:
+          for value in new_sort_list:
+              matched_pages = value_page_lookup.get(value)
+              
+              if matched_pages:
+              
+                  for page_number in matched_pages:
+                      pdf_path, local_page_number = document.get_source_page(page_number)
+                      sorted_pdf_writer.add_page(unsorted_pdf_files[pdf_path], local_page_number)
+              
+              else:
+                  logger.warning("Missing value # %s in PDF file" % (value))
+
+        logger.info("New sorted file(s) created: %s" % (', '.join(sorted_pdf_writer.output_paths)))
+        output_paths.append(sorted_pdf_writer.output_paths)
 
-    logger.info("New sorted file created: %s" % (output_filename))
+    return output_paths
+
+
+def extract_text_from_images(images, pool=None):
+    """
+    Yields the OCR text of each image, in page order, using the provided worker pool.
+    A temporary pool with the default number of workers is used if none is provided.
+    """
+    yield from map_images_on_pool(extract_text_from_image, images, pool)
+
+
+def map_images_on_pool(func, images, pool=None, run_metrics=None):
+    if pool is not None:
+      yield from pool.map(func, images, run_metrics)
+      return
+
+    with ocr_pool.OcrWorkerPool() as default_pool:
+      yield from default_pool.map(func, images, run_metrics)
 
 
 def extract_text_from_image(image):
-    return pytesseract.image_to_data(image, lang='eng', output_type=Output.DICT).get('text')
+    """ Returns the OCR text of the image, using the OCR backend of this worker (see ocr_backend) """
+    return ocr_backend.get_backend().image_to_data(image).get('text')
+
+
+def extract_ocr_data_from_image(image):
+    """ Returns the OCR text of the image, and tesseract's confidence (0-100, -1 for non-words) in each item """
+    data = ocr_backend.get_backend().image_to_data(image)
+    return data.get('text'), [float(confidence) for confidence in data.get('conf')]
+
+
+def track_in_flight(images, in_flight):
+    """ Passes on each image, keeping it in the in_flight queue until its OCR result is back """
+    for image in images:
+      in_flight.append(image)
+      yield image
+
+
+def get_value_position(extracted_text, criteria_key, value_index):
+    """ Returns the index of the criteria value in the page text, or None if the key or value is missing """
+    if criteria_key not in extracted_text:
+      return None
+    value_position = extracted_text.index(criteria_key) + value_index
+    if value_position < 0 or value_position >= len(extracted_text) or not extracted_text[value_position]:
+      return None
+    return value_position
+
+
+def is_confident_match(extracted_text, confidences, criteria_key, value_index, min_confidence):
+    """
+    Checks that the criteria key and its value were both found on the page,
+    and that tesseract is at least min_confidence sure of the value
+    """
+    value_position = get_value_position(extracted_text, criteria_key, value_index)
+    return value_position is not None and confidences[value_position] >= min_confidence
+
+
+def get_key_region(data, image_size, criteria_key, value_index):
+    """
+    Returns the region of the image around the criteria key and its value, from the
+    word bounding boxes returned by image_to_data, as (left, top, right, bottom) ratios
+    of the image size. The region is padded on every side, and extended to the right
+    to leave room for longer values. Returns None if the key and value are not on the
+    same line, as the value index would not hold for text OCR'd from the region alone.
+    """
+    extracted_text = data.get('text')
+    value_position = get_value_position(extracted_text, criteria_key, value_index)
+    if value_position is None:
+      return None
+    key_position = extracted_text.index(criteria_key)
+    line_of = lambda position: (data['block_num'][position], data['par_num'][position], data['line_num'][position])
+    if line_of(key_position) != line_of(value_position):
+      return None
+
+    positions = [key_position, value_position]
+    left = min(data['left'][position] for position in positions)
+    top = min(data['top'][position] for position in positions)
+    right = max(data['left'][position] + data['width'][position] for position in positions)
+    bottom = max(data['top'][position] + data['height'][position] for position in positions)
+    right += right - left
+
+    image_width, image_height = image_size
+    return (
+      max(0, left / image_width - KEY_REGION_PADDING),
+      max(0, top / image_height - KEY_REGION_PADDING),
+      min(1, right / image_width + KEY_REGION_PADDING),
+      min(1, bottom / image_height + KEY_REGION_PADDING)
+    )
+
+
+def extract_targeted_ocr_data_from_image(task):
+    """
+    Worker function for targeted OCR. task is (image, key_region, criteria_key, value_index).
+    * If a key region is provided, only that crop of the image is OCR'd first, and its text
+      is used if the criteria key and value are found in it
+    * Otherwise, or on a miss, the whole image is OCR'd and the region around the key is
+      returned so later pages can be targeted
+    Returns (text, confidences, key_region, region_hit)
+    """
+    image, key_region, criteria_key, value_index = task
+    if key_region is not None:
+      width, height = image.size
+      crop = image.crop((width*key_region[0], height*key_region[1], width*key_region[2], height*key_region[3]))
+      extracted_text, confidences = extract_ocr_data_from_image(crop)
+      if get_value_position(extracted_text, criteria_key, value_index) is not None:
+        return extracted_text, confidences, key_region, True
+
+    data = ocr_backend.get_backend().image_to_data(image)
+    confidences = [float(confidence) for confidence in data.get('conf')]
+    return data.get('text'), confidences, get_key_region(data, image.size, criteria_key, value_index), False
+
+
+def skip_blank_page(func, max_ink_ratio, task):
+    """
+    Worker function that returns func(task), eg. the OCR data of a page, or None without
+    running tesseract if the page is blank (see page_classifier). task is an image, or a
+    tuple starting with one
+    """
+    image = task[0] if isinstance(task, tuple) else task
+    if page_classifier.is_blank_page(image, max_ink_ratio):
+      return None
+    return func(task)
+
+
+def get_tesseract_version(backend=ocr_backend.PYTESSERACT):
+    return ocr_backend.get_version(backend)
+
+
+class PageTextExtractor:
+  """
+  Extracts the text of every page of a document, in page order.
+  * If use_text_layer is set, pages whose embedded text layer contains the criteria
+    key use that text directly and are never rendered
+  * If a cache is provided, pages OCR'd by a previous run with the same settings
+    are read from the cache and are never rendered
+  * If blank_ink_ratio is set, rendered pages with at most that share of ink pixels are
+    classified as blank before OCR, and have no text (an empty list) without running tesseract.
+    Like any page without the criteria key, they still follow the previous page with --multipage
+  * If deduplicate is set, pages with the same content as an earlier page of the run
+    (eg. a reprinted order, or the same file listed twice) reuse that page's text, and
+    are never rendered. Pages are compared by their content fingerprint (see page_hasher)
+  * All other pages are rendered and OCR'd on the worker pool
+  * If adaptive_dpis are provided, pages are first OCR'd at those lower resolutions in
+    order, and only pages where the criteria value was not found with at least
+    min_confidence are rendered again at the next resolution, up to dpi
+  * If targeted is set, the region around the criteria key is learned from the first
+    page it is found on, and later pages only OCR that small region, falling back to
+    the whole page (or quadrants) when the key or value is not found in it
+  * page_sources counts how many pages took each path
+  * run_metrics record stage times, and the render time, OCR time, size and
+    confidence of each OCR'd page
+  """
+
+  TEXT_LAYER = 'text layer'
+  CACHE = 'cache'
+  OCR = 'ocr'
+  TARGETED_HIT = 'targeted region'
+  TARGETED_MISS = 'targeted fallback'
+  DUPLICATE = 'duplicate'
+  BLANK = 'blank'
+
+  def __init__(self, pool, dpi, quadrants, criteria_key, use_text_layer=False,
+      page_budget=rasterizer.DEFAULT_PAGE_BUDGET, render_threads=rasterizer.DEFAULT_RENDER_THREADS, cache=None,
+      adaptive_dpis=None, value_index=1, min_confidence=DEFAULT_MIN_CONFIDENCE, targeted=False, run_metrics=None, deduplicate=False,
+      blank_ink_ratio=None):
+    self.pool = pool
+    self.dpi = dpi
+    self.quadrants = quadrants
+    self.criteria_key = criteria_key
+    self.use_text_layer = use_text_layer
+    self.page_budget = page_budget
+    self.render_threads = render_threads
+    self.cache = cache
+    self.adaptive_dpis = sorted(adaptive_dpi for adaptive_dpi in (adaptive_dpis or []) if adaptive_dpi < dpi)
+    self.value_index = value_index
+    self.min_confidence = min_confidence
+    self.targeted = targeted
+    self.deduplicate = deduplicate
+    self.blank_ink_ratio = blank_ink_ratio
+    self.key_region = None
+    self.page_sources = Counter()
+    self.run_metrics = run_metrics or metrics.RunMetrics()
+
+  def get_ocr_settings(self):
+    """ Every setting the OCR text of a page depends on, used to key the OCR cache """
+    backend = self.pool.ocr_backend if self.pool is not None else ocr_backend.resolve_backend_name()
+    settings = {
+      'dpi': self.dpi,
+      'quadrants': sorted(self.quadrants),
+      'language': OCR_LANGUAGE,
+      'tesseract': get_tesseract_version(backend)
+    }
+    if backend != ocr_backend.PYTESSERACT:
+      settings['ocr_backend'] = backend
+    if self.adaptive_dpis:
+      settings.update({'adaptive_dpis': self.adaptive_dpis, 'min_confidence': self.min_confidence})
+    if self.targeted:
+      settings['targeted'] = True
+    if self.adaptive_dpis or self.targeted:
+      settings.update({'criteria_key': self.criteria_key, 'value_index': self.value_index})
+    if self.blank_ink_ratio is not None:
+      settings['blank_ink_ratio'] = self.blank_ink_ratio
+    return settings
+
+  def get_text_layer_pages(self, document, first_page, last_page):
+    """ Returns a map of page index to text layer tokens, for pages from first_page to last_page (exclusive) where the criteria key was found """
+    if not self.use_text_layer:
+      return {}
+    text_layer_pages = {}
+    for pdf_path, page_offset, local_first_page, local_last_page in document.split_page_range(first_page, last_page):
+      layer_pages = text_layer.extract_text_layer(pdf_path, local_first_page + 1, local_last_page) or []
+      text_layer_pages.update({page_offset + local_first_page + page_index: tokens for page_index, tokens in enumerate(layer_pages) if self.criteria_key in tokens})
+    return text_layer_pages
+
+  def get_page_fingerprints(self, document, first_page, last_page):
+    """
+    Returns a map of page index to content fingerprint, for pages from first_page to last_page
+    (exclusive), or an empty map if neither caching nor deduplication need them
+    """
+    if self.cache is None and not self.deduplicate:
+      return {}
+    fingerprints = {}
+    for pdf_path, page_offset, local_first_page, local_last_page in document.split_page_range(first_page, last_page):
+      page_fingerprints = page_hasher.get_page_fingerprints(pdf_path, local_first_page, local_last_page)
+      fingerprints.update(zip(range(page_offset + local_first_page, page_offset + local_last_page), page_fingerprints))
+    return fingerprints
+
+  def get_cache_keys(self, fingerprints):
+    """ Returns a map of page index to OCR cache key, or an empty map if caching is disabled """
+    if self.cache is None:
+      return {}
+    ocr_settings = self.get_ocr_settings()
+    return {page_index: self.cache.get_key(fingerprint, ocr_settings) for page_index, fingerprint in fingerprints.items()}
+
+  def get_cached_pages(self, cache_keys, skip_pages):
+    cached_pages = {}
+    for page_index, key in cache_keys.items():
+      if page_index not in skip_pages:
+        page_text = self.cache.get(key)
+        if page_text is not None:
+          cached_pages[page_index] = page_text
+    return cached_pages
+
+  def get_duplicate_pages(self, fingerprints, page_indexes):
+    """ Returns a map of each of the given pages with the same fingerprint as an earlier one of them, to that earlier page """
+    if not self.deduplicate:
+      return {}
+    first_pages = {}
+    duplicate_pages = {}
+    for page_index in page_indexes:
+      first_page = first_pages.setdefault(fingerprints[page_index], page_index)
+      if first_page != page_index:
+        duplicate_pages[page_index] = first_page
+    return duplicate_pages
+
+  def get_ocr_function(self, func):
+    """ Worker function that times func, skipping blank pages if blank_ink_ratio is set """
+    if self.blank_ink_ratio is not None:
+      func = partial(skip_blank_page, func, self.blank_ink_ratio)
+    return partial(metrics.timed_call, func)
+
+  def ocr_images(self, images):
+    """ Yields the OCR text, word confidences and OCR time of each image, in page order. Blank pages have no text """
+    if not self.targeted:
+      timed_ocr = self.get_ocr_function(extract_ocr_data_from_image)
+      for ocr_data, ocr_seconds in map_images_on_pool(timed_ocr, images, self.pool, self.run_metrics):
+        extracted_text, confidences = ocr_data or ([], [])
+        yield extracted_text, confidences, ocr_seconds
+      return
+
+    # Tasks are created as the pool pulls images, so pages submitted after the
+    # key region is learned are targeted
+    tasks = ((image, self.key_region, self.criteria_key, self.value_index) for image in images)
+    timed_ocr = self.get_ocr_function(extract_targeted_ocr_data_from_image)
+    for ocr_data, ocr_seconds in map_images_on_pool(timed_ocr, tasks, self.pool, self.run_metrics):
+      if ocr_data is None:
+        yield [], [], ocr_seconds
+        continue
+      extracted_text, confidences, key_region, region_hit = ocr_data
+      if region_hit:
+        self.page_sources[self.TARGETED_HIT] += 1
+      else:
+        self.page_sources[self.TARGETED_MISS] += 1
+        if self.key_region is None and key_region is not None:
+          logger.debug("Learned %s region %s" % (self.criteria_key, str(key_region)))
+          self.key_region = key_region
+      yield extracted_text, confidences, ocr_seconds
+
+  def convert_pages_to_images(self, document, dpi, page_numbers, raster_directory=None):
+    """
+    Yields the given global (1-based) pages as images, in page order.
+    Each page is rendered directly from its source file, as a MappedPage in
+    raster_directory if one is provided.
+    """
+    for pdf_path, local_page_numbers in document.split_page_numbers(page_numbers):
+      if not local_page_numbers:
+        continue
+      if raster_directory is None:
+        yield from convert_document_to_images(pdf_path, dpi, self.quadrants, self.page_budget, self.render_threads, local_page_numbers)
+      else:
+        yield from convert_document_to_mapped_pages(pdf_path, dpi, self.quadrants, raster_directory, self.page_budget, self.render_threads, local_page_numbers)
+
+  def ocr_pages(self, document, dpi, page_numbers):
+    """
+    Yields the OCR text and word confidences of the given (1-based) pages at dpi, recording each page's metrics.
+    * Pages are rendered on a background thread while earlier pages are OCR'd. At most
+      page_budget rendered pages wait for the OCR pool, so rendering never runs far ahead
+    * Up to get_max_rendered_pages(page_budget) rendered pages are held at once: a window
+      of page_budget pages being rendered, page_budget waiting, and the pool's pages in
+      flight (up to page_budget with the default pool)
+    * Pages OCR'd by worker processes are handed over as mapped pages, removed as soon as their result is back
+    * The utilization of the OCR workers (their OCR time over the time of the pass) is recorded
+    """
+    render_info = deque()
+    in_flight = deque()
+    workers = self.pool.workers if self.pool is not None else ocr_pool.default_worker_count()
+    pass_time = time.perf_counter()
+    with ExitStack() as stack:
+      raster_directory = None
+      if self.pool is not None and self.pool.workers > 1:
+        required_bytes = get_max_rendered_pages(self.page_budget) * rasterizer.get_mapped_page_bytes(dpi)
+        raster_directory = stack.enter_context(tempfile.TemporaryDirectory(prefix='pdf_sorter_', dir=rasterizer.get_mapped_page_directory(required_bytes)))
+      images = self.run_metrics.time_images(self.convert_pages_to_images(document, dpi, page_numbers, raster_directory), render_info)
+      # Entered after the raster directory, so the render thread is stopped before the directory is removed
+      images = stack.enter_context(stage_queue.BackgroundStage(images, 'render', self.page_budget, self.run_metrics))
+      images = track_in_flight(images, in_flight)
+      for page_number, (extracted_text, confidences, ocr_seconds) in zip(page_numbers, self.ocr_images(images)):
+        # Every image is pulled from render_info before its OCR result comes back
+        render_seconds, size = render_info.popleft()
+        image = in_flight.popleft()
+        if isinstance(image, rasterizer.MappedPage):
+          image.remove()
+        source = self.OCR if extracted_text else self.BLANK
+        self.run_metrics.record_page(page_number, source, dpi, render_seconds, ocr_seconds, size, metrics.get_mean_confidence(confidences))
+        page_time = time.perf_counter()
+        self.run_metrics.record_utilization('ocr', ocr_seconds, workers * (page_time - pass_time))
+        pass_time = page_time
+        yield extracted_text, confidences
+
+  def extract_ocr_text(self, document, page_numbers):
+    """ Yields the OCR text of the given (1-based) pages, in page order """
+    if not self.adaptive_dpis:
+      for extracted_text, _ in self.ocr_pages(document, self.dpi, page_numbers):
+        yield extracted_text
+      return
+
+    # Pages are yielded in page order as soon as their text is final: once it passes the
+    # confidence check, or was OCR'd at the last resolution. Only the pages from the first
+    # one waiting for a retry on are held back
+    final_text = {}
+    page_order = iter(page_numbers)
+    next_page = next(page_order, None)
+    remaining_pages = page_numbers
+    pass_dpis = self.adaptive_dpis + [self.dpi]
+    for pass_number, pass_dpi in enumerate(pass_dpis, 1):
+      if not remaining_pages:
+        break
+      logger.info("OCR pass at %d dpi for %d pages" % (pass_dpi, len(remaining_pages)))
+      failed_pages = []
+      for page_number, (extracted_text, confidences) in zip(remaining_pages, self.ocr_pages(document, pass_dpi, remaining_pages)):
+        # Blank pages have no text at any resolution
+        if pass_number < len(pass_dpis) and extracted_text and not is_confident_match(extracted_text, confidences, self.criteria_key, self.value_index, self.min_confidence):
+          failed_pages.append(page_number)
+          continue
+        final_text[page_number] = extracted_text
+        while next_page in final_text:
+          yield final_text.pop(next_page)
+          next_page = next(page_order, None)
+      remaining_pages = failed_pages
+
+  def extract(self, document, first_page=0, last_page=None):
+    """
+    Yields the text of each page of the document, in page order.
+    document is either a VirtualDocument of several files, or the path of a single PDF.
+    Pages before first_page (0-based) are skipped, eg. when resuming a job, and so are
+    pages from last_page (0-based, exclusive) on, eg. when extracting a single shard.
+    """
+    document = virtual_document.as_virtual_document(document)
+    self.page_sources = Counter()
+    page_count = document.page_count if last_page is None else min(last_page, document.page_count)
+    # Only the pages being extracted are read, so shards of a large document don't each read all of it
+    with self.run_metrics.stage('text layer'):
+      text_layer_pages = self.get_text_layer_pages(document, first_page, page_count)
+    with self.run_metrics.stage('fingerprint'):
+      fingerprints = self.get_page_fingerprints(document, first_page, page_count)
+    with self.run_metrics.stage('cache lookup'):
+      cache_keys = self.get_cache_keys(fingerprints)
+      cached_pages = self.get_cached_pages(cache_keys, text_layer_pages)
+    ocr_page_indexes = [page_index for page_index in range(first_page, page_count)
+      if page_index not in text_layer_pages and page_index not in cached_pages]
+    duplicate_pages = self.get_duplicate_pages(fingerprints, ocr_page_indexes)
+    ocr_page_numbers = [page_index + 1 for page_index in ocr_page_indexes if page_index not in duplicate_pages]
+    # Text of the pages that later duplicates reuse
+    duplicated_text = {first_page: None for first_page in duplicate_pages.values()}
+
+    ocr_text = self.extract_ocr_text(document, ocr_page_numbers)
+
+    for page_index in range(first_page, page_count):
+      if page_index in text_layer_pages:
+        self.page_sources[self.TEXT_LAYER] += 1
+        self.run_metrics.record_page(page_index + 1, self.TEXT_LAYER)
+        yield text_layer_pages[page_index]
+      elif page_index in cached_pages:
+        self.page_sources[self.CACHE] += 1
+        self.run_metrics.record_page(page_index + 1, self.CACHE)
+        yield cached_pages[page_index]
+      elif page_index in duplicate_pages:
+        self.page_sources[self.DUPLICATE] += 1
+        self.run_metrics.record_page(page_index + 1, self.DUPLICATE, duplicate_of=duplicate_pages[page_index] + 1)
+        yield duplicated_text[duplicate_pages[page_index]]
+      else:
+        page_text = next(ocr_text)
+        self.page_sources[self.OCR if page_text else self.BLANK] += 1
+        if cache_keys:
+          self.cache.put(cache_keys[page_index], page_text)
+        if page_index in duplicated_text:
+          duplicated_text[page_index] = page_text
+        yield page_text
 
+    logger.info("Extracted text from %d pages: %d from the text layer, %d from the OCR cache, %d duplicates of earlier pages, %d with OCR, %d blank" % (
+      page_count - first_page, self.page_sources[self.TEXT_LAYER], self.page_sources[self.CACHE], self.page_sources[self.DUPLICATE], self.page_sources[self.OCR],
+      self.page_sources[self.BLANK]))
+    if self.targeted:
+      logger.info("Targeted OCR found %s in the learned region on %d pages, and OCR'd %d whole pages" % (
+        self.criteria_key, self.page_sources[self.TARGETED_HIT], self.page_sources[self.TARGETED_MISS]))
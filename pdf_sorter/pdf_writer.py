@@ -0,0 +1,392 @@
+import io
+import logging
+import mmap
+import os
+import re
+from collections import namedtuple
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+logger = logging.getLogger('pdf_sorter')
+
+# Object numbers reserved for the catalog and page tree, which are written last
+CATALOG_OBJECT_NUMBER = 1
+PAGES_OBJECT_NUMBER = 2
+# Source objects already copied are never read again, so the reader's cache of
+# parsed objects is emptied once it grows past this many objects
+SOURCE_CACHE_LIMIT = 4096
+
+WHITESPACE = b' \t\r\n\x00\x0c'
+DELIMITERS = b'()<>[]{}/%'
+OBJECT_HEADER = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj')
+STREAM_LENGTH = re.compile(rb'/Length\s+(\d+)(?:\s+(\d+)\s+R)?')
+
+# A source object copied byte-for-byte from its offset in the source file
+RawObject = namedtuple('RawObject', ['source', 'idnum', 'generation'])
+
+
+def skip_literal_string(data, position):
+  """ Position just after the literal string starting at position, allowing for nested and escaped parentheses """
+  depth = 0
+  while position < len(data):
+    byte = data[position]
+    if byte == 0x5c:
+      position += 2
+      continue
+    if byte == 0x28:
+      depth += 1
+    elif byte == 0x29:
+      depth -= 1
+      if depth == 0:
+        return position + 1
+    position += 1
+  return position
+
+
+def scan_object_body(data, position):
+  """
+  Scans the body of a source object up to its 'stream' or 'endobj' keyword, without parsing it.
+  * Returns (keyword position, keyword, references), where references are the
+    (start, end, idnum, generation) of each 'N G R' outside of strings and comments
+  * Stream data is never scanned, as it follows the 'stream' keyword
+  """
+  references = []
+  numbers = []
+  while position < len(data):
+    byte = data[position]
+    if byte in WHITESPACE:
+      position += 1
+    elif byte == 0x25:
+      # Comment, up to the end of the line
+      while position < len(data) and data[position] not in b'\r\n':
+        position += 1
+    elif byte == 0x28:
+      position = skip_literal_string(data, position)
+      numbers = []
+    elif data[position:position + 2] in (b'<<', b'>>'):
+      position += 2
+      numbers = []
+    elif byte == 0x3c:
+      # Hex string
+      position = data.find(b'>', position) + 1 or len(data)
+      numbers = []
+    elif byte in b'>[]{}':
+      position += 1
+      numbers = []
+    else:
+      end = position + 1
+      while end < len(data) and data[end] not in WHITESPACE and data[end] not in DELIMITERS:
+        end += 1
+      token = data[position:end]
+      if token in (b'stream', b'endobj'):
+        return position, token, references
+      if token == b'R' and len(numbers) >= 2:
+        (start, _, idnum), (_, _, generation) = numbers[-2:]
+        references.append((start, end, idnum, generation))
+        numbers = []
+      elif token.isdigit():
+        numbers.append((position, end, int(token)))
+      else:
+        numbers = []
+      position = end
+  return position, b'endobj', references
+
+
+def get_page_tree(reader):
+  """ (idnum, generation) of every page and page tree node of a source reader """
+  page_tree = set()
+  nodes = [reader.trailer['/Root'].raw_get('/Pages')]
+  while nodes:
+    node = nodes.pop()
+    if not isinstance(node, IndirectObject) or (node.idnum, node.generation) in page_tree:
+      continue
+    page_tree.add((node.idnum, node.generation))
+    nodes.extend(reader.getObject(node).get('/Kids', []))
+  return page_tree
+
+
+class RawSource:
+  """
+  Memory map of a source PDF, used to copy its objects byte-for-byte.
+  * Object offsets come from the cross-reference table the reader already parsed
+  * Stream data (eg. page images) is copied as-is, never decoded or re-encoded
+  * Objects without an offset (eg. inside a compressed object stream) are copied
+    through the reader instead
+  """
+
+  def __init__(self, reader, data):
+    self.reader = reader
+    self.data = data
+    self.view = memoryview(data)
+    self.offsets = dict(((idnum, generation), offset)
+      for generation, objects in reader.xref.items() for idnum, offset in objects.items())
+    self.page_tree = get_page_tree(reader)
+
+  @classmethod
+  def open(cls, reader):
+    """ RawSource of a reader, or None if its source can't be copied byte-for-byte (eg. encrypted or in memory) """
+    if reader.isEncrypted:
+      return None
+    try:
+      data = mmap.mmap(reader.stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, io.UnsupportedOperation, OSError, ValueError):
+      return None
+    return cls(reader, data)
+
+  def has_object(self, idnum, generation):
+    offset = self.offsets.get((idnum, generation))
+    if offset is None:
+      return False
+    header = OBJECT_HEADER.match(self.data, offset)
+    return header is not None and (int(header.group(1)), int(header.group(2))) == (idnum, generation)
+
+  def get_stream_range(self, dictionary, keyword_position):
+    """ Start and end offsets of the data of the stream whose 'stream' keyword is at keyword_position """
+    start = keyword_position + len(b'stream')
+    if self.data[start:start + 2] == b'\r\n':
+      start += 2
+    elif self.data[start:start + 1] in (b'\r', b'\n'):
+      start += 1
+
+    length = STREAM_LENGTH.search(dictionary)
+    if length is not None:
+      if length.group(2) is None:
+        end = start + int(length.group(1))
+      else:
+        end = start + self.reader.getObject(IndirectObject(int(length.group(1)), int(length.group(2)), self.reader))
+      if self.data[end:end + 30].lstrip(WHITESPACE).startswith(b'endstream'):
+        return start, end
+
+    # Missing or wrong /Length, so the data ends at the end of line before 'endstream'
+    end = self.data.find(b'endstream', start)
+    if self.data[end - 2:end] == b'\r\n':
+      end -= 2
+    elif self.data[end - 1:end] in (b'\r', b'\n'):
+      end -= 1
+    return start, end
+
+  def close(self):
+    self.view.release()
+    self.data.close()
+
+
+class StreamingPdfWriter:
+  """
+  Append-only PDF writer that writes each page to the output file as it is added.
+  * Every object a page needs (contents, fonts, images) is copied from the source
+    reader straight to the output, and only its new object number and file offset
+    are kept in memory
+  * Objects are copied byte-for-byte from a memory map of the source file, and
+    only the references in their dictionaries are renumbered. Image streams are
+    never parsed, decoded or held in memory
+  * Objects shared between pages (eg. fonts), or a page added more than once, are
+    written once and referenced again, so duplicated pages cost one small page dict
+  * References to other pages (eg. in link annotations) are dropped, so copying a
+    page never pulls in the rest of its source document
+  * The page tree, catalog and cross-reference table are written by close()
+  * Memory use is bounded by the largest single page, not by the output size
+  """
+
+  def __init__(self, output_path):
+    self.output_path = output_path
+    self._output = open(output_path, 'wb')
+    self._output.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    self._offsets = {}
+    self._copied = {}
+    self._next_object_number = PAGES_OBJECT_NUMBER + 1
+    self._page_numbers = []
+    self._sources = {}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  @property
+  def page_count(self):
+    return len(self._page_numbers)
+
+  def reserve_object_number(self):
+    object_number = self._next_object_number
+    self._next_object_number += 1
+    return object_number
+
+  def get_source(self, reader):
+    if id(reader) not in self._sources:
+      self._sources[id(reader)] = RawSource.open(reader)
+    return self._sources[id(reader)]
+
+  def get_reference(self, reader, reference, pending):
+    """ New object number of a source object, queueing it to be copied the first time it is seen """
+    key = (id(reader), reference.idnum, reference.generation)
+    if key in self._copied:
+      return self._copied[key]
+
+    source = self.get_source(reader)
+    if source is not None and source.has_object(reference.idnum, reference.generation):
+      if (reference.idnum, reference.generation) in source.page_tree:
+        self._copied[key] = None
+      else:
+        self._copied[key] = self.reserve_object_number()
+        pending.append((self._copied[key], RawObject(source, reference.idnum, reference.generation)))
+    else:
+      source_object = reader.getObject(reference)
+      if isinstance(source_object, DictionaryObject) and source_object.get('/Type') in ['/Page', '/Pages']:
+        self._copied[key] = None
+      else:
+        self._copied[key] = self.reserve_object_number()
+        pending.append((self._copied[key], source_object))
+    return self._copied[key]
+
+  def write_value(self, reader, value, pending):
+    """ Writes a direct value, renumbering any references to source objects """
+    if isinstance(value, IndirectObject):
+      object_number = self.get_reference(reader, value, pending)
+      self._output.write(b'null' if object_number is None else b'%d 0 R' % object_number)
+    elif isinstance(value, DictionaryObject):
+      self._output.write(b'<<')
+      for key, item in value.items():
+        if key == '/Length' and isinstance(value, StreamObject):
+          continue
+        key.writeToStream(self._output, None)
+        self._output.write(b' ')
+        self.write_value(reader, item, pending)
+        self._output.write(b'\n')
+      if isinstance(value, StreamObject):
+        self._output.write(b'/Length %d\n>>\nstream\n' % len(value._data))
+        self._output.write(value._data)
+        self._output.write(b'\nendstream')
+      else:
+        self._output.write(b'>>')
+    elif isinstance(value, ArrayObject):
+      self._output.write(b'[')
+      for item in value:
+        self.write_value(reader, item, pending)
+        self._output.write(b' ')
+      self._output.write(b']')
+    else:
+      value.writeToStream(self._output, None)
+
+  def write_raw_object(self, object_number, raw_object, pending):
+    """ Copies a source object byte-for-byte, renumbering the references in its dictionary """
+    source = raw_object.source
+    body_start = OBJECT_HEADER.match(source.data, source.offsets[(raw_object.idnum, raw_object.generation)]).end()
+    body_end, keyword, references = scan_object_body(source.data, body_start)
+
+    self._offsets[object_number] = self._output.tell()
+    self._output.write(b'%d 0 obj' % object_number)
+    position = body_start
+    for start, end, idnum, generation in references:
+      self._output.write(source.view[position:start])
+      reference_number = self.get_reference(source.reader, IndirectObject(idnum, generation, source.reader), pending)
+      self._output.write(b'null' if reference_number is None else b'%d 0 R' % reference_number)
+      position = end
+    self._output.write(source.view[position:body_end])
+    if keyword == b'stream':
+      stream_start, stream_end = source.get_stream_range(source.data[body_start:body_end], body_end)
+      self._output.write(b'stream\n')
+      self._output.write(source.view[stream_start:stream_end])
+      self._output.write(b'\nendstream')
+    self._output.write(b'\nendobj\n')
+
+  def write_object(self, object_number, reader, value, pending):
+    if isinstance(value, RawObject):
+      self.write_raw_object(object_number, value, pending)
+      return
+    self._offsets[object_number] = self._output.tell()
+    self._output.write(b'%d 0 obj\n' % object_number)
+    self.write_value(reader, value, pending)
+    self._output.write(b'\nendobj\n')
+
+  def add_page(self, reader, page_index):
+    """ Writes a page of the source reader, and every object it needs that was not already written """
+    page = reader.getPage(page_index)
+    page_number = self.reserve_object_number()
+    pending = []
+    self._offsets[page_number] = self._output.tell()
+    self._output.write(b'%d 0 obj\n<<' % page_number)
+    for key, value in page.items():
+      key.writeToStream(self._output, None)
+      self._output.write(b' ')
+      if key == '/Parent':
+        self._output.write(b'%d 0 R' % PAGES_OBJECT_NUMBER)
+      else:
+        self.write_value(reader, value, pending)
+      self._output.write(b'\n')
+    self._output.write(b'>>\nendobj\n')
+
+    while pending:
+      object_number, source_object = pending.pop()
+      self.write_object(object_number, reader, source_object, pending)
+    self._page_numbers.append(page_number)
+
+    resolved_objects = getattr(reader, 'resolvedObjects', {})
+    if len(resolved_objects) > SOURCE_CACHE_LIMIT:
+      resolved_objects.clear()
+
+  def close(self):
+    """ Writes the page tree, catalog and cross-reference table, and closes the output file """
+    if self._output.closed:
+      return
+    kids = b' '.join(b'%d 0 R' % page_number for page_number in self._page_numbers)
+    self._offsets[PAGES_OBJECT_NUMBER] = self._output.tell()
+    self._output.write(b'%d 0 obj\n<< /Type /Pages /Kids [%s] /Count %d >>\nendobj\n' % (PAGES_OBJECT_NUMBER, kids, len(self._page_numbers)))
+    self._offsets[CATALOG_OBJECT_NUMBER] = self._output.tell()
+    self._output.write(b'%d 0 obj\n<< /Type /Catalog /Pages %d 0 R >>\nendobj\n' % (CATALOG_OBJECT_NUMBER, PAGES_OBJECT_NUMBER))
+
+    xref_offset = self._output.tell()
+    self._output.write(b'xref\n0 %d\n0000000000 65535 f \n' % self._next_object_number)
+    for object_number in range(1, self._next_object_number):
+      self._output.write(b'%010d 00000 n \n' % self._offsets[object_number])
+    self._output.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+      self._next_object_number, CATALOG_OBJECT_NUMBER, xref_offset))
+    self._output.close()
+    for source in self._sources.values():
+      if source is not None:
+        source.close()
+    self._sources = {}
+
+
+def get_chunk_path(output_path, chunk_number):
+  """ Path of a chunk of the output, eg. ./output/Route1_003.pdf """
+  stem, ext = os.path.splitext(output_path)
+  return '%s_%03d%s' % (stem, chunk_number, ext)
+
+
+class ChunkedPdfWriter:
+  """
+  Writes pages to a single streaming output, or with chunk_size to a new
+  output every chunk_size pages (eg. one PDF per printer tray).
+  Each chunk is a complete PDF with its own copy of the resources it uses.
+  """
+
+  def __init__(self, output_path, chunk_size=None):
+    self.output_path = output_path
+    self.chunk_size = chunk_size
+    self.output_paths = []
+    self._writer = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def add_page(self, reader, page_index):
+    if self._writer is not None and self.chunk_size and self._writer.page_count >= self.chunk_size:
+      self._writer.close()
+      self._writer = None
+    if self._writer is None:
+      chunk_path = get_chunk_path(self.output_path, len(self.output_paths) + 1) if self.chunk_size else self.output_path
+      self._writer = StreamingPdfWriter(chunk_path)
+      self.output_paths.append(chunk_path)
+    self._writer.add_page(reader, page_index)
+
+  def close(self):
+    if self._writer is None and not self.output_paths:
+      # No pages were added, but the output is still expected to exist
+      self._writer = StreamingPdfWriter(self.output_path)
+      self.output_paths.append(self.output_path)
+    if self._writer is not None:
+      self._writer.close()
+      self._writer = None
@@ -0,0 +1,190 @@
+from itertools import chain
+import logging
+import os
+from pdf_sorter import checkpoint
+from pdf_sorter import data_explorer
+from pdf_sorter import fs_helper
+from pdf_sorter import metrics
+from pdf_sorter import ocr_cache
+from pdf_sorter import page_classifier
+from pdf_sorter import page_index
+from pdf_sorter import pdf_image_sorter
+from pdf_sorter import sharding
+from pdf_sorter import virtual_document
+
+logger = logging.getLogger('pdf_sorter')
+
+def get_explore_store_header(pdf_paths, sort_targets, explore_file, settings):
+  """
+  Identifies an explore job, like the journal header of a sort job, by its explore output
+  (and -o outputs, when the default explore file is used) so jobs on the same input,
+  eg. of a batch or the service, each append to a store of their own
+  """
+  outputs = {'explore': os.path.abspath(explore_file) if explore_file else None, 'outputs': [target.output for target in sort_targets]}
+  return checkpoint.get_journal_header(pdf_paths, outputs, settings)
+
+
+def get_page_budget(args):
+  return args.page_budget or args.workers * 2
+
+
+def get_blank_ink_ratio(args):
+  """ Ink ratio below which pages are classified as blank, or None to OCR every page """
+  if args.blank_ink is None and args.drop_blank:
+    return page_classifier.DEFAULT_BLANK_INK_RATIO
+  return args.blank_ink
+
+
+def create_cache(args):
+  """ OCR result cache for the given arguments, or None if caching is disabled """
+  return None if args.no_cache else ocr_cache.OcrCache(args.cache_dir, args.cache_size)
+
+
+def create_extractor(args, pool, cache, run_metrics, extraction_settings):
+  """
+  Extractor of the text of the pages: a PageTextExtractor using the pool, or a
+  ShardCoordinator handing shards of the pages to workers with --shard-dir
+  """
+  if args.shard_dir:
+    return sharding.ShardCoordinator(args.shard_dir, extraction_settings, args.shard_size, args.local_shard_workers,
+      sharding.get_local_worker_arguments(args), args.shard_timeout, run_metrics)
+  return pdf_image_sorter.PageTextExtractor(pool, cache=cache, run_metrics=run_metrics, **extraction_settings)
+
+
+def track_progress(extracted_text_pages, page_count, progress, first_page=0):
+  """ Calls progress(pages_done, page_count) as the text of each page is extracted """
+  for pages_done, page_text in enumerate(extracted_text_pages, first_page + 1):
+    progress(pages_done, page_count)
+    yield page_text
+
+
+def write_sorted_documents(args, document, value_page_lookups, run_metrics):
+    """
+    Writes the pages of the document in the order of the sort list of each sort target,
+    using the value map extracted for its criteria key. Returns the output path (or the
+    list of chunk paths with --chunk-size) of the single target, or a list of them if
+    there are several.
+    """
+    # Get the new order(s) to sort by (based on the route)
+    sorted_outputs = [(value_page_lookup, fs_helper.get_sort_list(target.sort, args.reverse), target.output)
+      for target, value_page_lookup in zip(args.sort_targets, value_page_lookups)]
+
+    with run_metrics.stage('write'):
+      output_paths = pdf_image_sorter.generate_sorted_documents(document, sorted_outputs, args.chunk_size)
+
+    logger.info("Success! Document sorting complete.")
+    outputs = output_paths if args.chunk_size else [target.output for target in args.sort_targets]
+    return outputs if len(outputs) > 1 else outputs[0]
+
+
+def run_job(args, pool, cache=None, explore_file=None, progress=None, run_metrics=None):
+    """
+    Runs a single sort or explore job with validated arguments, using an OCR worker
+    pool (and optionally a cache) that can be shared between jobs.
+    If provided, progress(pages_done, page_count) is called as each page is extracted,
+    and run_metrics record the time of each stage and page.
+    Each of several criteria keys (args.sort_targets) is extracted from the same pass over
+    the pages, and sorts its own output.
+    Returns the path of the sorted PDF (or the paths of its chunks), a list of those for
+    several criteria keys, or the path of the explore CSV (or Parquet file) in explore mode.
+    """
+    documents_to_sort = args.files
+    dpi = args.dpi
+    quadrant = args.quadrant
+    criteria_key = args.criteria
+    value_index = args.index
+    multi_page = args.multipage
+    explore = args.explore
+    sort_targets = args.sort_targets
+    page_budget = get_page_budget(args)
+    render_threads = args.render_threads
+    use_text_layer = args.text_layer
+    adaptive_dpis = args.adaptive_dpi
+    min_confidence = args.min_confidence
+    # Explore mode needs the text of the whole page (or quadrants), and a region learned
+    # for one criteria key would miss the others
+    targeted = args.targeted and not explore and len(sort_targets) == 1
+    if args.targeted and not targeted and not explore:
+      logger.warning("Targeted OCR only works with a single criteria key. OCRing whole pages instead")
+
+    run_metrics = run_metrics or metrics.RunMetrics()
+
+    index_settings = [page_index.get_index_settings(args, target) for target in sort_targets]
+
+    logger.info("Hello! I'm going to re-sort %s because you asked me to!" % (documents_to_sort))
+
+    # Values already extracted from the same input, with the same settings, by a previous run
+    if args.from_index and not explore:
+      with run_metrics.stage('index lookup'):
+        indexed = page_index.load_indexes(documents_to_sort, index_settings)
+      if None not in indexed:
+        value_page_lookups = [value_page_lookup for value_page_lookup, _ in indexed]
+        page_counts = indexed[0][1]
+        return write_sorted_documents(args, virtual_document.VirtualDocument(documents_to_sort, page_counts), value_page_lookups, run_metrics)
+      logger.warning("Extracting %s values from %s instead" % (criteria_key, documents_to_sort))
+
+    # Input file(s) as a single document, without writing a merged copy
+    document = virtual_document.VirtualDocument(documents_to_sort)
+
+    # Values of the pages extracted by an earlier run of the same job that didn't finish (--resume)
+    resumed_values = []
+    if explore:
+      # Relative indexes of each page are appended to an on-disk store as its text arrives,
+      # named after the job so a run that died part way can be carried on
+      store_header = get_explore_store_header(documents_to_sort, sort_targets, explore_file, index_settings)
+      store_path = checkpoint.get_journal_path(store_header, data_explorer.EXPLORE_STORE_EXTENSION)
+      if args.resume and os.path.exists(store_path):
+        column_store = data_explorer.ExploreColumnStore.load(store_path)
+        logger.info("Resuming explore data from %s after %d pages" % (store_path, column_store.page_count))
+      else:
+        column_store = data_explorer.ExploreColumnStore(store_path)
+      first_page = column_store.page_count
+    else:
+      journal_header = checkpoint.get_journal_header(documents_to_sort, [target.output for target in sort_targets], index_settings)
+      journal_path = checkpoint.get_journal_path(journal_header)
+      if args.resume:
+        resumed_values = checkpoint.load_journal(journal_path, journal_header)
+      first_page = len(resumed_values)
+
+    # Text of the original pdf(s) as a generator function, from the text layer, cache or OCR
+    extraction_settings = {'dpi': dpi, 'quadrants': quadrant, 'criteria_key': criteria_key, 'use_text_layer': use_text_layer,
+      'page_budget': page_budget, 'render_threads': render_threads, 'adaptive_dpis': adaptive_dpis, 'value_index': value_index,
+      'min_confidence': min_confidence, 'targeted': targeted, 'deduplicate': not args.no_dedup, 'blank_ink_ratio': get_blank_ink_ratio(args)}
+    extractor = create_extractor(args, pool, cache, run_metrics, extraction_settings)
+    extracted_text_pages = extractor.extract(document, first_page)
+    if progress is not None:
+      extracted_text_pages = track_progress(extracted_text_pages, document.page_count, progress, first_page)
+
+    if explore:
+      logger.debug("Running in explore mode")
+      explore_file = data_explorer.get_explore_file_path(explore_file or data_explorer.get_default_explore_file(), args.explore_format)
+      with column_store:
+        with run_metrics.stage('extract'):
+          for page_text in extracted_text_pages:
+            with run_metrics.stage('explore matrix'):
+              column_store.add_page(page_text, criteria_key)
+        with run_metrics.stage('write'):
+          explore_file = column_store.write_explore_file(explore_file, args.explore_format)
+      os.remove(store_path)
+      logger.info('Success! Data exploration complete.')
+      return explore_file
+
+    else:
+      logger.debug("Running in sort mode")
+      # The value of each page is journaled as it is extracted, so a job that dies can be resumed
+      with checkpoint.ExtractionJournal(journal_path, journal_header, resumed_values) as journal:
+        # Map of values from document to page index for each criteria key, all extracted from
+        # the same text as each page arrives. Resumed values are replayed first, so multipage
+        # pages follow the right value
+        with run_metrics.stage('extract'):
+          page_values = (pdf_image_sorter.get_page_values(page_text, sort_targets, args.drop_blank) for page_text in extracted_text_pages)
+          value_page_lookups = pdf_image_sorter.build_value_page_maps(chain(resumed_values, journal.record(page_values)),
+            [target.criteria for target in sort_targets], multi_page)
+
+        # Saved so a later run with a new sort list can skip extraction (--from-index)
+        with run_metrics.stage('index write'):
+          page_index.save_indexes(document, list(zip(index_settings, value_page_lookups)))
+
+        output = write_sorted_documents(args, document, value_page_lookups, run_metrics)
+        journal.remove()
+      return output
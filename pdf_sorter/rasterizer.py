@@ -0,0 +1,252 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import logging
+import math
+import mmap
+import os
+import re
+import shutil
+import subprocess
+import uuid
+from pdf2image import pdfinfo_from_path, convert_from_path
+from pdf2image.parsers import parse_buffer_to_ppm
+from PIL import Image
+
+logger = logging.getLogger('pdf_sorter')
+
+DEFAULT_RENDER_THREADS = 4
+DEFAULT_PAGE_BUDGET = 8
+# Rendered pages handed to OCR workers are written here, so they stay in memory
+SHARED_MEMORY_DIRECTORY = '/dev/shm'
+# Page size in points used to estimate the size of a rendered page before it is rendered
+# (the larger sides of letter and A4)
+ESTIMATED_PAGE_SIZE = (612, 842)
+PGM_HEADER = re.compile(rb'P5\s+(\d+)\s+(\d+)\s+\d+\s')
+
+def get_page_count(pdf_path):
+  return pdfinfo_from_path(pdf_path)["Pages"]
+
+
+def get_page_windows(page_numbers, window_size):
+  """
+  Splits the page numbers to render into (first_page, last_page) windows of at most
+  window_size consecutive pages. Page numbers are 1-based and inclusive, as expected by poppler.
+  """
+  window_size = max(1, window_size)
+  windows = []
+  for page_number in page_numbers:
+    if windows and windows[-1][1] == page_number - 1 and page_number - windows[-1][0] < window_size:
+      windows[-1] = (windows[-1][0], page_number)
+    else:
+      windows.append((page_number, page_number))
+  return windows
+
+
+def get_pages_to_render(pdf_path, page_numbers):
+  if page_numbers is None:
+    return range(1, get_page_count(pdf_path) + 1)
+  return sorted(page_numbers)
+
+
+def render_pages(pdf_path, dpi, page_budget=DEFAULT_PAGE_BUDGET, render_threads=DEFAULT_RENDER_THREADS, page_numbers=None):
+  """
+  Yields the pages of the document as images, in page order.
+  * Pages are rendered in windows of page_budget pages, so only one window of
+    rendered pages is held in memory regardless of the document length
+  * The next window is only rendered once the previous one has been consumed
+  * Each window is split between at most render_threads poppler processes
+  * Only the given (1-based) page numbers are rendered if provided, otherwise all pages
+  """
+  windows = get_page_windows(get_pages_to_render(pdf_path, page_numbers), page_budget)
+  logger.debug("Rendering %d windows of up to %d pages" % (len(windows), page_budget))
+
+  for first_page, last_page in windows:
+    thread_count = max(1, min(render_threads, last_page - first_page + 1))
+    for page in convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page, thread_count=thread_count):
+      yield page
+
+
+def get_page_sizes(pdf_path, first_page, last_page):
+  """
+  Returns the (width, height) in points of each page in the window, as the page
+  is displayed (ie. width and height are swapped for pages rotated by 90 or 270 degrees)
+  """
+  info = pdfinfo_from_path(pdf_path, first_page=first_page, last_page=last_page)
+  sizes = []
+  for page_number in range(first_page, last_page + 1):
+    # pdfinfo only numbers the page size lines when more than one page is requested
+    prefix = 'Page %4d' % page_number
+    if prefix + ' size' not in info:
+      prefix = 'Page'
+    size = info[prefix + ' size'].split()
+    width, height = float(size[0]), float(size[2])
+    if int(float(info.get(prefix + ' rot', 0))) % 180 == 90:
+      width, height = height, width
+    sizes.append((width, height))
+  return sizes
+
+
+def get_region_box(page_size, dpi, crop_width, crop_height):
+  """
+  Converts a page size in points and the crop ratios of a quadrant selection into
+  the (x, y, width, height) pixel box poppler should render at the given dpi
+  """
+  page_width = math.ceil(page_size[0] * dpi / 72)
+  page_height = math.ceil(page_size[1] * dpi / 72)
+  x = int(page_width * crop_width[0])
+  y = int(page_height * crop_height[0])
+  return (x, y, int(page_width * crop_width[1]) - x, int(page_height * crop_height[1]) - y)
+
+
+def get_region_arguments(box):
+  """
+  pdftoppm arguments to render only the given pixel box of a page. The box is measured
+  from the page size pdfinfo reports, which is the CropBox, so the page is rendered by
+  its CropBox too (pdftoppm otherwise places -x and -y on the MediaBox)
+  """
+  x, y, width, height = box
+  return ['-cropbox', '-x', str(x), '-y', str(y), '-W', str(width), '-H', str(height)]
+
+
+def render_page_region(pdf_path, dpi, page_number, box):
+  """ Renders only the given pixel box of a single page using pdftoppm """
+  command = ['pdftoppm', '-r', str(dpi), '-f', str(page_number), '-l', str(page_number)] + get_region_arguments(box) + [pdf_path]
+  output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+  return parse_buffer_to_ppm(output)[0]
+
+
+def render_page_regions(pdf_path, dpi, crop_width, crop_height, page_budget=DEFAULT_PAGE_BUDGET, render_threads=DEFAULT_RENDER_THREADS, page_numbers=None):
+  """
+  Yields the cropped region of the pages of the document, in page order.
+  Only the region selected by the crop ratios is rasterized, so a single
+  quadrant costs about a quarter of the pixel work and memory of a full page.
+  Pages are rendered in the same bounded windows as render_pages.
+  """
+  windows = get_page_windows(get_pages_to_render(pdf_path, page_numbers), page_budget)
+  logger.debug("Rendering region %s x %s in %d windows" % (crop_width, crop_height, len(windows)))
+
+  with ThreadPoolExecutor(max_workers=render_threads) as executor:
+    for first_page, last_page in windows:
+      page_sizes = get_page_sizes(pdf_path, first_page, last_page)
+      boxes = [get_region_box(size, dpi, crop_width, crop_height) for size in page_sizes]
+      for page in executor.map(render_page_region, [pdf_path]*len(boxes), [dpi]*len(boxes), range(first_page, last_page + 1), boxes):
+        yield page
+
+
+class MappedPage:
+  """
+  A page rendered by poppler as an 8-bit grayscale PGM file (in shared memory where
+  available), handed to OCR workers by path instead of as a pickled image.
+  * crop returns a view of the same file (offset and row stride), with no copy
+  * open maps the file as a read-only PIL image, again with no copy
+  * The process that rendered the page removes it once its OCR result is back
+  """
+
+  def __init__(self, path, width, height, offset, stride=None, whole_file=True):
+    self.path = path
+    self.width = width
+    self.height = height
+    self.offset = offset
+    self.stride = stride or width
+    self.whole_file = whole_file
+
+  @property
+  def size(self):
+    return (self.width, self.height)
+
+  def crop(self, box):
+    """ View of the (left, top, right, bottom) pixel box of the page, like PIL's Image.crop """
+    left, top, right, bottom = [int(value) for value in box]
+    left, right = max(0, left), min(self.width, right)
+    top, bottom = max(0, top), min(self.height, bottom)
+    return MappedPage(self.path, max(0, right - left), max(0, bottom - top),
+      self.offset + top * self.stride + left, self.stride, False)
+
+  @contextmanager
+  def open(self):
+    with open(self.path, 'rb') as page_file:
+      mapped = mmap.mmap(page_file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)[self.offset:self.offset + self.height * self.stride]
+    image = Image.frombuffer('L', self.size, view, 'raw', 'L', self.stride, 1)
+    try:
+      yield image
+    finally:
+      image.close()
+      view.release()
+      mapped.close()
+
+  def remove(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+
+@contextmanager
+def open_image(image):
+  """ A PIL image of a rendered page, whether it is a MappedPage or already a PIL image """
+  if isinstance(image, MappedPage):
+    with image.open() as mapped_image:
+      yield mapped_image
+  else:
+    yield image
+
+
+def get_mapped_page_bytes(dpi, page_size=ESTIMATED_PAGE_SIZE):
+  """ Estimated size of the grayscale PGM file of a whole page rendered at dpi """
+  return math.ceil(page_size[0] * dpi / 72) * math.ceil(page_size[1] * dpi / 72)
+
+
+def get_mapped_page_directory(required_bytes=0):
+  """
+  Parent directory for mapped pages: shared memory if the system has it with room for
+  required_bytes, otherwise the temp directory.
+  * Docker's default /dev/shm is only 64 MB, a few pages at 300 dpi. pdftoppm fails once
+      it is full, so a shared memory directory too small for the pages is not used
+  """
+  if not os.path.isdir(SHARED_MEMORY_DIRECTORY):
+    return None
+  free_bytes = shutil.disk_usage(SHARED_MEMORY_DIRECTORY).free
+  if free_bytes < required_bytes:
+    logger.info("Only %d MB free in %s, and rendered pages need up to %d MB. Using the temp directory instead" %
+      (free_bytes // 2**20, SHARED_MEMORY_DIRECTORY, required_bytes // 2**20))
+    return None
+  return SHARED_MEMORY_DIRECTORY
+
+
+def render_mapped_page(pdf_path, dpi, page_number, raster_directory, box=None):
+  """ Renders a page, or only the given pixel box of it, straight to a grayscale PGM file with pdftoppm """
+  output_root = os.path.join(raster_directory, uuid.uuid4().hex)
+  command = ['pdftoppm', '-gray', '-singlefile', '-r', str(dpi), '-f', str(page_number), '-l', str(page_number)]
+  if box is not None:
+    command += get_region_arguments(box)
+  subprocess.run(command + [pdf_path, output_root], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+
+  page_path = output_root + '.pgm'
+  with open(page_path, 'rb') as page_file:
+    header = PGM_HEADER.match(page_file.read(64))
+  width, height = int(header.group(1)), int(header.group(2))
+  # One row of padding, so the view of a crop that ends at the bottom right of the page
+  # can span whole rows
+  with open(page_path, 'ab') as page_file:
+    page_file.write(bytes(width))
+  return MappedPage(page_path, width, height, header.end())
+
+
+def render_mapped_pages(pdf_path, dpi, crop_width, crop_height, raster_directory, page_budget=DEFAULT_PAGE_BUDGET,
+    render_threads=DEFAULT_RENDER_THREADS, page_numbers=None):
+  """
+  Yields the pages of the document (or the region selected by the crop ratios) as
+  MappedPages in raster_directory, in page order, rendered in the same bounded
+  windows as render_pages. Only the first window is rendered before the first page is yielded.
+  """
+  windows = get_page_windows(get_pages_to_render(pdf_path, page_numbers), page_budget)
+  whole_page = crop_width == (0, 1) and crop_height == (0, 1)
+
+  with ThreadPoolExecutor(max_workers=render_threads) as executor:
+    for first_page, last_page in windows:
+      page_range = range(first_page, last_page + 1)
+      if whole_page:
+        boxes = [None] * len(page_range)
+      else:
+        boxes = [get_region_box(size, dpi, crop_width, crop_height) for size in get_page_sizes(pdf_path, first_page, last_page)]
+      for page in executor.map(render_mapped_page, [pdf_path]*len(boxes), [dpi]*len(boxes), page_range, [raster_directory]*len(boxes), boxes):
+        yield page
@@ -0,0 +1,344 @@
+import argparse
+import base64
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import shutil
+import socketserver
+import threading
+import time
+import uuid
+from pdf_sorter import argument_handler
+from pdf_sorter import batch
+from pdf_sorter import fs_helper
+from pdf_sorter import metrics
+from pdf_sorter import ocr_pool
+from pdf_sorter import pipeline
+
+logger = logging.getLogger('pdf_sorter')
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_CONCURRENT_JOBS = 2
+DEFAULT_MAX_QUEUED_JOBS = 100
+DEFAULT_MAX_FINISHED_JOBS = 1000
+DEFAULT_FINISHED_JOB_TTL = 24 * 60 * 60
+FINISHED_STATUSES = ['success', 'failed']
+SERVICE_SUBDIRECTORY = 'output/service'
+RESULT_CONTENT_TYPES = {'.pdf': 'application/pdf', '.csv': 'text/csv', '.parquet': 'application/vnd.apache.parquet'}
+
+class QueueFullError(Exception):
+  pass
+
+
+class SortService:
+  """
+  Long-running sorter that keeps its OCR worker pool and result cache warm between jobs.
+  * Jobs are validated with the same rules as a command line run, then queued
+  * At most concurrent_jobs jobs run at once; at most max_queued jobs can be waiting
+  * Every job runs through pipeline.run_job, exactly like the command line
+  * The pool and cache are built from the arguments of the first job, which are
+    the same for every job except for the job specific fields
+  * The metrics of every finished job are added to run_metrics, the service totals
+  * Finished jobs, and their uploads and results, are removed finished_ttl seconds after
+    they finish, or once more than max_finished jobs have finished, oldest first.
+    The files of a request that fails validation are removed straight away
+  """
+
+  def __init__(self, shared_arguments, concurrent_jobs=DEFAULT_CONCURRENT_JOBS, max_queued=DEFAULT_MAX_QUEUED_JOBS,
+      max_finished=DEFAULT_MAX_FINISHED_JOBS, finished_ttl=DEFAULT_FINISHED_JOB_TTL):
+    self.shared_arguments = shared_arguments
+    self.max_queued = max_queued
+    self.max_finished = max_finished
+    self.finished_ttl = finished_ttl
+    self.jobs = {}
+    # Queue slots taken by requests that are still being saved and validated
+    self._reserved_slots = 0
+    self.pool = None
+    self.cache = None
+    self.run_metrics = metrics.RunMetrics()
+    self._lock = threading.Lock()
+    self._executor = ThreadPoolExecutor(max_workers=concurrent_jobs)
+
+  def close(self):
+    self._executor.shutdown()
+    if self.pool is not None:
+      self.pool.close()
+
+  def get_shared_resources(self, args):
+    with self._lock:
+      if self.pool is None:
+        self.cache = pipeline.create_cache(args)
+        self.pool = ocr_pool.OcrWorkerPool(args.workers, pipeline.get_page_budget(args), args.ocr_backend)
+      return self.pool, self.cache
+
+  @staticmethod
+  def get_job_directory(job_id):
+    return os.path.join(SERVICE_SUBDIRECTORY, job_id)
+
+  def remove_job_files(self, job_id):
+    shutil.rmtree(self.get_job_directory(job_id), ignore_errors=True)
+
+  def prune_finished_jobs(self):
+    """ Removes finished jobs past finished_ttl, and the oldest beyond max_finished, with their files """
+    with self._lock:
+      # A job is only finished once its metrics are recorded too
+      finished_jobs = sorted((job for job in self.jobs.values() if job['status'] in FINISHED_STATUSES and job.get('finished') is not None),
+        key=lambda job: job['finished'])
+      expiry_time = time.time() - self.finished_ttl
+      expired_jobs = [job['id'] for job in finished_jobs if job['finished'] < expiry_time]
+      expired_jobs += [job['id'] for job in finished_jobs[:max(0, len(finished_jobs) - self.max_finished)] if job['id'] not in expired_jobs]
+      for job_id in expired_jobs:
+        del self.jobs[job_id]
+    for job_id in expired_jobs:
+      self.remove_job_files(job_id)
+    if expired_jobs:
+      logger.info("Removed %d finished jobs" % len(expired_jobs))
+
+  def save_job_files(self, job_id, request):
+    """
+    Converts a job request into a manifest style job. Input PDFs and the sort list can
+    either reference files on this host (files, sort) or be sent with the request
+    (uploads as [{"filename", "content" (base64)}], sort_values as a list).
+    """
+    job_directory = fs_helper.create_subdirectory_if_needed(self.get_job_directory(job_id))
+    job = {field: request[field] for field in ['criteria', 'index', 'quadrant', 'multipage', 'reverse', 'explore'] if field in request}
+    job['files'] = list(request.get('files', []))
+    for upload_number, upload in enumerate(request.get('uploads', [])):
+      upload_path = job_directory + '%d_%s' % (upload_number, os.path.basename(upload['filename']))
+      with open(upload_path, 'wb') as upload_file:
+        upload_file.write(base64.b64decode(upload['content']))
+      job['files'].append(upload_path)
+
+    job['sort'] = request.get('sort')
+    if 'sort_values' in request:
+      job['sort'] = job_directory + 'sort.txt'
+      with open(job['sort'], 'w') as sort_file:
+        sort_file.write('\n'.join(str(value) for value in request['sort_values']))
+
+    job['output'] = os.path.join('service', job_id, 'sorted.pdf')
+    return job
+
+  def prepare_job(self, job_id, request):
+    """ Saves the files of a job request and validates it like a command line run. Returns its arguments """
+    job = self.save_job_files(job_id, request)
+    missing_fields = [field for field in batch.REQUIRED_MANIFEST_FIELDS if not job.get(field)]
+    if missing_fields:
+      raise ValueError('Job is missing %s' % ', '.join(missing_fields))
+    try:
+      return argument_handler.get_valid_arguments(batch.get_job_arguments(job, self.shared_arguments))
+    except SystemExit:
+      raise ValueError('Invalid job arguments')
+
+  def submit(self, request):
+    """ Validates and queues a job request, returning the new job's status """
+    self.prune_finished_jobs()
+    with self._lock:
+      queued_jobs = self._reserved_slots + sum(1 for job in self.jobs.values() if job['status'] == 'queued')
+      if queued_jobs >= self.max_queued:
+        raise QueueFullError('%d jobs are already queued' % queued_jobs)
+      # Reserved in the same lock as the check, so concurrent requests can't all take the last slot
+      self._reserved_slots += 1
+
+    job_id = uuid.uuid4().hex
+    try:
+      args = self.prepare_job(job_id, request)
+    except Exception:
+      with self._lock:
+        self._reserved_slots -= 1
+      self.remove_job_files(job_id)
+      raise
+
+    status = {'id': job_id, 'status': 'queued', 'explore': args.explore, 'pages_done': 0, 'pages_total': None,
+      'output': None, 'error': None, 'submitted': time.time(), 'finished': None, 'seconds': None, 'metrics': None}
+    with self._lock:
+      self._reserved_slots -= 1
+      self.jobs[job_id] = status
+      queued_status = dict(status)
+    self._executor.submit(self.run, job_id, args)
+    return queued_status
+
+  def update(self, job_id, **fields):
+    with self._lock:
+      self.jobs[job_id].update(fields)
+
+  def run(self, job_id, args):
+    start_time = time.time()
+    self.update(job_id, status='running')
+    progress = lambda pages_done, pages_total: self.update(job_id, pages_done=pages_done, pages_total=pages_total)
+    job_metrics = metrics.RunMetrics()
+    try:
+      pool, cache = self.get_shared_resources(args)
+      explore_file = os.path.join(os.path.dirname(args.output), 'explore.csv')
+      output = pipeline.run_job(args, pool, cache, explore_file, progress, job_metrics)
+      self.update(job_id, status='success', output=output)
+    except Exception as error:
+      logger.exception("Service job %s failed" % job_id)
+      self.update(job_id, status='failed', error=str(error))
+    self.run_metrics.merge(job_metrics)
+    self.update(job_id, finished=time.time(), seconds=round(time.time() - start_time, 3), metrics=job_metrics.get_summary())
+    if args.statsd:
+      job_metrics.send_statsd(args.statsd)
+    self.prune_finished_jobs()
+
+  def get_status(self, job_id):
+    with self._lock:
+      job = self.jobs.get(job_id)
+      return dict(job) if job else None
+
+  def get_job_counts(self):
+    with self._lock:
+      return dict(Counter(job['status'] for job in self.jobs.values()))
+
+  def to_prometheus(self):
+    """ Totals of every finished job, and the number of jobs in each status, in the Prometheus text format """
+    lines = ['# TYPE %s_jobs gauge' % metrics.METRIC_PREFIX]
+    lines += ['%s_jobs{status="%s"} %d' % (metrics.METRIC_PREFIX, status, count) for status, count in sorted(self.get_job_counts().items())]
+    return '\n'.join(lines) + '\n' + self.run_metrics.to_prometheus()
+
+
+class SortServiceHandler(BaseHTTPRequestHandler):
+  """
+  Local HTTP API of the sorter service:
+  * POST /jobs with a JSON job request queues a sort or explore job
+  * GET /jobs/<id> returns the job status and progress
+  * GET /jobs/<id>/result returns the sorted PDF, or the explore CSV (or Parquet file)
+  * GET /health returns the number of jobs in each status
+  * GET /metrics returns the service totals for Prometheus
+  """
+
+  def send_json(self, status_code, body):
+    content = json.dumps(body).encode()
+    self.send_response(status_code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def send_content(self, content, content_type):
+    self.send_response(200)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def send_file(self, file_path, content_type):
+    with open(file_path, 'rb') as result_file:
+      self.send_content(result_file.read(), content_type)
+
+  def do_POST(self):
+    if self.path.rstrip('/') != '/jobs':
+      return self.send_json(404, {'error': 'Not found'})
+    try:
+      request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+      self.send_json(202, self.server.service.submit(request))
+    except QueueFullError as error:
+      self.send_json(503, {'error': str(error)})
+    except (ValueError, KeyError, TypeError) as error:
+      self.send_json(400, {'error': str(error)})
+
+  def do_GET(self):
+    parts = [part for part in self.path.split('/') if part]
+    if parts == ['health']:
+      return self.send_json(200, self.server.service.get_job_counts())
+    if parts == ['metrics']:
+      return self.send_content(self.server.service.to_prometheus().encode(), 'text/plain; version=0.0.4')
+    if len(parts) < 2 or parts[0] != 'jobs':
+      return self.send_json(404, {'error': 'Not found'})
+
+    job = self.server.service.get_status(parts[1])
+    if job is None:
+      return self.send_json(404, {'error': 'Job %s not found' % parts[1]})
+    if parts[2:] == []:
+      return self.send_json(200, job)
+    if parts[2:] == ['result']:
+      if job['status'] != 'success':
+        return self.send_json(409, {'error': 'Job %s is %s' % (job['id'], job['status'])})
+      if isinstance(job['output'], list):
+        # Chunked output (--chunk-size) is left on disk
+        return self.send_json(200, {'outputs': job['output']})
+      return self.send_file(job['output'], RESULT_CONTENT_TYPES[os.path.splitext(job['output'])[1]])
+    self.send_json(404, {'error': 'Not found'})
+
+  def log_message(self, format, *args):
+    # Unix socket clients have no address, so log without it
+    logger.debug("Service request: " + format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+
+def create_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+  """ HTTP server for the service, on a Unix socket if socket_path is provided, otherwise on host:port """
+  if socket_path:
+    if os.path.exists(socket_path):
+      os.remove(socket_path)
+    server = ThreadingUnixHTTPServer(socket_path, SortServiceHandler)
+  else:
+    server = ThreadingHTTPServer((host, port), SortServiceHandler)
+  server.service = service
+  return server
+
+
+def get_service_arguments(args):
+  """
+  Parses the serve command line. Any argument that is not service specific is
+  applied to every job, eg. --dpi, --workers or --cache-dir.
+  """
+  parser = argparse.ArgumentParser(prog='pdf_sorter serve',
+      description='Run pdf_sorter as a local service that keeps OCR workers and caches warm between jobs')
+
+  parser.add_argument('--host', type=str, required=False, default=DEFAULT_HOST,
+                      help='Optional (default = %s): Host to listen on.' % DEFAULT_HOST)
+
+  parser.add_argument('--port', type=int, required=False, default=DEFAULT_PORT,
+                      help='Optional (default = %d): Port to listen on.' % DEFAULT_PORT)
+
+  parser.add_argument('--socket', type=str, required=False, default=None,
+                      help='Optional: Path of a Unix socket to listen on instead of a port.')
+
+  parser.add_argument('-j', '--jobs', action=argument_handler.PositiveIntegerValidator, type=int, required=False,
+                      default=DEFAULT_CONCURRENT_JOBS,
+                      help='Optional (default = %d): Number of jobs to run at once. All jobs share the same OCR workers.' % DEFAULT_CONCURRENT_JOBS)
+
+  parser.add_argument('--max-queued', action=argument_handler.PositiveIntegerValidator, type=int, required=False,
+                      default=DEFAULT_MAX_QUEUED_JOBS,
+                      help='Optional (default = %d): Maximum number of jobs waiting to run. Further jobs are rejected until the queue drains.' % DEFAULT_MAX_QUEUED_JOBS)
+
+  parser.add_argument('--max-finished', action=argument_handler.PositiveIntegerValidator, type=int, required=False,
+                      default=DEFAULT_MAX_FINISHED_JOBS,
+                      help='Optional (default = %d): Maximum number of finished jobs kept. The oldest finished jobs, and their uploads and results, are removed first.' % DEFAULT_MAX_FINISHED_JOBS)
+
+  parser.add_argument('--finished-ttl', action=argument_handler.PositiveIntegerValidator, type=int, required=False,
+                      default=DEFAULT_FINISHED_JOB_TTL,
+                      help='Optional (default = %d): Seconds a finished job, and its uploads and results, are kept after it finishes.' % DEFAULT_FINISHED_JOB_TTL)
+
+  parser.add_argument('--debug', action="store_const", required=False,
+                      dest="loglevel", const=logging.DEBUG, default=logging.WARNING,
+                      help='[FLAG] Include debug logs in logging output (lowest log level, captures all logs)')
+
+  parser.add_argument('--verbose', action="store_const", required=False,
+                      dest="loglevel", const=logging.INFO, default=logging.WARNING,
+                      help='[FLAG] Include descriptive statements in logging output (excludes debug logging statements)')
+
+  return parser.parse_known_args(args)
+
+
+def main(args):
+  service_args, shared_arguments = get_service_arguments(args)
+  fs_helper.setup_logging(False, service_args.loglevel, 'service')
+
+  service = SortService(shared_arguments, service_args.jobs, service_args.max_queued, service_args.max_finished, service_args.finished_ttl)
+  server = create_server(service, service_args.host, service_args.port, service_args.socket)
+  logger.warning("pdf_sorter service listening on %s" % (service_args.socket or '%s:%d' % (service_args.host, service_args.port)))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    logger.warning("Stopping pdf_sorter service")
+  finally:
+    server.server_close()
+    service.close()
@@ -0,0 +1,353 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pdf_sorter import argument_handler
+from pdf_sorter import fs_helper
+from pdf_sorter import metrics
+from pdf_sorter import ocr_backend
+from pdf_sorter import ocr_cache
+from pdf_sorter import ocr_pool
+from pdf_sorter import pdf_image_sorter
+from pdf_sorter import virtual_document
+
+logger = logging.getLogger('pdf_sorter')
+
+DEFAULT_SHARD_SIZE = 250
+DEFAULT_LOCAL_SHARD_WORKERS = 1
+DEFAULT_SHARD_TIMEOUT = 600
+# How often coordinators check for results, and idle workers for tasks, in seconds
+POLL_SECONDS = 0.2
+# Seconds local workers are given to exit once a job's spool is closed
+WORKER_EXIT_SECONDS = 10
+
+TASKS = 'tasks'
+CLAIMED = 'claimed'
+RESULTS = 'results'
+CLOSED = 'closed'
+
+def get_shards(first_page, page_count, shard_size):
+  """ Splits the (0-based) pages from first_page to page_count into (first_page, last_page) ranges of at most shard_size pages, last_page exclusive """
+  return [(shard_first_page, min(shard_first_page + shard_size, page_count)) for shard_first_page in range(first_page, page_count, shard_size)]
+
+
+def get_worker_name():
+  return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+def write_json(path, data):
+  """ Writes data to a temporary file next to path and renames it, so readers (eg. on another host) never see part of it """
+  temporary_path = '%s.%s.tmp' % (path, get_worker_name())
+  with open(temporary_path, 'w') as json_file:
+    json.dump(data, json_file)
+  os.replace(temporary_path, path)
+
+
+def read_json(path):
+  """ Contents of a JSON file, or None if it doesn't exist """
+  try:
+    with open(path) as json_file:
+      return json.load(json_file)
+  except FileNotFoundError:
+    return None
+
+
+class ShardSpool:
+  """
+  Directory of a sharded job, shared by its coordinator and its workers (eg. on a network
+  share). Each step is a file written or renamed, so no other service is needed:
+  * tasks/<shard>.json: a page range waiting for a worker, with the input files and extraction settings
+  * claimed/<shard>.json: the task moved here by the worker that claimed it. Renames are
+    atomic, so only one worker gets each task. The worker touches it as each page is
+    extracted, and a claim that goes stale (eg. the worker's host went down) is moved back
+    to tasks/
+  * results/<shard>.json: the text of each page of the shard, written by the worker
+  * closed: written by the coordinator once it is done with the job, so its workers exit
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+
+  def get_path(self, subdirectory, shard_number):
+    return os.path.join(self.directory, subdirectory, '%06d.json' % shard_number)
+
+  def create(self):
+    for subdirectory in [TASKS, CLAIMED, RESULTS]:
+      os.makedirs(os.path.join(self.directory, subdirectory), exist_ok=True)
+
+  def add_task(self, shard_number, task):
+    write_json(self.get_path(TASKS, shard_number), task)
+
+  def claim_task(self):
+    """ Claims the first waiting task. Returns the task and the path of its claim, or None if no task is waiting """
+    try:
+      filenames = sorted(os.listdir(os.path.join(self.directory, TASKS)))
+    except FileNotFoundError:
+      return None
+    for filename in filenames:
+      if not filename.endswith('.json'):
+        continue
+      claim_path = os.path.join(self.directory, CLAIMED, filename)
+      try:
+        os.rename(os.path.join(self.directory, TASKS, filename), claim_path)
+        # Renaming keeps the time the task was written, which could already look stale
+        os.utime(claim_path)
+        task = read_json(claim_path)
+      except FileNotFoundError:
+        # Claimed by another worker first
+        continue
+      if task is not None:
+        return task, claim_path
+    return None
+
+  def heartbeat(self, claim_path):
+    """ Marks a claimed task as still being worked on """
+    try:
+      os.utime(claim_path)
+    except FileNotFoundError:
+      # Requeued by the coordinator, but the result is still used if it arrives first
+      pass
+
+  def complete(self, shard_number, result, claim_path):
+    write_json(self.get_path(RESULTS, shard_number), result)
+    for path in [claim_path, self.get_path(TASKS, shard_number)]:
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+
+  def get_result(self, shard_number):
+    return read_json(self.get_path(RESULTS, shard_number))
+
+  def requeue_stale_claims(self, timeout):
+    """ Moves tasks claimed by workers that have not extracted a page for timeout seconds back to the queue """
+    claimed_directory = os.path.join(self.directory, CLAIMED)
+    for filename in os.listdir(claimed_directory):
+      claim_path = os.path.join(claimed_directory, filename)
+      try:
+        if time.time() - os.path.getmtime(claim_path) > timeout:
+          os.rename(claim_path, os.path.join(self.directory, TASKS, filename))
+          logger.warning("Shard %s was not extracted within %d seconds. Queued it again" % (os.path.splitext(filename)[0], timeout))
+      except FileNotFoundError:
+        # Completed in the meantime
+        pass
+
+  def close(self):
+    write_json(os.path.join(self.directory, CLOSED), {'closed': time.time()})
+
+  def is_closed(self):
+    return os.path.exists(os.path.join(self.directory, CLOSED)) or not os.path.isdir(self.directory)
+
+
+class ShardCoordinator:
+  """
+  Extracts the text of a document's pages on shard workers (see run_worker), on this host
+  or any host sharing shard_directory. Has the same extract method as
+  pdf_image_sorter.PageTextExtractor, which each worker runs on its shards with settings
+  (the extractor's keyword arguments).
+  * Each job gets its own spool in shard_directory, and its pages are split into shards of
+    shard_size pages
+  * local_workers worker processes are started on this host, with worker_arguments
+  * Results are yielded in page order as each shard arrives, so the values of the pages
+    (and multipage runs continuing across the end of a shard) are resolved exactly as in
+    a single process run
+  * A shard whose worker has not extracted a page for timeout seconds is handed to another worker
+  """
+
+  def __init__(self, shard_directory, settings, shard_size=DEFAULT_SHARD_SIZE, local_workers=DEFAULT_LOCAL_SHARD_WORKERS,
+      worker_arguments=None, timeout=DEFAULT_SHARD_TIMEOUT, run_metrics=None):
+    self.shard_directory = shard_directory
+    self.settings = settings
+    self.shard_size = shard_size
+    self.local_workers = local_workers
+    self.worker_arguments = worker_arguments or []
+    self.timeout = timeout
+    self.run_metrics = run_metrics or metrics.RunMetrics()
+
+  def start_local_workers(self, spool):
+    command = [sys.executable, '-m', 'pdf_sorter', 'shard-worker', self.shard_directory, '--job', os.path.basename(spool.directory)] + self.worker_arguments
+    return [subprocess.Popen(command) for _ in range(self.local_workers)]
+
+  def stop_local_workers(self, workers):
+    for worker in workers:
+      try:
+        worker.wait(WORKER_EXIT_SECONDS)
+      except subprocess.TimeoutExpired:
+        worker.terminate()
+        worker.wait()
+
+  def wait_for_result(self, spool, shard_number, workers):
+    """ Waits for a shard's result, queueing stale claims again. Raises a RuntimeError if the shard failed, or every local worker stopped """
+    while True:
+      result = spool.get_result(shard_number)
+      if result is not None:
+        if 'error' in result:
+          raise RuntimeError("Shard %d failed on %s: %s" % (shard_number, result['worker'], result['error']))
+        return result
+      if workers and all(worker.poll() is not None for worker in workers):
+        raise RuntimeError("Every local shard worker stopped before shard %d was extracted" % shard_number)
+      spool.requeue_stale_claims(self.timeout)
+      time.sleep(POLL_SECONDS)
+
+  def record_pages(self, page_rows):
+    """ Adds the page metrics recorded by a worker to this run's """
+    for page, source, dpi, render_seconds, ocr_seconds, width, height, confidence, duplicate_of in page_rows:
+      size = None if width is None else (width, height)
+      self.run_metrics.record_page(page, source, dpi, render_seconds, ocr_seconds, size, confidence, duplicate_of)
+
+  def extract(self, document, first_page=0):
+    """ Yields the text of each page of the document from first_page (0-based) on, in page order """
+    document = virtual_document.as_virtual_document(document)
+    shards = get_shards(first_page, document.page_count, self.shard_size)
+    os.makedirs(self.shard_directory, exist_ok=True)
+    spool = ShardSpool(tempfile.mkdtemp(prefix='job_', dir=self.shard_directory))
+    spool.create()
+    pdf_paths = [os.path.abspath(pdf_path) for pdf_path in document.pdf_paths]
+    for shard_number, (shard_first_page, shard_last_page) in enumerate(shards):
+      spool.add_task(shard_number, {'shard': shard_number, 'files': pdf_paths, 'page_counts': document.page_counts,
+        'first_page': shard_first_page, 'last_page': shard_last_page, 'settings': self.settings})
+    logger.info("Queued %d pages as %d shards in %s" % (document.page_count - first_page, len(shards), spool.directory))
+
+    workers = self.start_local_workers(spool)
+    try:
+      for shard_number, (shard_first_page, shard_last_page) in enumerate(shards):
+        with self.run_metrics.stage('shard wait'):
+          result = self.wait_for_result(spool, shard_number, workers)
+        logger.debug("Shard %d (pages %d-%d) extracted by %s" % (shard_number, shard_first_page + 1, shard_last_page, result['worker']))
+        self.record_pages(result['page_rows'])
+        yield from result['pages']
+    finally:
+      spool.close()
+      self.stop_local_workers(workers)
+      shutil.rmtree(spool.directory, ignore_errors=True)
+
+
+def extract_shard(task, pool, cache, spool, claim_path):
+  """ Extracts the text of the pages of a shard task. Returns its result: the text and metrics of each page """
+  document = virtual_document.VirtualDocument(task['files'], task['page_counts'])
+  run_metrics = metrics.RunMetrics()
+  extractor = pdf_image_sorter.PageTextExtractor(pool, cache=cache, run_metrics=run_metrics, **task['settings'])
+  pages = []
+  for page_text in extractor.extract(document, task['first_page'], task['last_page']):
+    pages.append(page_text)
+    spool.heartbeat(claim_path)
+  return {'worker': get_worker_name(), 'pages': pages, 'page_rows': run_metrics.pages}
+
+
+def claim_next_task(shard_directory, job=None):
+  """ Claims the first waiting task of the given job, or of any job in shard_directory. Returns (spool, task, claim path), or None """
+  try:
+    jobs = [job] if job else sorted(os.listdir(shard_directory))
+  except FileNotFoundError:
+    return None
+  for job_name in jobs:
+    spool = ShardSpool(os.path.join(shard_directory, job_name))
+    claimed = spool.claim_task()
+    if claimed is not None:
+      task, claim_path = claimed
+      return spool, task, claim_path
+  return None
+
+
+def run_worker(shard_directory, pool, cache=None, job=None, once=False):
+  """
+  Claims and extracts shards of the jobs in shard_directory. Returns the number of shards extracted.
+  * With job, only shards of that job are extracted, until its coordinator closes it
+  * With once, the worker returns as soon as no task is waiting. Otherwise it keeps
+    waiting for new jobs
+  * A shard that fails is returned to its coordinator as an error
+  """
+  shard_count = 0
+  while True:
+    claimed = claim_next_task(shard_directory, job)
+    if claimed is None:
+      if once or (job and ShardSpool(os.path.join(shard_directory, job)).is_closed()):
+        return shard_count
+      time.sleep(POLL_SECONDS)
+      continue
+
+    spool, task, claim_path = claimed
+    logger.info("Extracting shard %d (pages %d-%d) of %s" % (task['shard'], task['first_page'] + 1, task['last_page'], spool.directory))
+    try:
+      result = extract_shard(task, pool, cache, spool, claim_path)
+    except Exception as error:
+      logger.exception("Shard %d of %s failed" % (task['shard'], spool.directory))
+      result = {'worker': get_worker_name(), 'error': '%s: %s' % (type(error).__name__, error)}
+    try:
+      spool.complete(task['shard'], result, claim_path)
+    except FileNotFoundError:
+      logger.warning("%s was removed before shard %d was extracted" % (spool.directory, task['shard']))
+    shard_count += 1
+
+
+def get_local_worker_arguments(args):
+  """ Arguments of the shard workers a sort starts on this host, matching its own OCR settings """
+  worker_arguments = ['-w', str(args.workers), '--ocr-backend', args.ocr_backend, '--cache-dir', args.cache_dir, '--cache-size', str(args.cache_size)]
+  if args.no_cache:
+    worker_arguments.append('--no-cache')
+  if args.loglevel == logging.DEBUG:
+    worker_arguments.append('--debug')
+  elif args.loglevel == logging.INFO:
+    worker_arguments.append('--verbose')
+  return worker_arguments
+
+
+def main(args):
+  parser = argparse.ArgumentParser(prog='pdf_sorter shard-worker',
+    description='Extract the text of the shards of sorts run with --shard-dir, from the spool directory they share.')
+
+  parser.add_argument('shard_dir', type=str,
+                      help='Spool directory of the sharded sorts (--shard-dir).')
+
+  parser.add_argument('--job', type=str, required=False, default=None,
+                      help='Optional: Only extract shards of this job, and exit once it is done. Used by the workers a sort starts on its own host.')
+
+  parser.add_argument('-w', '--workers', action=argument_handler.PositiveIntegerValidator, type=int, required=False,
+                      default=ocr_pool.default_worker_count(),
+                      help='Optional (default = number of cores): Number of worker processes used to run OCR on the pages of each shard in parallel.')
+
+  parser.add_argument('--ocr-backend', action=argument_handler.OcrBackendValidator, type=str, required=False,
+                      default=ocr_backend.AUTO,
+                      help='Optional (default = auto): OCR backend, pytesseract or tesserocr.')
+
+  parser.add_argument('--cache-dir', action='store', type=str, required=False,
+                      default=ocr_cache.DEFAULT_CACHE_DIRECTORY,
+                      help='Optional (default = %s): Directory of the OCR result cache.' % ocr_cache.DEFAULT_CACHE_DIRECTORY)
+
+  parser.add_argument('--cache-size', action=argument_handler.PositiveIntegerValidator, type=int, required=False,
+                      default=ocr_cache.DEFAULT_CACHE_SIZE_MB,
+                      help='Optional (default = %d): Maximum size of the OCR result cache in MB.' % ocr_cache.DEFAULT_CACHE_SIZE_MB)
+
+  parser.add_argument('--no-cache', action='store_true', required=False,
+                      help='[FLAG] Do not read or write the OCR result cache.')
+
+  parser.add_argument('--once', action='store_true', required=False,
+                      help='[FLAG] Exit as soon as no shard is waiting, instead of waiting for new jobs.')
+
+  parser.add_argument('--debug', action="store_const", required=False,
+                      dest="loglevel",
+                      const=logging.DEBUG,
+                      default=logging.WARNING,
+                      help='[FLAG] Include debug logs in logging output (lowest log level, captures all logs)')
+
+  parser.add_argument('--verbose', action="store_const", required=False,
+                      dest="loglevel",
+                      const=logging.INFO,
+                      default=logging.WARNING,
+                      help='[FLAG] Include descriptive statements in logging output (excludes debug logging statements)')
+
+  worker_args = parser.parse_args(args)
+  fs_helper.setup_logging(False, worker_args.loglevel, 'shard_worker')
+
+  cache = None if worker_args.no_cache else ocr_cache.OcrCache(worker_args.cache_dir, worker_args.cache_size)
+  with ocr_pool.OcrWorkerPool(worker_args.workers, worker_args.workers * 2, worker_args.ocr_backend) as pool:
+    shard_count = run_worker(worker_args.shard_dir, pool, cache, worker_args.job, worker_args.once)
+  logger.info("Extracted %d shards" % shard_count)
+
+  exit(0)
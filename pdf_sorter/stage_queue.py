@@ -0,0 +1,104 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger('pdf_sorter')
+
+# How often a blocked stage checks whether its consumer has stopped, in seconds
+STOP_CHECK_SECONDS = 0.1
+
+class StageError:
+  """ An exception raised by a stage's thread, passed through the queue to be raised again by its consumer """
+
+  def __init__(self, error):
+    self.error = error
+
+
+_DONE = object()
+
+class BackgroundStage:
+  """
+  Pulls items from an iterable (eg. rendered pages) on a background thread into a
+  bounded queue, so producing the next items overlaps with consuming the previous ones.
+  * At most queue_size items wait in the queue. A full queue blocks the thread, so a
+    producer can't run ahead of its consumer (backpressure)
+  * Items are yielded in order. An exception in the thread is raised by the consumer
+  * The thread's busy time (pulling items) and blocked time (waiting for room in the
+    queue) are recorded as the stage's utilization, and the consumer's time waiting for
+    items as a '<name> wait' stage, if run_metrics are provided
+  * Use as a context manager: leaving it stops the thread and waits for it, eg. before
+    the directory the items are written to is removed
+  """
+
+  def __init__(self, items, name, queue_size, run_metrics=None):
+    self.name = name
+    self.run_metrics = run_metrics
+    self._items = items
+    self._queue = queue.Queue(max(1, queue_size))
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name='pdf_sorter_%s' % name, daemon=True)
+    self._thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def _put(self, item):
+    """ Waits for room in the queue. Returns False if the consumer stopped first """
+    while not self._stop.is_set():
+      try:
+        self._queue.put(item, timeout=STOP_CHECK_SECONDS)
+        return True
+      except queue.Full:
+        continue
+    return False
+
+  def _run(self):
+    busy_seconds = blocked_seconds = 0
+    items = iter(self._items)
+    try:
+      while not self._stop.is_set():
+        start_time = time.perf_counter()
+        try:
+          item = next(items)
+        except StopIteration:
+          self._put(_DONE)
+          break
+        pulled_time = time.perf_counter()
+        busy_seconds += pulled_time - start_time
+        put = self._put(item)
+        blocked_seconds += time.perf_counter() - pulled_time
+        if not put:
+          break
+    except Exception as error:
+      self._put(StageError(error))
+    finally:
+      close = getattr(items, 'close', None)
+      if close is not None:
+        close()
+      if self.run_metrics is not None:
+        self.run_metrics.record_utilization(self.name, busy_seconds, busy_seconds + blocked_seconds)
+      logger.debug("%s stage busy for %.3fs, blocked for %.3fs" % (self.name, busy_seconds, blocked_seconds))
+
+  def __iter__(self):
+    wait_seconds = 0
+    try:
+      while True:
+        start_time = time.perf_counter()
+        item = self._queue.get()
+        wait_seconds += time.perf_counter() - start_time
+        if item is _DONE:
+          return
+        if isinstance(item, StageError):
+          raise item.error
+        yield item
+    finally:
+      if self.run_metrics is not None:
+        self.run_metrics.add_stage_time(self.name + ' wait', wait_seconds)
+
+  def close(self):
+    self._stop.set()
+    self._thread.join()
@@ -0,0 +1,99 @@
+import logging
+import random
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger('pdf_sorter')
+
+PAGE_WIDTH_INCHES = 8.5
+PAGE_HEIGHT_INCHES = 11
+FONT_SIZE_POINTS = 14
+DEFAULT_CRITERIA_KEY = 'Order:'
+ITEM_NAMES = ['Widget', 'Bracket', 'Gasket', 'Sprocket', 'Hinge', 'Spacer', 'Washer', 'Bearing', 'Valve', 'Coupler']
+
+def get_font(dpi):
+  """ Font of FONT_SIZE_POINTS at the page dpi, or Pillow's small bitmap font on older versions of Pillow """
+  try:
+    return ImageFont.load_default(size=FONT_SIZE_POINTS * dpi // 72)
+  except TypeError:
+    return ImageFont.load_default()
+
+
+def get_key_origin(layout, page_size):
+  """
+  Top left corner of the order details for the layout, which is the
+  quadrant (1-4, numbered as for --quadrant) the criteria key is printed in
+  """
+  width, height = page_size
+  margin = width // 12
+  left = margin if layout in [1, 3] else width // 2 + margin // 2
+  top = margin if layout in [1, 2] else height // 2 + margin // 2
+  return left, top
+
+
+def add_noise(image, noise, randomizer):
+  """ Flips a `noise` fraction of the pixels of a 1-bit page image, like scanner speckle """
+  pixels = image.load()
+  width, height = image.size
+  for _ in range(int(width * height * noise)):
+    x, y = randomizer.randrange(width), randomizer.randrange(height)
+    pixels[x, y] = 255 - pixels[x, y]
+
+
+def draw_page(order_value, page_of_order, pages_in_order, criteria_key, dpi, layout, noise, randomizer):
+  """
+  Draws one page of a packing list as a 1-bit image. The criteria key and order value
+  are only printed on the first page of an order, so later pages are multi-page
+  continuations
+  """
+  page_size = (int(PAGE_WIDTH_INCHES * dpi), int(PAGE_HEIGHT_INCHES * dpi))
+  image = Image.new('1', page_size, 1)
+  draw = ImageDraw.Draw(image)
+  font = get_font(dpi)
+  line_height = FONT_SIZE_POINTS * dpi * 2 // 72
+
+  left, top = get_key_origin(layout, page_size)
+  lines = ['PACKING LIST', 'Page %d of %d' % (page_of_order, pages_in_order)]
+  if page_of_order == 1:
+    lines.insert(1, '%s %s' % (criteria_key, order_value))
+  for line_number, line in enumerate(lines):
+    draw.text((left, top + line_number * line_height), line, font=font, fill=0)
+
+  # Line items fill the quadrants without the order details
+  item_left, item_top = get_key_origin(5 - layout, page_size)
+  for line_number in range(randomizer.randint(3, 8)):
+    line = '%s %05d Qty %d' % (randomizer.choice(ITEM_NAMES), randomizer.randrange(100000), randomizer.randint(1, 20))
+    draw.text((item_left, item_top + line_number * line_height), line, font=font, fill=0)
+
+  if noise:
+    add_noise(image, noise, randomizer)
+  return image
+
+
+def generate_packing_list(pdf_path, page_count, dpi=150, noise=0.0, layout=1, multipage_ratio=0.2,
+    criteria_key=DEFAULT_CRITERIA_KEY, seed=0):
+  """
+  Writes an image-only PDF of synthetic packing lists with known criteria values, one page at a time.
+  * Every order has a unique numeric value, printed after the criteria key on its first page
+  * multipage_ratio of the orders span 2-3 pages, with the key only on the first page
+  * layout is the quadrant (1-4) of the page the criteria key is printed in
+  * noise is the fraction of pixels flipped on each page
+  Returns the expected value of each page, in page order, and the order values in a
+  shuffled sort order.
+  """
+  randomizer = random.Random(seed)
+  order_values = iter(randomizer.sample(range(10000, 99999), page_count))
+  page_values = []
+  while len(page_values) < page_count:
+    order_value = str(next(order_values))
+    pages_in_order = randomizer.randint(2, 3) if randomizer.random() < multipage_ratio else 1
+    pages_in_order = min(pages_in_order, page_count - len(page_values))
+    for page_of_order in range(1, pages_in_order + 1):
+      image = draw_page(order_value, page_of_order, pages_in_order, criteria_key, dpi, layout, noise, randomizer)
+      # Each page is appended to the PDF as it is drawn, so only one page image is held in memory
+      image.save(pdf_path, append=bool(page_values), resolution=dpi)
+      page_values.append(order_value)
+  logger.info("Generated %d page packing list %s" % (page_count, pdf_path))
+
+  sort_values = list(dict.fromkeys(page_values))
+  randomizer.shuffle(sort_values)
+  return page_values, sort_values
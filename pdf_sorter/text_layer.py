@@ -0,0 +1,50 @@
+import logging
+import subprocess
+from xml.etree import ElementTree
+
+logger = logging.getLogger('pdf_sorter')
+
+XHTML_NAMESPACE = '{http://www.w3.org/1999/xhtml}'
+
+def get_text_layer_tokens(bbox_layout):
+  """
+  Converts pdftotext -bbox-layout output into one token list per page.
+  Token lists follow the same layout as the text returned by tesseract's image_to_data,
+  so criteria values are found at the same relative index as in OCR'd pages:
+  * An empty string for the page, each block and paragraph, and each line
+  * Followed by the words of that line
+  """
+  root = ElementTree.fromstring(bbox_layout)
+  pages = []
+  for page in root.iter(XHTML_NAMESPACE + 'page'):
+    tokens = ['']
+    for flow in page.iter(XHTML_NAMESPACE + 'flow'):
+      tokens.append('')
+      for block in flow.iter(XHTML_NAMESPACE + 'block'):
+        tokens.append('')
+        for line in block.iter(XHTML_NAMESPACE + 'line'):
+          tokens.append('')
+          tokens.extend(word.text for word in line.iter(XHTML_NAMESPACE + 'word') if word.text)
+    pages.append(tokens)
+  return pages
+
+
+def extract_text_layer(pdf_path, first_page=None, last_page=None):
+  """
+  Returns the words of each page's embedded text layer using pdftotext.
+  Only pages first_page to last_page (1-based, inclusive) are read if given, eg. for a shard.
+  Pages without a text layer (eg. scanned images) return a list with no words.
+  Returns None if the text layer can not be read, in which case every page should be OCR'd.
+  """
+  command = ['pdftotext', '-bbox-layout']
+  if first_page is not None:
+    command += ['-f', str(first_page)]
+  if last_page is not None:
+    command += ['-l', str(last_page)]
+  command += [pdf_path, '-']
+  try:
+    output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+    return get_text_layer_tokens(output)
+  except (OSError, subprocess.CalledProcessError, ElementTree.ParseError) as error:
+    logger.warning("Could not read text layer of %s (%s). Using OCR for all pages." % (pdf_path, error))
+    return None
@@ -0,0 +1,71 @@
+from bisect import bisect_right
+import logging
+from pdf_sorter import rasterizer
+
+logger = logging.getLogger('pdf_sorter')
+
+class VirtualDocument:
+  """
+  Several input PDF files treated as a single document, in the order provided,
+  without ever writing a merged copy to disk.
+  * Global page indexes run across all files, eg. the first page of the second file
+    follows the last page of the first file
+  * Each global page maps back to its (source file, local page) so pages can be
+    rendered and copied straight from the original files
+  """
+
+  def __init__(self, pdf_paths, page_counts=None):
+    self.pdf_paths = list(pdf_paths)
+    self.page_counts = page_counts or [rasterizer.get_page_count(pdf_path) for pdf_path in self.pdf_paths]
+    self.page_offsets = []
+    offset = 0
+    for page_count in self.page_counts:
+      self.page_offsets.append(offset)
+      offset += page_count
+    self.page_count = offset
+    if len(self.pdf_paths) > 1:
+      logger.info("Treating %s as a single document of %d pages" % (self.pdf_paths, self.page_count))
+
+  def get_source_page(self, page_index):
+    """ Maps a global (0-based) page index to its (source file, local 0-based page index) """
+    if page_index < 0 or page_index >= self.page_count:
+      raise IndexError("Page %d out of range for document of %d pages" % (page_index, self.page_count))
+    # The last file starting at or before the page, which skips over any empty files
+    source = bisect_right(self.page_offsets, page_index) - 1
+    return self.pdf_paths[source], page_index - self.page_offsets[source]
+
+  def get_sources(self):
+    """ Returns (source file, global index of its first page, page count) for each file """
+    return list(zip(self.pdf_paths, self.page_offsets, self.page_counts))
+
+  def split_page_range(self, first_page, last_page):
+    """
+    Splits the global (0-based) pages from first_page to last_page (exclusive) into (source
+    file, global index of its first page, local first page, local last page (exclusive))
+    for each file they cover, in document order
+    """
+    split = []
+    for pdf_path, offset, page_count in self.get_sources():
+      local_first_page, local_last_page = max(first_page - offset, 0), min(last_page - offset, page_count)
+      if local_first_page < local_last_page:
+        split.append((pdf_path, offset, local_first_page, local_last_page))
+    return split
+
+  def split_page_numbers(self, page_numbers):
+    """
+    Splits sorted global (1-based) page numbers into (source file, local 1-based page numbers)
+    for each source file, in document order
+    """
+    page_numbers = sorted(page_numbers)
+    split = []
+    for pdf_path, offset, page_count in self.get_sources():
+      local_page_numbers = [page_number - offset for page_number in page_numbers if offset < page_number <= offset + page_count]
+      split.append((pdf_path, local_page_numbers))
+    return split
+
+
+def as_virtual_document(document):
+  """ Accepts either a VirtualDocument or the path of a single PDF file """
+  if isinstance(document, VirtualDocument):
+    return document
+  return VirtualDocument([document])
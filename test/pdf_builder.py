@@ -0,0 +1,27 @@
+""" Minimal PDFs built in memory for tests, without any PDF library """
+
+def build_pdf(objects):
+  """ Builds a PDF of the given objects, numbered from 1, with the first as the catalog """
+  pdf = b'%PDF-1.4\n'
+  offsets = []
+  for number, obj in enumerate(objects, 1):
+    offsets.append(len(pdf))
+    pdf += b'%d 0 obj\n%s\nendobj\n' % (number, obj)
+  xref_offset = len(pdf)
+  pdf += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+  pdf += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+  pdf += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref_offset)
+  return pdf
+
+
+def build_pdf_from_contents(page_contents):
+  """ Builds a PDF with one letter size page per content stream """
+  page_count = len(page_contents)
+  objects = [
+    b'<< /Type /Catalog /Pages 2 0 R >>',
+    b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % (3 + 2*i) for i in range(page_count)), page_count)
+  ]
+  for i, content in enumerate(page_contents):
+    objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R >>' % (4 + 2*i))
+    objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content))
+  return build_pdf(objects)
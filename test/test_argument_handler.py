@@ -1,4 +1,5 @@
 import logging
+import os
 from unittest import TestCase, main, mock
 from unittest.mock import patch
 from pdf_sorter  import argument_handler
@@ -32,6 +33,9 @@ class TestArgumentHandler(TestCase):
   VALID_DPI = '125'
   INVALID_DPI = '50'
 
+  VALID_WORKERS = '4'
+  INVALID_WORKERS = '0'
+
 
   def mock_file_exists(self, arg):
     return self.EXISTS in arg
@@ -63,7 +67,9 @@ class TestArgumentHandler(TestCase):
     dpi_arg = self.get_arg(nameset['dpi'], dpi)
     settings = flags.split() if flags else []
 
-    return [nameset['sort'], sort, nameset['files'], files, nameset['output'], output, nameset['criteria'], criteria] + index_arg + quadrant_arg + dpi_arg + settings
+    criteria_arg = self.get_arg(nameset['criteria'], criteria)
+
+    return [nameset['sort'], sort, nameset['files'], files, nameset['output'], output] + criteria_arg + index_arg + quadrant_arg + dpi_arg + settings
 
   def setUp(self):
     self.patcher = patch('pdf_sorter.argument_handler.os.path.exists')
@@ -108,6 +114,22 @@ class TestArgumentHandler(TestCase):
     self.assertEqual(actual.override, False)
     self.assertEqual(actual.multipage, False)
     self.assertEqual(actual.explore, False)
+    self.assertEqual(actual.workers, os.cpu_count())
+    self.assertEqual(actual.page_budget, None)
+    self.assertEqual(actual.render_threads, 4)
+    self.assertEqual(actual.text_layer, False)
+    self.assertEqual(actual.no_cache, False)
+    self.assertEqual(actual.cache_dir, 'output/cache')
+    self.assertEqual(actual.cache_size, 512)
+    self.assertEqual(actual.adaptive_dpi, None)
+    self.assertEqual(actual.min_confidence, 60)
+    self.assertEqual(actual.targeted, False)
+    self.assertEqual(actual.statsd, None)
+    self.assertEqual(actual.from_index, False)
+    self.assertEqual(actual.chunk_size, None)
+    self.assertEqual(actual.explore_format, 'csv')
+    self.assertEqual(actual.resume, False)
+    self.assertEqual(actual.ocr_backend, 'auto')
 
   """ Sort file tests """
 
@@ -181,6 +203,38 @@ class TestArgumentHandler(TestCase):
     self.assertEqual(actual.criteria, self.VALID_CRITERIA)
     self.assertEqual(actual.index, -10)
 
+  """ Several criteria tests """
+
+  def test_valid_several_criteria(self):
+    test_args = ['-s', self.VALID_SORT_FILE, self.EXISTS + '2.txt', '-f', self.VALID_INPUT_PDF_FILE,
+      '-o', self.VALID_OUTPUT_PDF_FILE, 'colors.pdf', '-c', self.VALID_CRITERIA, 'Color:', '-i', '2']
+    actual = argument_handler.get_valid_arguments(test_args)
+
+    self.assertEqual(actual.sort_targets, [
+      argument_handler.SortTarget(self.VALID_CRITERIA, 2, self.VALID_SORT_FILE, './output/' + self.VALID_OUTPUT_PDF_FILE),
+      argument_handler.SortTarget('Color:', 2, self.EXISTS + '2.txt', './output/colors.pdf')])
+    self.assertEqual((actual.criteria, actual.index, actual.sort), (self.VALID_CRITERIA, 2, self.VALID_SORT_FILE))
+
+  def test_invalid_several_criteria_without_outputs(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, [self.VALID_CRITERIA, 'Color:'])
+
+    with self.assertRaises(SystemExit):
+      argument_handler.get_valid_arguments(test_args)
+
+  def test_invalid_several_criteria_indexes(self):
+    test_args = ['-s', self.VALID_SORT_FILE, self.VALID_SORT_FILE, '-f', self.VALID_INPUT_PDF_FILE,
+      '-o', self.VALID_OUTPUT_PDF_FILE, 'colors.pdf', '-c', self.VALID_CRITERIA, 'Color:', '-i', '1', '2', '3']
+
+    with self.assertRaises(SystemExit):
+      argument_handler.get_valid_arguments(test_args)
+
+  def test_invalid_repeated_output(self):
+    test_args = ['-s', self.VALID_SORT_FILE, self.VALID_SORT_FILE, '-f', self.VALID_INPUT_PDF_FILE,
+      '-o', self.VALID_OUTPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, '-c', self.VALID_CRITERIA, 'Color:']
+
+    with self.assertRaises(SystemExit):
+      argument_handler.get_valid_arguments(test_args)
+
   """ DPI value tests """
 
   def test_valid_dpi(self):
@@ -195,6 +249,96 @@ class TestArgumentHandler(TestCase):
     with self.assertRaises(SystemExit):
       argument_handler.get_valid_arguments(test_args)
 
+  def test_valid_adaptive_dpi(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--min-confidence 80 --adaptive-dpi 200 120 200")
+    actual = argument_handler.get_valid_arguments(test_args)
+
+    self.assertEqual(actual.adaptive_dpi, [120, 200])
+    self.assertEqual(actual.min_confidence, 80)
+
+  def test_invalid_adaptive_dpi(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--adaptive-dpi 120 " + self.INVALID_DPI)
+
+    with self.assertRaises(SystemExit):
+      argument_handler.get_valid_arguments(test_args)
+
+  def test_invalid_min_confidence(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--min-confidence 101")
+
+    with self.assertRaises(SystemExit):
+      argument_handler.get_valid_arguments(test_args)
+
+  """ Worker count tests """
+
+  def test_valid_workers(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "-w " + self.VALID_WORKERS)
+    actual = argument_handler.get_valid_arguments(test_args)
+
+    self.assertEqual(actual.workers, int(self.VALID_WORKERS))
+
+  def test_invalid_workers(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--workers " + self.INVALID_WORKERS)
+
+    with self.assertRaises(SystemExit):
+      argument_handler.get_valid_arguments(test_args)
+
+  def test_valid_page_budget(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--page-budget 16 --render-threads 2")
+    actual = argument_handler.get_valid_arguments(test_args)
+
+    self.assertEqual(actual.page_budget, 16)
+    self.assertEqual(actual.render_threads, 2)
+
+  def test_invalid_page_budget(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--page-budget 0")
+
+    with self.assertRaises(SystemExit):
+      argument_handler.get_valid_arguments(test_args)
+
+  def test_valid_chunk_size(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--chunk-size 50")
+    actual = argument_handler.get_valid_arguments(test_args)
+
+    self.assertEqual(actual.chunk_size, 50)
+
+  def test_valid_statsd(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--statsd localhost:8125")
+    actual = argument_handler.get_valid_arguments(test_args)
+
+    self.assertEqual(actual.statsd, ('localhost', 8125))
+
+  def test_invalid_statsd(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--statsd localhost")
+
+    with self.assertRaises(SystemExit):
+      argument_handler.get_valid_arguments(test_args)
+
+  def test_invalid_explore_format(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--explore-format xlsx")
+
+    with self.assertRaises(SystemExit):
+      argument_handler.get_valid_arguments(test_args)
+
+  def test_parquet_explore_format_requires_pyarrow(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--explore-format parquet")
+
+    with patch.dict('sys.modules', {'pyarrow': None}):
+      with self.assertRaises(SystemExit):
+        argument_handler.get_valid_arguments(test_args)
+
+  def test_invalid_ocr_backend(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--ocr-backend easyocr")
+
+    with self.assertRaises(SystemExit):
+      argument_handler.get_valid_arguments(test_args)
+
+  def test_tesserocr_backend_requires_tesserocr(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--ocr-backend tesserocr")
+
+    with patch.dict('sys.modules', {'tesserocr': None}):
+      with self.assertRaises(SystemExit):
+        argument_handler.get_valid_arguments(test_args)
+
   """ Quadrant value tests """
 
   def test_valid_quadrant_one_value(self):
@@ -241,6 +385,30 @@ class TestArgumentHandler(TestCase):
 
     self.assertEqual(actual.reverse, True)
   
+  def test_flag_text_layer(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--text-layer")
+    actual = argument_handler.get_valid_arguments(test_args)
+
+    self.assertEqual(actual.text_layer, True)
+
+  def test_flag_no_cache(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--no-cache")
+    actual = argument_handler.get_valid_arguments(test_args)
+
+    self.assertEqual(actual.no_cache, True)
+
+  def test_flag_from_index(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--from-index")
+    actual = argument_handler.get_valid_arguments(test_args)
+
+    self.assertEqual(actual.from_index, True)
+
+  def test_flag_targeted(self):
+    test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--targeted")
+    actual = argument_handler.get_valid_arguments(test_args)
+
+    self.assertEqual(actual.targeted, True)
+
   def test_flag_debug(self):
     test_args = self.build_sys_args(True, self.VALID_SORT_FILE, self.VALID_INPUT_PDF_FILE, self.VALID_OUTPUT_PDF_FILE, self.VALID_CRITERIA, flags = "--debug")
     actual = argument_handler.get_valid_arguments(test_args)
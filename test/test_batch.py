@@ -0,0 +1,124 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+from pdf_sorter import batch
+from textwrap import dedent
+
+class TestBatch(TestCase):
+
+  EXISTS = 'existsyepyep'
+
+  TEST_JOBS = [
+    {'name': 'route-1', 'files': [EXISTS + '1.pdf', EXISTS + '2.pdf'], 'sort': EXISTS + '.txt', 'output': 'route1.pdf', 'criteria': 'Order', 'index': 2, 'multipage': True},
+    {'files': EXISTS + '3.pdf', 'sort': EXISTS + '.txt', 'output': 'route2.pdf', 'criteria': 'Color:'}
+  ]
+
+  TEST_CSV_MANIFEST = dedent("""
+    name,files,sort,output,criteria,index,quadrant,multipage,reverse
+    route-1,a.pdf;b.pdf,route1.txt,route1.pdf,Order,2,1 2,true,
+    ,c.pdf,route2.txt,route2.pdf,Color:,,,,yes
+    """).strip()
+
+  def mock_file_exists(self, arg):
+    return self.EXISTS in arg
+
+  def setUp(self):
+    self.temp_directory = tempfile.TemporaryDirectory()
+    self.patcher = patch('pdf_sorter.argument_handler.os.path.exists')
+    self.mock_os_path_exists = self.patcher.start()
+    self.mock_os_path_exists.side_effect = self.mock_file_exists
+
+  def tearDown(self):
+    self.patcher.stop()
+    self.temp_directory.cleanup()
+
+  def write_manifest(self, filename, contents):
+    manifest_path = os.path.join(self.temp_directory.name, filename)
+    with open(manifest_path, 'w') as manifest:
+      manifest.write(contents)
+    return manifest_path
+
+  """ Manifests """
+
+  def test_read_json_manifest(self):
+    manifest_path = self.write_manifest('jobs.json', json.dumps({'jobs': self.TEST_JOBS}))
+    self.assertEqual(batch.read_manifest(manifest_path), self.TEST_JOBS)
+
+  def test_read_csv_manifest(self):
+    manifest_path = self.write_manifest('jobs.csv', self.TEST_CSV_MANIFEST)
+    jobs = batch.read_manifest(manifest_path)
+
+    self.assertEqual(len(jobs), 2)
+    self.assertEqual(batch.get_job_arguments(jobs[0], []),
+      ['-s', 'route1.txt', '-f', 'a.pdf', 'b.pdf', '-o', 'route1.pdf', '-c', 'Order', '-i', '2', '-q', '1', '2', '--multipage'])
+    self.assertEqual(batch.get_job_arguments(jobs[1], ['-d', '200']),
+      ['-s', 'route2.txt', '-f', 'c.pdf', '-o', 'route2.pdf', '-c', 'Color:', '--reverse', '-d', '200'])
+    self.assertEqual(batch.get_job_name(jobs[1]), 'route2.pdf')
+
+  def test_read_manifest_missing_field(self):
+    manifest_path = self.write_manifest('jobs.json', json.dumps([{'files': 'a.pdf', 'sort': 'a.txt'}]))
+    with self.assertRaises(ValueError):
+      batch.read_manifest(manifest_path)
+
+  def test_read_manifest_bad_extension(self):
+    manifest_path = self.write_manifest('jobs.txt', '')
+    with self.assertRaises(ValueError):
+      batch.read_manifest(manifest_path)
+
+  """ Running jobs """
+
+  @patch('pdf_sorter.batch.pipeline.run_job')
+  def test_run_batch_shares_pool(self, mock_run_job):
+    mock_run_job.side_effect = lambda args, pool, cache, explore_file, run_metrics: args.output
+    invalid_job = dict(self.TEST_JOBS[1], sort='missing.txt')
+
+    statuses = batch.run_batch(self.TEST_JOBS + [invalid_job], ['-w', '1', '--no-cache', '--override'])
+
+    self.assertEqual([status['status'] for status in statuses], ['success', 'success', 'invalid'])
+    self.assertEqual(statuses[0]['output'], './output/route1.pdf')
+    pools = set(id(call.args[1]) for call in mock_run_job.call_args_list)
+    self.assertEqual(len(pools), 1)
+    job_args = mock_run_job.call_args_list[0].args[0]
+    self.assertEqual(job_args.workers, 1)
+    self.assertIn('stages', statuses[0]['metrics'])
+
+  @patch('pdf_sorter.batch.pipeline.run_job')
+  def test_run_batch_explore_job(self, mock_run_job):
+    def run_job(args, pool, cache, explore_file, run_metrics):
+      # The explore file can be written on a fresh checkout, with no ./output/data yet
+      self.assertTrue(os.path.isdir(os.path.dirname(explore_file)))
+      return explore_file
+    mock_run_job.side_effect = run_job
+    working_directory = os.getcwd()
+    os.chdir(self.temp_directory.name)
+    try:
+      statuses = batch.run_batch([dict(self.TEST_JOBS[1], explore=True)], ['-w', '1', '--no-cache', '--override'])
+    finally:
+      os.chdir(working_directory)
+
+    self.assertEqual(statuses[0]['status'], 'success')
+    self.assertEqual(statuses[0]['output'], './output/data/route2.csv')
+
+  @patch('pdf_sorter.batch.pipeline.run_job')
+  def test_run_batch_job_failure(self, mock_run_job):
+    mock_run_job.side_effect = RuntimeError('poppler failed')
+
+    statuses = batch.run_batch(self.TEST_JOBS[:1], ['-w', '1', '--no-cache', '--override'])
+
+    self.assertEqual(statuses[0]['status'], 'failed')
+    self.assertEqual(statuses[0]['error'], 'poppler failed')
+
+  def test_write_batch_summary(self):
+    statuses = [{'name': 'a', 'status': 'success'}, {'name': 'b', 'status': 'failed'}]
+    summary_path = os.path.join(self.temp_directory.name, 'summary.json')
+
+    batch.write_batch_summary('jobs.json', statuses, 1.5, summary_path)
+
+    with open(summary_path) as summary_file:
+      summary = json.load(summary_file)
+    self.assertEqual((summary['succeeded'], summary['failed'], summary['jobs']), (1, 1, statuses))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+from unittest import TestCase, main
+from unittest.mock import patch
+import tempfile
+from pdf_sorter import benchmark
+from pdf_sorter import ocr_pool
+from pdf_sorter import synthetic_documents
+
+class TestBenchmark(TestCase):
+
+  CONFIG = {'pages': 6, 'document_dpi': 20, 'noise': 0.0, 'layout': 1, 'multipage_ratio': 0, 'seed': 1,
+    'dpi': 300, 'quadrant': [0], 'workers': 1, 'page_budget': 2, 'render_threads': 1}
+
+  def setUp(self):
+    self.temp_directory = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.temp_directory.cleanup()
+
+  def get_results(self, stage_seconds, page_accuracy=1.0):
+    stages = {stage: {'seconds': seconds} for stage, seconds in stage_seconds.items()}
+    return {'stages': stages, 'total': {'seconds': sum(stage_seconds.values())},
+      'accuracy': {'page_accuracy': page_accuracy, 'order_accuracy': page_accuracy}}
+
+  def test_get_accuracy(self):
+    page_values = ['1', '1', '2', '3']
+    self.assertEqual(benchmark.get_accuracy({'1': [0, 1], '2': [2], '3': [3]}, page_values),
+      {'page_accuracy': 1.0, 'order_accuracy': 1.0, 'orders_expected': 3, 'orders_found': 3})
+    self.assertEqual(benchmark.get_accuracy({'1': [0], '8': [2, 3]}, page_values),
+      {'page_accuracy': 0.25, 'order_accuracy': 0.0, 'orders_expected': 3, 'orders_found': 2})
+
+  @patch('pdf_sorter.benchmark.pdf_image_sorter.extract_ocr_data_from_image')
+  @patch('pdf_sorter.benchmark.pdf_image_sorter.convert_document_to_images')
+  def test_run_benchmark(self, mock_convert, mock_ocr):
+    generated = {}
+    generate_packing_list = synthetic_documents.generate_packing_list
+    def generate(*args):
+      generated['page_values'], sort_values = generate_packing_list(*args)
+      return generated['page_values'], sort_values
+
+    def ocr_page(page_number):
+      # OCR reads every key perfectly, except on the last page
+      page_values = generated['page_values']
+      page_index = page_number - 1
+      first_page = (page_index == 0 or page_values[page_index] != page_values[page_index - 1]) and page_index != len(page_values) - 1
+      extracted_text = ['PACKING', 'LIST', 'Order:', page_values[page_index]] if first_page else ['PACKING', 'LIST']
+      return extracted_text, [90] * len(extracted_text)
+
+    # Rendered pages stand in as their page numbers
+    mock_convert.side_effect = lambda *args: iter(args[-1])
+    mock_ocr.side_effect = ocr_page
+    with patch('pdf_sorter.benchmark.synthetic_documents.generate_packing_list', side_effect=generate):
+      with ocr_pool.OcrWorkerPool(1) as pool:
+        results = benchmark.run_benchmark(self.CONFIG, self.temp_directory.name, pool)
+
+    # Pages are extracted by the sort's PageTextExtractor, streamed in windows of the page budget
+    mock_convert.assert_called_once_with(self.temp_directory.name + '/benchmark.pdf', 300, [0], 2, 1, list(range(1, 7)))
+    self.assertIn('render wait', results['extract_metrics']['stages'])
+    self.assertEqual(sum(results['extract_metrics']['pages'].values()), 6)
+    self.assertEqual(list(results['stages']), ['generate'] + benchmark.STAGES)
+    self.assertEqual(results['total']['seconds'], round(sum(results['stages'][stage]['seconds'] for stage in benchmark.STAGES), 4))
+    self.assertGreater(results['total']['peak_rss_mb'], 0)
+    self.assertEqual(results['accuracy']['orders_expected'], len(set(generated['page_values'])))
+    # Without its key the last page is attached to the order before it
+    self.assertEqual(results['accuracy']['page_accuracy'], 0.8333)
+    self.assertEqual(results['accuracy']['order_accuracy'], 0.6667)
+
+  def test_compare_results(self):
+    previous = self.get_results({'extract': 10, 'write': 1})
+    self.assertEqual(benchmark.compare_results(self.get_results({'extract': 10.5, 'write': 1}), previous), [])
+
+    regressions = benchmark.compare_results(self.get_results({'extract': 15, 'write': 1}, 0.9), previous)
+    self.assertEqual(regressions, [
+      'extract is 50% slower (15.00s vs 10.00s)',
+      'total is 45% slower (16.00s vs 11.00s)',
+      'page_accuracy dropped from 1.0000 to 0.9000',
+      'order_accuracy dropped from 1.0000 to 0.9000'
+    ])
+
+  def test_get_benchmark_arguments(self):
+    args = benchmark.get_benchmark_arguments(['-p', '40', '--noise', '0.01', '--layout', '2', '-w', '2'])
+    config = benchmark.get_config(args)
+    self.assertEqual(config['pages'], 40)
+    self.assertEqual(config['noise'], 0.01)
+    self.assertEqual(config['layout'], 2)
+    self.assertEqual(config['page_budget'], 4)
+    self.assertEqual(config['quadrant'], [0])
+
+
+if __name__ == '__main__':
+  main()
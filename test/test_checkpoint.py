@@ -0,0 +1,149 @@
+import csv
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase, main
+from unittest.mock import patch
+from pdf_sorter import argument_handler
+from pdf_sorter import checkpoint
+from pdf_sorter import data_explorer
+from pdf_sorter import pipeline
+
+class TestCheckpoint(TestCase):
+
+  SETTINGS = {'criteria': 'Order', 'index': 1, 'multipage': True}
+  PAGE_TEXT = [['Order', '1'], ['more'], ['Order', '2'], ['Order', '3'], ['more']]
+
+  def setUp(self):
+    self.temp_directory = tempfile.TemporaryDirectory()
+    self.pdf_path = os.path.join(self.temp_directory.name, 'route.pdf')
+    with open(self.pdf_path, 'wb') as pdf_file:
+      pdf_file.write(b'%PDF-1.4')
+    self.patcher = patch('pdf_sorter.checkpoint.fs_helper.create_subdirectory_if_needed')
+    self.patcher.start().return_value = self.temp_directory.name + '/'
+    self.header = checkpoint.get_journal_header([self.pdf_path], 'route_sorted.pdf', self.SETTINGS)
+    self.journal_path = checkpoint.get_journal_path(self.header)
+
+  def tearDown(self):
+    self.patcher.stop()
+    self.temp_directory.cleanup()
+
+  def write_journal(self, page_values):
+    with checkpoint.ExtractionJournal(self.journal_path, self.header) as journal:
+      list(journal.record(page_values))
+
+  def test_load_journal(self):
+    self.write_journal(['1', None, '2'])
+    with open(self.journal_path, 'a') as journal_file:
+      # Killed while writing the next page
+      journal_file.write('[3, "3')
+
+    self.assertEqual(checkpoint.load_journal(self.journal_path, self.header), ['1', None, '2'])
+
+  def test_load_journal_different_job(self):
+    self.write_journal(['1', None, '2'])
+    other_header = checkpoint.get_journal_header([self.pdf_path], 'route_sorted.pdf', dict(self.SETTINGS, index=2))
+
+    self.assertEqual(checkpoint.load_journal(self.journal_path, other_header), [])
+    self.assertNotEqual(checkpoint.get_journal_path(other_header), self.journal_path)
+
+  def test_load_missing_journal(self):
+    self.assertEqual(checkpoint.load_journal(self.journal_path, self.header), [])
+
+  def test_resumed_values_rewritten(self):
+    with checkpoint.ExtractionJournal(self.journal_path, self.header, ['1', None]) as journal:
+      list(journal.record(['2']))
+
+    self.assertEqual(checkpoint.load_journal(self.journal_path, self.header), ['1', None, '2'])
+
+  def get_job_args(self, sort_targets):
+    return SimpleNamespace(files=[self.pdf_path], output=sort_targets[0].output, dpi=300, quadrant=[0], criteria=sort_targets[0].criteria, index=1,
+      multipage=True, explore=False, page_budget=None, workers=1, render_threads=1, text_layer=False, adaptive_dpi=None,
+      min_confidence=60, targeted=False, no_dedup=False, blank_ink=None, drop_blank=False, shard_dir=None, from_index=False, resume=True, sort='route.txt', reverse=False, chunk_size=None,
+      sort_targets=sort_targets)
+
+  @patch('pdf_sorter.pipeline.page_index.save_indexes')
+  @patch('pdf_sorter.pipeline.write_sorted_documents')
+  @patch('pdf_sorter.pipeline.pdf_image_sorter.PageTextExtractor')
+  @patch('pdf_sorter.pipeline.virtual_document.VirtualDocument')
+  def test_resume_job(self, mock_document, mock_extractor, mock_write, mock_save_indexes):
+    args = self.get_job_args([argument_handler.SortTarget('Order', 1, 'route.txt', 'route_sorted.pdf')])
+    with patch('pdf_sorter.pipeline.page_index.get_index_settings', return_value=self.SETTINGS):
+      header = checkpoint.get_journal_header([self.pdf_path], ['route_sorted.pdf'], [self.SETTINGS])
+      # The first run died after the first two pages
+      with checkpoint.ExtractionJournal(checkpoint.get_journal_path(header), header) as journal:
+        list(journal.record([['1'], [None]]))
+      mock_extractor.return_value.extract.return_value = iter(self.PAGE_TEXT[2:])
+      mock_write.side_effect = lambda args, document, value_page_lookups, run_metrics: args.output
+
+      output = pipeline.run_job(args, None)
+
+    self.assertEqual(output, 'route_sorted.pdf')
+    self.assertEqual(mock_extractor.return_value.extract.call_args.args[1], 2)
+    value_page_lookups = mock_write.call_args.args[2]
+    self.assertEqual([dict(value_page_lookup) for value_page_lookup in value_page_lookups], [{'1': [0, 1], '2': [2], '3': [3, 4]}])
+    self.assertFalse(os.path.exists(checkpoint.get_journal_path(header)))
+
+  @patch('pdf_sorter.pipeline.pdf_image_sorter.PageTextExtractor')
+  @patch('pdf_sorter.pipeline.virtual_document.VirtualDocument')
+  def test_resume_explore_job(self, mock_document, mock_extractor):
+    args = self.get_job_args([argument_handler.SortTarget('Order', 1, None, None)])
+    args.explore = True
+    args.explore_format = data_explorer.CSV_FORMAT
+    explore_file = os.path.join(self.temp_directory.name, 'route.csv')
+    with patch('pdf_sorter.pipeline.page_index.get_index_settings', return_value=self.SETTINGS):
+      header = pipeline.get_explore_store_header([self.pdf_path], args.sort_targets, explore_file, [self.SETTINGS])
+      store_path = checkpoint.get_journal_path(header, data_explorer.EXPLORE_STORE_EXTENSION)
+      # The first run died while writing the third page
+      with data_explorer.ExploreColumnStore(store_path) as column_store:
+        for page_text in self.PAGE_TEXT[:2]:
+          column_store.add_page(page_text, 'Order')
+      with open(store_path, 'a') as store_file:
+        store_file.write('[-1, ["Or')
+      mock_extractor.return_value.extract.return_value = iter(self.PAGE_TEXT[2:])
+
+      output = pipeline.run_job(args, None, explore_file=explore_file)
+
+    self.assertEqual(output, explore_file)
+    self.assertEqual(mock_extractor.return_value.extract.call_args.args[1], 2)
+    with open(explore_file, newline='') as explore_csv:
+      rows = list(csv.reader(explore_csv))
+    self.assertEqual(rows, [['Relative Index', 'Page 1', 'Page 2', 'Page 3', 'Page 4', 'Page 5'],
+      ['0', 'Order', '', 'Order', 'Order', ''], ['1', '1', '', '2', '3', '']])
+    self.assertFalse(os.path.exists(store_path))
+
+  def test_explore_stores_per_job(self):
+    sort_targets = [argument_handler.SortTarget('Order', 1, None, None)]
+    store_paths = [checkpoint.get_journal_path(pipeline.get_explore_store_header([self.pdf_path], sort_targets, explore_file, [self.SETTINGS]),
+      data_explorer.EXPLORE_STORE_EXTENSION) for explore_file in ['./output/data/route1.csv', './output/data/route2.csv', './output/data/route1.csv']]
+
+    # Jobs on the same input write to their own store, and a resumed job finds its own again
+    self.assertNotEqual(store_paths[0], store_paths[1])
+    self.assertEqual(store_paths[0], store_paths[2])
+
+  @patch('pdf_sorter.pipeline.page_index.save_indexes')
+  @patch('pdf_sorter.pipeline.pdf_image_sorter.generate_sorted_documents')
+  @patch('pdf_sorter.pipeline.fs_helper.get_sort_list')
+  @patch('pdf_sorter.pipeline.pdf_image_sorter.PageTextExtractor')
+  @patch('pdf_sorter.pipeline.virtual_document.VirtualDocument')
+  def test_several_criteria_one_pass(self, mock_document, mock_extractor, mock_sort_list, mock_generate, mock_save_indexes):
+    sort_targets = [argument_handler.SortTarget('Order', 1, 'route.txt', 'route_sorted.pdf'),
+      argument_handler.SortTarget('Color:', 1, 'colors.txt', 'color_sorted.pdf')]
+    args = self.get_job_args(sort_targets)
+    args.resume = False
+    page_text = [['Order', '1', 'Color:', 'red'], ['more'], ['Order', '2', 'Color:', 'blue']]
+    mock_extractor.return_value.extract.return_value = iter(page_text)
+    mock_sort_list.side_effect = lambda sort, reverse: [sort]
+
+    output = pipeline.run_job(args, None)
+
+    self.assertEqual(output, ['route_sorted.pdf', 'color_sorted.pdf'])
+    mock_extractor.return_value.extract.assert_called_once()
+    sorted_outputs = mock_generate.call_args.args[1]
+    self.assertEqual([(dict(lookup), sort, output) for lookup, sort, output in sorted_outputs], [
+      ({'1': [0, 1], '2': [2]}, ['route.txt'], 'route_sorted.pdf'),
+      ({'red': [0, 1], 'blue': [2]}, ['colors.txt'], 'color_sorted.pdf')])
+    self.assertEqual([settings['criteria'] for settings, _ in mock_save_indexes.call_args.args[1]], ['Order', 'Color:'])
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,7 @@
+import os
+import tempfile
 from unittest import TestCase, main
+from unittest.mock import patch
 from pdf_sorter import data_explorer
 
 class TestDataExplorer(TestCase):
@@ -77,6 +80,63 @@ class TestDataExplorer(TestCase):
     expected_result = {}
     actual_result = data_explorer.build_relative_index_matrix(self.TEST_EXTRACTED_DATA1, test_criteria)
     self.assertEqual(actual_result, expected_result)
+  """ Column store """
+
+  def build_column_store(self, temp_directory, pages, criteria_key):
+    column_store = data_explorer.ExploreColumnStore(os.path.join(temp_directory, 'explore' + data_explorer.EXPLORE_STORE_EXTENSION))
+    for page_text in pages:
+      column_store.add_page(page_text, criteria_key)
+    return column_store
+
+  def read_explore_file(self, explore_file):
+    with open(explore_file) as explore_data:
+      return explore_data.read()
+
+  def test_column_store_explore_csv(self):
+    relative_indexes = data_explorer.build_relative_index_matrix(self.TEST_EXTRACTED_DATA2, 'name')
+    with tempfile.TemporaryDirectory() as temp_directory:
+      with self.build_column_store(temp_directory, self.TEST_EXTRACTED_DATA2, 'name') as column_store:
+        explore_file = column_store.write_explore_file(os.path.join(temp_directory, 'explore.data'))
+      rows = self.read_explore_file(explore_file).splitlines()
+
+    self.assertTrue(explore_file.endswith('explore.csv'))
+    self.assertEqual(len(rows), 11)
+    self.assertEqual(rows[0], 'Relative Index,Page 1,Page 2,Page 3,Page 4,Page 5,Page 6')
+    self.assertEqual(rows[1], '-4,,,,cat,,')
+    self.assertEqual(rows[7], '2,tigger,pepper,,salt,milo,lucy')
+    self.assertEqual(rows[1:], [','.join([str(index)] + relative_indexes[index]) for index in range(-4, 6)])
+    self.assertEqual((column_store.min_index, column_store.max_index, column_store.page_count), (-4, 5, 6))
+
+  @patch('pdf_sorter.data_explorer.EXPLORE_CELL_BUDGET', 7)
+  def test_column_store_written_in_blocks(self):
+    relative_indexes = data_explorer.build_relative_index_matrix(self.TEST_EXTRACTED_DATA2, 'name')
+    with tempfile.TemporaryDirectory() as temp_directory:
+      with self.build_column_store(temp_directory, self.TEST_EXTRACTED_DATA2, 'name') as column_store:
+        rows = list(column_store.get_rows())
+
+    self.assertEqual(rows, [[index] + relative_indexes[index] for index in range(-4, 6)])
+
+  def test_column_store_no_match(self):
+    with tempfile.TemporaryDirectory() as temp_directory:
+      with self.build_column_store(temp_directory, self.TEST_EXTRACTED_DATA1, 'dog') as column_store:
+        explore_file = column_store.write_explore_file(os.path.join(temp_directory, 'explore.csv'))
+      self.assertEqual(self.read_explore_file(explore_file).splitlines(), ['Relative Index,Page 1,Page 2,Page 3,Page 4,Page 5'])
+
+  def test_load_partial_column_store(self):
+    with tempfile.TemporaryDirectory() as temp_directory:
+      column_store = self.build_column_store(temp_directory, self.TEST_EXTRACTED_DATA2[:3], 'name')
+      # Killed while writing the next page
+      column_store._store.write('[-1, ["cat"')
+      column_store.close()
+
+      with data_explorer.ExploreColumnStore.load(column_store.store_path) as loaded_store:
+        self.assertEqual(loaded_store.page_count, 3)
+        for page_text in self.TEST_EXTRACTED_DATA2[3:]:
+          loaded_store.add_page(page_text, 'name')
+        rows = list(loaded_store.get_rows())
+
+    relative_indexes = data_explorer.build_relative_index_matrix(self.TEST_EXTRACTED_DATA2, 'name')
+    self.assertEqual(rows, [[index] + relative_indexes[index] for index in range(-4, 6)])
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
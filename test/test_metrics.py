@@ -0,0 +1,148 @@
+import csv
+import json
+import os
+import socket
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+from pdf_sorter import metrics
+
+class TestMetrics(TestCase):
+
+  def setUp(self):
+    self.temp_directory = tempfile.TemporaryDirectory()
+    self.run_metrics = metrics.RunMetrics()
+
+  def tearDown(self):
+    self.temp_directory.cleanup()
+
+  def record_pages(self):
+    self.run_metrics.record_page(1, 'text layer')
+    self.run_metrics.record_page(2, 'ocr', 300, 0.2, 1.0, (2550, 3300), 90.0)
+    self.run_metrics.record_page(3, 'ocr', 300, 0.4, 2.0, (2550, 3300), 70.0)
+
+  def test_timed_call(self):
+    result, seconds = metrics.timed_call(len, 'abc')
+    self.assertEqual(result, 3)
+    self.assertGreaterEqual(seconds, 0)
+
+  def test_mean_confidence(self):
+    self.assertEqual(metrics.get_mean_confidence([-1, 90, -1, 80]), 85)
+    self.assertIsNone(metrics.get_mean_confidence([-1, -1]))
+
+  def test_reset_peak_rss(self):
+    status_path = os.path.join(self.temp_directory.name, 'status')
+    with open(status_path, 'w') as status:
+      status.write('Name:\tpython\nVmPeak:\t  900000 kB\nVmHWM:\t  512000 kB\nVmRSS:\t  20480 kB\n')
+    clear_refs_path = os.path.join(self.temp_directory.name, 'clear_refs')
+
+    with patch('pdf_sorter.metrics.PROCESS_STATUS_PATH', status_path), patch('pdf_sorter.metrics.CLEAR_REFS_PATH', clear_refs_path):
+      self.assertEqual(metrics.get_peak_rss_mb()[0], 500)
+      self.assertTrue(metrics.reset_peak_rss())
+    with open(clear_refs_path, 'r') as clear_refs:
+      self.assertEqual(clear_refs.read(), metrics.RESET_PEAK_RSS)
+
+    with patch('pdf_sorter.metrics.CLEAR_REFS_PATH', os.path.join(self.temp_directory.name, 'missing', 'clear_refs')):
+      self.assertFalse(metrics.reset_peak_rss())
+
+  def test_stage(self):
+    with self.run_metrics.stage('write'):
+      pass
+    with self.assertRaises(ValueError):
+      with self.run_metrics.stage('write'):
+        raise ValueError()
+    self.run_metrics.add_stage_time('extract', 2)
+    self.assertEqual(set(self.run_metrics.stages), {'write', 'extract'})
+    self.assertEqual(self.run_metrics.stages['extract'], 2)
+
+  def test_time_images(self):
+    render_info = []
+    images = list(self.run_metrics.time_images(iter(['page0', 'page1']), render_info))
+    self.assertEqual(images, ['page0', 'page1'])
+    self.assertEqual([size for _, size in render_info], [None, None])
+
+  def test_summary(self):
+    self.record_pages()
+    self.run_metrics.record_queue_depth(2)
+    self.run_metrics.record_queue_depth(4)
+
+    summary = self.run_metrics.get_summary()
+
+    self.assertEqual(summary['pages'], {'text layer': 1, 'ocr': 2})
+    self.assertAlmostEqual(summary['render_seconds'], 0.6)
+    self.assertEqual(summary['ocr_seconds'], 3.0)
+    self.assertAlmostEqual(summary['mean_render_seconds'], 0.3)
+    self.assertEqual(summary['mean_ocr_seconds'], 1.5)
+    self.assertEqual(summary['mean_confidence'], 80.0)
+    self.assertEqual((summary['max_queue_depth'], summary['mean_queue_depth']), (4, 3.0))
+    self.assertGreater(summary['peak_rss_mb'], 0)
+
+  def test_duplicate_pages(self):
+    self.record_pages()
+    self.run_metrics.record_page(4, 'duplicate', duplicate_of=2)
+    summary = self.run_metrics.get_summary()
+    self.assertEqual(summary['pages']['duplicate'], 1)
+    self.assertEqual(summary['duplicate_pages'], [[4, 2]])
+    self.assertEqual(self.run_metrics.pages[-1][-1], 2)
+
+  def test_merge(self):
+    self.record_pages()
+    self.run_metrics.add_stage_time('extract', 1)
+    totals = metrics.RunMetrics()
+    totals.merge(self.run_metrics)
+    totals.merge(self.run_metrics)
+    summary = totals.get_summary()
+    self.assertEqual(summary['stages'], {'extract': 2})
+    self.assertEqual(summary['pages'], {'text layer': 2, 'ocr': 4})
+    self.assertEqual(totals.pages, [])
+
+  def test_utilization(self):
+    self.run_metrics.record_utilization('render', 1, 4)
+    self.run_metrics.record_utilization('ocr', 6, 8)
+    totals = metrics.RunMetrics()
+    totals.merge(self.run_metrics)
+    totals.record_utilization('render', 3, 4)
+
+    self.assertEqual(self.run_metrics.get_summary()['utilization'], {'render': 0.25, 'ocr': 0.75})
+    self.assertEqual(totals.get_summary()['utilization'], {'render': 0.5, 'ocr': 0.75})
+    self.assertIn('pdf_sorter_stage_utilization{stage="ocr"} 0.75\n', totals.to_prometheus())
+    self.assertIn('pdf_sorter.utilization.render:0.5|g', totals.to_statsd())
+
+  def test_write_report(self):
+    self.record_pages()
+    report_path = os.path.join(self.temp_directory.name, 'run')
+
+    summary_path = self.run_metrics.write_report(report_path)
+
+    with open(summary_path) as summary_file:
+      self.assertEqual(json.load(summary_file)['pages'], {'text layer': 1, 'ocr': 2})
+    with open(report_path + '_pages.csv') as pages_file:
+      rows = list(csv.reader(pages_file))
+    self.assertEqual(rows[0], metrics.PAGE_REPORT_FIELDS)
+    self.assertEqual(rows[1], ['1', 'text layer', '', '', '', '', '', '', ''])
+    self.assertEqual(rows[2], ['2', 'ocr', '300', '0.2', '1.0', '2550', '3300', '90.0', ''])
+
+  def test_prometheus(self):
+    self.record_pages()
+    self.run_metrics.add_stage_time('explore matrix', 1.5)
+    exposition = self.run_metrics.to_prometheus()
+    self.assertIn('pdf_sorter_stage_seconds_total{stage="explore_matrix"} 1.5\n', exposition)
+    self.assertIn('pdf_sorter_pages_total{source="text_layer"} 1\n', exposition)
+    self.assertIn('pdf_sorter_ocr_seconds_total 3.0\n', exposition)
+
+  def test_statsd(self):
+    self.record_pages()
+    self.run_metrics.add_stage_time('write', 0.25)
+    self.assertIn('pdf_sorter.stage.write:250|ms', self.run_metrics.to_statsd())
+    self.assertIn('pdf_sorter.pages.ocr:2|c', self.run_metrics.to_statsd())
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as statsd_server:
+      statsd_server.bind(('127.0.0.1', 0))
+      statsd_server.settimeout(5)
+      self.run_metrics.send_statsd(statsd_server.getsockname())
+      packet = statsd_server.recv(65536).decode()
+    self.assertEqual(packet.split('\n'), self.run_metrics.to_statsd())
+
+
+if __name__ == '__main__':
+  main()
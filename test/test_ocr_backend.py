@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+from unittest import TestCase, main
+from unittest.mock import MagicMock, patch
+from PIL import Image
+from pdf_sorter import ocr_backend
+from pdf_sorter import rasterizer
+
+RIL = SimpleNamespace(BLOCK=1, PARA=2, TEXTLINE=3, WORD=4)
+
+class MockWord:
+  """ A word of a mock tesserocr result iterator, and the block, paragraph and line it starts """
+
+  def __init__(self, text, box, starts=()):
+    self.text = text
+    self.box = box
+    self.starts = starts
+
+  def Empty(self, level):
+    return False
+
+  def IsAtBeginningOf(self, level):
+    return level in self.starts
+
+  def BoundingBox(self, level):
+    return self.box
+
+  def Confidence(self, level):
+    return 91.5
+
+  def GetUTF8Text(self, level):
+    return self.text
+
+
+class TestOcrBackend(TestCase):
+
+  WORDS = [
+    MockWord('Packing', (10, 10, 50, 30), (RIL.BLOCK, RIL.PARA, RIL.TEXTLINE)),
+    MockWord('List', (60, 10, 90, 30)),
+    MockWord('Order', (100, 40, 140, 60), (RIL.TEXTLINE,)),
+    MockWord('1001', (150, 40, 180, 60))
+  ]
+
+  def setUp(self):
+    self.tesserocr = MagicMock(RIL=RIL)
+    self.tesserocr.iterate_level.side_effect = lambda iterator, level: iter(self.WORDS)
+    self.tesserocr.tesseract_version.return_value = 'tesseract 5.3.0\n leptonica-1.82.0'
+    self.modules_patcher = patch.dict('sys.modules', {'tesserocr': self.tesserocr})
+    self.modules_patcher.start()
+
+  def tearDown(self):
+    self.modules_patcher.stop()
+    ocr_backend._engines.__dict__.clear()
+    ocr_backend.set_backend(ocr_backend.PYTESSERACT)
+
+  def test_resolve_backend_name(self):
+    self.assertEqual(ocr_backend.resolve_backend_name(ocr_backend.AUTO), ocr_backend.TESSEROCR)
+    self.assertEqual(ocr_backend.resolve_backend_name(ocr_backend.PYTESSERACT), ocr_backend.PYTESSERACT)
+    with patch.dict('sys.modules', {'tesserocr': None}):
+      self.assertEqual(ocr_backend.resolve_backend_name(ocr_backend.AUTO), ocr_backend.PYTESSERACT)
+
+  def test_tesserocr_rows_match_pytesseract(self):
+    backend = ocr_backend.TesserocrBackend()
+    data = backend.image_to_data(Image.new('RGB', (200, 100)))
+
+    self.assertEqual(data['text'], ['', '', '', '', 'Packing', 'List', '', 'Order', '1001'])
+    self.assertEqual(data['conf'], [-1, -1, -1, -1, 91.5, 91.5, -1, 91.5, 91.5])
+    self.assertEqual(data['level'], [1, 2, 3, 4, 5, 5, 4, 5, 5])
+    self.assertEqual(data['line_num'], [0, 0, 0, 1, 1, 1, 2, 2, 2])
+    self.assertEqual(data['word_num'], [0, 0, 0, 0, 1, 2, 0, 1, 2])
+    self.assertEqual((data['left'][7], data['top'][7], data['width'][7], data['height'][7]), (100, 40, 40, 20))
+    self.assertEqual(data['width'][0], 200)
+
+  def test_tesserocr_raw_image_buffer(self):
+    backend = ocr_backend.TesserocrBackend()
+    backend.image_to_data(Image.new('1', (16, 8)))
+
+    image_bytes, width, height, bytes_per_pixel, bytes_per_line = backend.api.SetImageBytes.call_args.args
+    self.assertEqual((len(image_bytes), width, height, bytes_per_pixel, bytes_per_line), (128, 16, 8, 1, 16))
+
+  def test_backend_reused(self):
+    ocr_backend.start_worker(ocr_backend.TESSEROCR)
+    first = ocr_backend.get_backend()
+
+    self.assertIs(ocr_backend.get_backend(), first)
+    self.assertEqual(self.tesserocr.PyTessBaseAPI.call_count, 1)
+    self.assertEqual(ocr_backend.get_version(ocr_backend.TESSEROCR), 'tesseract 5.3.0')
+  @patch('pdf_sorter.ocr_backend.pytesseract.image_to_data')
+  def test_pytesseract_reads_mapped_page_file(self, mock_image_to_data):
+    page = rasterizer.MappedPage('/dev/shm/page.pgm', 200, 100, 15)
+
+    ocr_backend.PytesseractBackend().image_to_data(page)
+
+    self.assertEqual(mock_image_to_data.call_args.args[0], '/dev/shm/page.pgm')
+
+if __name__ == '__main__':
+  main()
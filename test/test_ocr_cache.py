@@ -0,0 +1,59 @@
+import os
+import tempfile
+from unittest import TestCase, main
+from pdf_sorter import ocr_cache
+
+class TestOcrCache(TestCase):
+
+  TEST_PAGE_TEXT = ['', 'Order', '#', '1001']
+
+  def setUp(self):
+    self.temp_directory = tempfile.TemporaryDirectory()
+    self.cache = ocr_cache.OcrCache(self.temp_directory.name)
+
+  def tearDown(self):
+    self.temp_directory.cleanup()
+
+  TEST_SETTINGS = {'dpi': 300, 'quadrants': [1], 'language': 'eng', 'tesseract': '5.0'}
+
+  def test_key_depends_on_settings(self):
+    key = ocr_cache.OcrCache.get_key('abc', self.TEST_SETTINGS)
+    self.assertEqual(key, ocr_cache.OcrCache.get_key('abc', dict(reversed(list(self.TEST_SETTINGS.items())))))
+    self.assertNotEqual(key, ocr_cache.OcrCache.get_key('abd', self.TEST_SETTINGS))
+    for setting, value in [('dpi', 200), ('quadrants', [2]), ('language', 'fra'), ('tesseract', '4.1')]:
+      self.assertNotEqual(key, ocr_cache.OcrCache.get_key('abc', dict(self.TEST_SETTINGS, **{setting: value})))
+
+  def test_put_and_get(self):
+    key = ocr_cache.OcrCache.get_key('abc', self.TEST_SETTINGS)
+    self.cache.put(key, self.TEST_PAGE_TEXT)
+    self.assertEqual(self.cache.get(key), self.TEST_PAGE_TEXT)
+    self.assertEqual(self.cache.hits, 1)
+
+  def test_get_missing(self):
+    self.assertIsNone(self.cache.get('missing'))
+    self.assertEqual(self.cache.misses, 1)
+
+  def test_persists_between_instances(self):
+    self.cache.put('abcdef', self.TEST_PAGE_TEXT)
+    reopened = ocr_cache.OcrCache(self.temp_directory.name)
+    self.assertEqual(reopened.get('abcdef'), self.TEST_PAGE_TEXT)
+    self.assertEqual(reopened._size_bytes, self.cache._size_bytes)
+
+  def test_evicts_least_recently_used(self):
+    for index, key in enumerate(['aa01', 'aa02', 'aa03']):
+      self.cache.put(key, self.TEST_PAGE_TEXT)
+      os.utime(self.cache.get_entry_path(key), (index, index))
+    # Reading aa01 makes aa02 the least recently used entry
+    self.cache.get('aa01')
+    entry_size = os.path.getsize(self.cache.get_entry_path('aa01'))
+    self.cache.max_size_bytes = entry_size * 3
+
+    self.cache.put('aa04', self.TEST_PAGE_TEXT)
+
+    self.assertIsNone(self.cache.get('aa02'))
+    self.assertEqual(self.cache.get('aa01'), self.TEST_PAGE_TEXT)
+    self.assertEqual(self.cache.get('aa04'), self.TEST_PAGE_TEXT)
+    self.assertLessEqual(self.cache._size_bytes, self.cache.max_size_bytes)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+from unittest import TestCase, main
+from pdf_sorter import metrics
+from pdf_sorter import ocr_pool
+
+class TestOcrPool(TestCase):
+
+  TEST_VALUES = [-5, 3, -8, 1, -2, 9, -7, 4]
+
+  def test_single_worker_runs_inline(self):
+    with ocr_pool.OcrWorkerPool(1) as pool:
+      actual = list(pool.map(abs, self.TEST_VALUES))
+      self.assertIsNone(pool._executor)
+    self.assertEqual(actual, [abs(value) for value in self.TEST_VALUES])
+
+  def test_multiple_workers_keep_order(self):
+    with ocr_pool.OcrWorkerPool(2, max_in_flight=3) as pool:
+      actual = list(pool.map(abs, self.TEST_VALUES))
+    self.assertEqual(actual, [abs(value) for value in self.TEST_VALUES])
+
+  def test_queue_depth_metrics(self):
+    run_metrics = metrics.RunMetrics()
+    with ocr_pool.OcrWorkerPool(2, max_in_flight=3) as pool:
+      list(pool.map(abs, self.TEST_VALUES, run_metrics))
+    self.assertEqual(run_metrics.max_queue_depth, 3)
+    self.assertEqual(run_metrics.totals['queue_samples'], len(self.TEST_VALUES))
+
+  def test_default_workers(self):
+    pool = ocr_pool.OcrWorkerPool()
+    self.assertEqual(pool.workers, ocr_pool.default_worker_count())
+    self.assertEqual(pool.max_in_flight, pool.workers * 2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+from unittest import TestCase, main
+from PIL import Image, ImageDraw
+from pdf_sorter import page_classifier
+
+class TestPageClassifier(TestCase):
+
+  def draw_page(self, lines=0, mode='L'):
+    """ A letter page at 100 dpi with the given number of lines of black text-sized bars """
+    page = Image.new(mode, (850, 1100), 'white')
+    draw = ImageDraw.Draw(page)
+    for line in range(lines):
+      draw.rectangle((80, 100 + line*30, 500, 112 + line*30), fill='black')
+    return page
+
+  def test_ink_ratio(self):
+    self.assertEqual(page_classifier.get_ink_ratio(self.draw_page()), 0)
+    self.assertAlmostEqual(page_classifier.get_ink_ratio(self.draw_page(1)), 421*13 / (850*1100))
+
+  def test_blank_page(self):
+    self.assertTrue(page_classifier.is_blank_page(self.draw_page()))
+    self.assertTrue(page_classifier.is_blank_page(self.draw_page(mode='RGB')))
+
+  def test_page_with_text(self):
+    self.assertFalse(page_classifier.is_blank_page(self.draw_page(1)))
+    self.assertFalse(page_classifier.is_blank_page(self.draw_page(20, mode='1')))
+
+  def test_speckled_page(self):
+    page = self.draw_page()
+    for pixel in range(0, 850*1100, 5000):
+      page.putpixel((pixel % 850, pixel // 850), 0)
+    self.assertTrue(page_classifier.is_blank_page(page))
+
+if __name__ == '__main__':
+    main()
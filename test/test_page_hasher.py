@@ -0,0 +1,71 @@
+import os
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+from PyPDF2 import PdfFileReader
+from PyPDF2.generic import StreamObject
+from pdf_sorter import page_hasher
+from pdf_builder import build_pdf_from_contents
+
+class TestPageHasher(TestCase):
+
+  def setUp(self):
+    self.temp_directory = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.temp_directory.cleanup()
+
+  def write_pdf(self, filename, page_contents):
+    pdf_path = os.path.join(self.temp_directory.name, filename)
+    with open(pdf_path, 'wb') as pdf_file:
+      pdf_file.write(build_pdf_from_contents(page_contents))
+    return pdf_path
+
+  def test_page_fingerprints(self):
+    pdf_path = self.write_pdf('test.pdf', [b'BT (Order 1001) Tj ET', b'BT (Order 1002) Tj ET', b'BT (Order 1001) Tj ET'])
+    actual = page_hasher.get_page_fingerprints(pdf_path)
+
+    self.assertEqual(len(actual), 3)
+    self.assertEqual(actual[0], actual[2])
+    self.assertNotEqual(actual[0], actual[1])
+
+  def test_page_fingerprints_page_range(self):
+    pdf_path = self.write_pdf('test.pdf', [b'BT (Order 1001) Tj ET', b'BT (Order 1002) Tj ET', b'BT (Order 1003) Tj ET'])
+
+    self.assertEqual(page_hasher.get_page_fingerprints(pdf_path, 1, 3), page_hasher.get_page_fingerprints(pdf_path)[1:])
+
+  def test_page_fingerprints_across_files(self):
+    first_path = self.write_pdf('first.pdf', [b'BT (Order 1001) Tj ET'])
+    second_path = self.write_pdf('second.pdf', [b'BT (Order 1002) Tj ET', b'BT (Order 1001) Tj ET'])
+
+    first = page_hasher.get_page_fingerprints(first_path)
+    second = page_hasher.get_page_fingerprints(second_path)
+
+    self.assertEqual(first[0], second[1])
+  def test_streams_not_parsed(self):
+    pdf_path = self.write_pdf('test.pdf', [b'BT (Order 1001) Tj ET', b'BT (Order 1002) Tj ET', b'BT (Order 1001) Tj ET'])
+    read_objects = []
+    get_object = PdfFileReader.getObject
+    def record_object(reader, reference):
+      read_objects.append(get_object(reader, reference))
+      return read_objects[-1]
+
+    with patch.object(PdfFileReader, 'getObject', autospec=True, side_effect=record_object):
+      actual = page_hasher.get_page_fingerprints(pdf_path)
+
+    self.assertEqual(actual[0], actual[2])
+    self.assertNotEqual(actual[0], actual[1])
+    # Content streams are hashed from the memory map, so the reader never holds their data
+    self.assertFalse([read_object for read_object in read_objects if isinstance(read_object, StreamObject)])
+
+  def test_page_fingerprints_without_memory_map(self):
+    pdf_path = self.write_pdf('test.pdf', [b'BT (Order 1001) Tj ET', b'BT (Order 1002) Tj ET', b'BT (Order 1001) Tj ET'])
+
+    with patch('pdf_sorter.page_hasher.RawSource.open', return_value=None):
+      actual = page_hasher.get_page_fingerprints(pdf_path)
+
+    self.assertEqual(actual[0], actual[2])
+    self.assertNotEqual(actual[0], actual[1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+from argparse import Namespace
+from unittest import TestCase, main
+from unittest.mock import patch
+from typing import OrderedDict
+from pdf_sorter import page_index
+from pdf_sorter import virtual_document
+
+class TestPageIndex(TestCase):
+
+  TEST_LOOKUP = OrderedDict([('1002', [0, 1]), ('1001', [2]), ('1003', [3])])
+
+  TEST_ARGS = Namespace(criteria='Order', index=2, multipage=True, quadrant=[2, 1], dpi=300, adaptive_dpi=None,
+    min_confidence=60, text_layer=False, targeted=False, blank_ink=None, drop_blank=False)
+
+  def setUp(self):
+    self.temp_directory = tempfile.TemporaryDirectory()
+    self.pdf_paths = [self.write_file('route1.pdf', b'first'), self.write_file('route2.pdf', b'second')]
+    self.document = virtual_document.VirtualDocument(self.pdf_paths, page_counts=[3, 1])
+    self.settings = page_index.get_index_settings(self.TEST_ARGS)
+
+  def tearDown(self):
+    self.temp_directory.cleanup()
+
+  def write_file(self, filename, contents):
+    file_path = os.path.join(self.temp_directory.name, filename)
+    with open(file_path, 'wb') as test_file:
+      test_file.write(contents)
+    return file_path
+
+  def test_index_path(self):
+    self.assertEqual(page_index.get_index_path(['./in/route1.pdf', './in/route2.pdf']), './in/route1.sort_index.json')
+
+  def test_settings(self):
+    self.assertEqual(self.settings['quadrant'], [1, 2])
+    self.assertEqual(self.settings['criteria'], 'Order')
+
+  def test_save_and_load(self):
+    index_path = page_index.save_index(self.document, self.TEST_LOOKUP, self.settings)
+    self.assertTrue(os.path.exists(index_path))
+
+    value_page_lookup, page_counts = page_index.load_index(self.pdf_paths, self.settings)
+
+    self.assertEqual(list(value_page_lookup.items()), list(self.TEST_LOOKUP.items()))
+    self.assertEqual(page_counts, [3, 1])
+
+  def test_save_keeps_other_settings(self):
+    color_settings = dict(self.settings, criteria='Color:', index=1)
+    color_lookup = OrderedDict([('Red', [0, 3]), ('Blue', [1, 2])])
+    page_index.save_indexes(self.document, [(self.settings, self.TEST_LOOKUP), (color_settings, color_lookup)])
+    page_index.save_index(self.document, self.TEST_LOOKUP, self.settings)
+
+    self.assertEqual(page_index.load_index(self.pdf_paths, self.settings)[0], self.TEST_LOOKUP)
+    self.assertEqual(page_index.load_index(self.pdf_paths, color_settings)[0], color_lookup)
+
+  def test_load_missing_index(self):
+    self.assertIsNone(page_index.load_index(self.pdf_paths, self.settings))
+
+  def test_load_with_different_settings(self):
+    page_index.save_index(self.document, self.TEST_LOOKUP, self.settings)
+    self.assertIsNone(page_index.load_index(self.pdf_paths, dict(self.settings, index=1)))
+
+  def test_load_with_changed_input(self):
+    page_index.save_index(self.document, self.TEST_LOOKUP, self.settings)
+    self.write_file('route2.pdf', b'changed')
+    self.assertIsNone(page_index.load_index(self.pdf_paths, self.settings))
+
+  def test_load_with_different_files(self):
+    page_index.save_index(self.document, self.TEST_LOOKUP, self.settings)
+    self.assertIsNone(page_index.load_index(self.pdf_paths[:1], self.settings))
+
+  def test_unchanged_files_not_hashed(self):
+    color_settings = dict(self.settings, criteria='Color:', index=1)
+    color_lookup = OrderedDict([('Red', [0, 3]), ('Blue', [1, 2])])
+    page_index.save_indexes(self.document, [(self.settings, self.TEST_LOOKUP), (color_settings, color_lookup)])
+
+    with patch('pdf_sorter.page_index.get_file_fingerprint', wraps=page_index.get_file_fingerprint) as mock_fingerprint:
+      indexed = page_index.load_indexes(self.pdf_paths, [self.settings, color_settings])
+      page_index.save_index(self.document, self.TEST_LOOKUP, self.settings)
+
+    self.assertEqual([value_page_lookup for value_page_lookup, _ in indexed], [self.TEST_LOOKUP, color_lookup])
+    mock_fingerprint.assert_not_called()
+
+  def test_load_with_touched_input(self):
+    page_index.save_index(self.document, self.TEST_LOOKUP, self.settings)
+    stat = os.stat(self.pdf_paths[1])
+    os.utime(self.pdf_paths[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    with patch('pdf_sorter.page_index.get_file_fingerprint', wraps=page_index.get_file_fingerprint) as mock_fingerprint:
+      self.assertEqual(page_index.load_index(self.pdf_paths, self.settings)[0], self.TEST_LOOKUP)
+      # Same size, new contents
+      self.write_file('route2.pdf', b'SECOND')
+      self.assertIsNone(page_index.load_index(self.pdf_paths, self.settings))
+
+    # Only the modified file is hashed, once per load
+    self.assertEqual([call.args[0] for call in mock_fingerprint.call_args_list], [self.pdf_paths[1]] * 2)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,3 +1,413 @@
-# crop ratios
+import os
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import MagicMock, mock_open, patch
+from PIL import Image
+from pdf_sorter import argument_handler
+from pdf_sorter import metrics
+from pdf_sorter import ocr_cache
+from pdf_sorter import ocr_pool
+from pdf_sorter import pdf_image_sorter
+from pdf_sorter import rasterizer
+from pdf_sorter import virtual_document
 
-# mock function to return text data
\ No newline at end of file
+class TestPdfImageSorter(TestCase):
+
+  TEST_EXTRACTED_TEXT = {
+    'page0': ['', 'Order', '#', '1001', 'Color:', 'Red'],
+    'page1': ['', 'Order', '#', '1002', 'Color:', 'Blue'],
+    'page2': ['', 'Continued', 'from', 'previous', 'page'],
+    'page3': ['', 'Order', '#', '1003', 'Color:', 'Red']
+  }
+
+  TEST_IMAGES = ['page0', 'page1', 'page2', 'page3']
+
+  def mock_extract_text(self, image):
+    return self.TEST_EXTRACTED_TEXT[image]
+
+  def mock_extract_ocr_data(self, image):
+    extracted_text = self.TEST_EXTRACTED_TEXT[image]
+    return extracted_text, [-1] + [90] * (len(extracted_text) - 1)
+
+  def setUp(self):
+    self.patcher = patch('pdf_sorter.pdf_image_sorter.extract_text_from_image')
+    self.mock_extract_text_from_image = self.patcher.start()
+    self.mock_extract_text_from_image.side_effect = self.mock_extract_text
+    self.extract_ocr_data_from_image = pdf_image_sorter.extract_ocr_data_from_image
+    self.ocr_data_patcher = patch('pdf_sorter.pdf_image_sorter.extract_ocr_data_from_image')
+    self.mock_extract_ocr_data_from_image = self.ocr_data_patcher.start()
+    self.mock_extract_ocr_data_from_image.side_effect = self.mock_extract_ocr_data
+    self.pool = ocr_pool.OcrWorkerPool(1)
+
+  def tearDown(self):
+    self.patcher.stop()
+    self.ocr_data_patcher.stop()
+    self.pool.close()
+
+  """ Crop ratios """
+
+  def test_crop_ratio_whole_page(self):
+    self.assertEqual(pdf_image_sorter.get_crop_width_ratio([0]), (0, 1))
+    self.assertEqual(pdf_image_sorter.get_crop_height_ratio([0]), (0, 1))
+
+  def test_crop_ratio_quadrant(self):
+    self.assertEqual(pdf_image_sorter.get_crop_width_ratio([4]), (0.5, 1))
+    self.assertEqual(pdf_image_sorter.get_crop_height_ratio([4]), (0.5, 1))
+
+  """ Page rendering """
+
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer')
+  def test_convert_whole_page(self, mock_rasterizer):
+    pdf_image_sorter.convert_document_to_images('test.pdf', 300, [0], 4, 2)
+    mock_rasterizer.render_pages.assert_called_once_with('test.pdf', 300, 4, 2, None)
+    mock_rasterizer.render_page_regions.assert_not_called()
+
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer')
+  def test_convert_quadrant_renders_region(self, mock_rasterizer):
+    pdf_image_sorter.convert_document_to_images('test.pdf', 300, [2], 4, 2)
+    mock_rasterizer.render_page_regions.assert_called_once_with('test.pdf', 300, (0.5, 1), (0, 0.5), 4, 2, None)
+    mock_rasterizer.render_pages.assert_not_called()
+
+  """ Key value extraction """
+
+  def test_extract_key_values(self):
+    actual = pdf_image_sorter.extract_key_values_from_images(self.TEST_IMAGES, 'Order', 2, False, self.pool)
+    expected = {'1001': [0], '1002': [1], '1003': [3]}
+    self.assertEqual(actual, expected)
+    self.assertEqual(list(actual.keys()), ['1001', '1002', '1003'])
+
+  def test_extract_key_values_duplicates(self):
+    actual = pdf_image_sorter.extract_key_values_from_images(self.TEST_IMAGES, 'Color:', 1, False, self.pool)
+    expected = {'Red': [0, 3], 'Blue': [1]}
+    self.assertEqual(actual, expected)
+
+  def test_extract_key_values_multipage(self):
+    actual = pdf_image_sorter.extract_key_values_from_images(self.TEST_IMAGES, 'Order', 2, True, self.pool)
+    expected = {'1001': [0], '1002': [1, 2], '1003': [3]}
+    self.assertEqual(actual, expected)
+
+  def test_build_value_page_maps(self):
+    sort_targets = [argument_handler.SortTarget('Order', 2, 'route.txt', 'route.pdf'), argument_handler.SortTarget('Color:', 1, 'colors.txt', 'colors.pdf')]
+    page_values = (pdf_image_sorter.get_page_values(text, sort_targets) for text in pdf_image_sorter.extract_text_from_images(self.TEST_IMAGES, self.pool))
+
+    actual = pdf_image_sorter.build_value_page_maps(page_values, ['Order', 'Color:'], True)
+
+    self.assertEqual(actual, [{'1001': [0], '1002': [1, 2], '1003': [3]}, {'Red': [0, 3], 'Blue': [1, 2]}])
+
+  def test_extract_text_keeps_page_order(self):
+    actual = list(pdf_image_sorter.extract_text_from_images(self.TEST_IMAGES, self.pool))
+    expected = [self.TEST_EXTRACTED_TEXT[image] for image in self.TEST_IMAGES]
+    self.assertEqual(actual, expected)
+
+  """ Page text extraction """
+
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_images')
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer.get_page_count')
+  @patch('pdf_sorter.pdf_image_sorter.text_layer.extract_text_layer')
+  def test_extractor_text_layer_fast_path(self, mock_text_layer, mock_page_count, mock_convert):
+    layer_text = [['', 'Order', '#', '2001'], [''], ['', 'Order', '#', '2003'], ['']]
+    mock_text_layer.return_value = layer_text
+    mock_page_count.return_value = 4
+    mock_convert.return_value = iter(['page1', 'page2'])
+
+    extractor = pdf_image_sorter.PageTextExtractor(self.pool, 300, [0], 'Order', True)
+    actual = list(extractor.extract('test.pdf'))
+
+    expected = [layer_text[0], self.TEST_EXTRACTED_TEXT['page1'], layer_text[2], self.TEST_EXTRACTED_TEXT['page2']]
+    self.assertEqual(actual, expected)
+    self.assertEqual(mock_convert.call_args.args[-1], [2, 4])
+    self.assertEqual(extractor.page_sources, {'text layer': 2, 'ocr': 2})
+
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_images')
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer.get_page_count')
+  @patch('pdf_sorter.pdf_image_sorter.text_layer.extract_text_layer')
+  def test_extractor_without_text_layer(self, mock_text_layer, mock_page_count, mock_convert):
+    mock_page_count.return_value = 4
+    mock_convert.return_value = iter(self.TEST_IMAGES)
+
+    extractor = pdf_image_sorter.PageTextExtractor(self.pool, 300, [0], 'Order')
+    actual = list(extractor.extract('test.pdf'))
+
+    self.assertEqual(actual, [self.TEST_EXTRACTED_TEXT[image] for image in self.TEST_IMAGES])
+    mock_text_layer.assert_not_called()
+    self.assertEqual(extractor.page_sources, {'ocr': 4})
+
+  @patch('pdf_sorter.pdf_image_sorter.page_hasher.get_page_fingerprints')
+  @patch('pdf_sorter.pdf_image_sorter.text_layer.extract_text_layer')
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_images')
+  def test_extractor_page_range(self, mock_convert, mock_text_layer, mock_fingerprints):
+    document = virtual_document.VirtualDocument(['a.pdf', 'b.pdf'], [2, 2])
+    mock_text_layer.side_effect = [[['']], [['']]]
+    mock_fingerprints.side_effect = [['b'], ['c']]
+    mock_convert.side_effect = [iter(['page1']), iter(['page2'])]
+
+    extractor = pdf_image_sorter.PageTextExtractor(self.pool, 300, [0], 'Order', True, deduplicate=True)
+    actual = list(extractor.extract(document, 1, 3))
+
+    self.assertEqual(actual, [self.TEST_EXTRACTED_TEXT['page1'], self.TEST_EXTRACTED_TEXT['page2']])
+    # Only the second page of a.pdf and the first page of b.pdf are read, eg. for a shard
+    self.assertEqual([call.args for call in mock_text_layer.call_args_list], [('a.pdf', 2, 2), ('b.pdf', 1, 1)])
+    self.assertEqual([call.args for call in mock_fingerprints.call_args_list], [('a.pdf', 1, 2), ('b.pdf', 0, 1)])
+    self.assertEqual([(call.args[0], call.args[-1]) for call in mock_convert.call_args_list], [('a.pdf', [2]), ('b.pdf', [1])])
+
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_images')
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer.get_page_count')
+  @patch('pdf_sorter.pdf_image_sorter.text_layer.extract_text_layer')
+  def test_extractor_metrics(self, mock_text_layer, mock_page_count, mock_convert):
+    mock_text_layer.return_value = [['', 'Order', '#', '2001'], [''], [''], ['']]
+    mock_page_count.return_value = 4
+    mock_convert.return_value = iter(self.TEST_IMAGES[1:])
+    run_metrics = metrics.RunMetrics()
+
+    extractor = pdf_image_sorter.PageTextExtractor(self.pool, 300, [0], 'Order', True, run_metrics=run_metrics)
+    list(extractor.extract('test.pdf'))
+
+    self.assertEqual([page[:3] for page in run_metrics.pages], [[1, 'text layer', None], [2, 'ocr', 300], [3, 'ocr', 300], [4, 'ocr', 300]])
+    self.assertEqual(run_metrics.pages[1][7], 90)
+    self.assertEqual(set(run_metrics.stages), {'text layer', 'fingerprint', 'cache lookup', 'render wait'})
+    self.assertEqual(run_metrics.get_summary()['pages'], {'text layer': 1, 'ocr': 3})
+    self.assertEqual(set(run_metrics.available_seconds), {'render', 'ocr'})
+
+  @patch('pdf_sorter.pdf_image_sorter.get_tesseract_version')
+  @patch('pdf_sorter.pdf_image_sorter.page_hasher.get_page_fingerprints')
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_images')
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer.get_page_count')
+  def test_extractor_cache(self, mock_page_count, mock_convert, mock_fingerprints, mock_version):
+    mock_page_count.return_value = 4
+    mock_fingerprints.return_value = ['a', 'b', 'c', 'd']
+    mock_version.return_value = '5.0'
+
+    with tempfile.TemporaryDirectory() as cache_directory:
+      cache = ocr_cache.OcrCache(cache_directory)
+      extractor = pdf_image_sorter.PageTextExtractor(self.pool, 300, [0], 'Order', cache=cache)
+
+      mock_convert.return_value = iter(self.TEST_IMAGES)
+      cold = list(extractor.extract('test.pdf'))
+      self.assertEqual(extractor.page_sources, {'ocr': 4})
+
+      mock_convert.return_value = iter([])
+      warm = list(extractor.extract('test.pdf'))
+      self.assertEqual(extractor.page_sources, {'cache': 4})
+      self.assertEqual(mock_convert.call_count, 1)
+
+    self.assertEqual(cold, warm)
+
+  @patch('pdf_sorter.pdf_image_sorter.page_hasher.get_page_fingerprints')
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_images')
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer.get_page_count')
+  def test_extractor_duplicates(self, mock_page_count, mock_convert, mock_fingerprints):
+    mock_page_count.return_value = 4
+    # The last two pages repeat the first two
+    mock_fingerprints.return_value = ['a', 'b', 'a', 'b']
+    mock_convert.side_effect = lambda pdf_path, dpi, quadrants, budget, threads, pages: iter([self.TEST_IMAGES[page - 1] for page in pages])
+    run_metrics = metrics.RunMetrics()
+
+    extractor = pdf_image_sorter.PageTextExtractor(self.pool, 300, [0], 'Order', run_metrics=run_metrics, deduplicate=True)
+    actual = list(extractor.extract('test.pdf'))
+
+    first_pages = [self.TEST_EXTRACTED_TEXT[image] for image in self.TEST_IMAGES[:2]]
+    self.assertEqual(actual, first_pages + first_pages)
+    self.assertEqual(mock_convert.call_args.args[5], [1, 2])
+    self.assertEqual(extractor.page_sources, {'ocr': 2, 'duplicate': 2})
+    self.assertEqual(run_metrics.get_summary()['duplicate_pages'], [[3, 1], [4, 2]])
+
+  @patch('pdf_sorter.pdf_image_sorter.page_classifier.is_blank_page')
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_images')
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer.get_page_count')
+  def test_extractor_blank_pages(self, mock_page_count, mock_convert, mock_is_blank):
+    mock_page_count.return_value = 4
+    mock_convert.return_value = iter(self.TEST_IMAGES)
+    mock_is_blank.side_effect = lambda image, max_ink_ratio: image == self.TEST_IMAGES[2]
+    run_metrics = metrics.RunMetrics()
+
+    extractor = pdf_image_sorter.PageTextExtractor(self.pool, 300, [0], 'Order', run_metrics=run_metrics, blank_ink_ratio=0.001)
+    actual = list(extractor.extract('test.pdf'))
+
+    self.assertEqual(actual[2], [])
+    self.assertEqual(self.mock_extract_ocr_data_from_image.call_count, 3)
+    self.assertEqual(extractor.page_sources, {'ocr': 3, 'blank': 1})
+    self.assertEqual(run_metrics.pages[2][1], 'blank')
+
+  def test_drop_blank_pages(self):
+    sort_targets = [argument_handler.SortTarget('Order', 2, 'route.txt', 'route.pdf')]
+    page_text = [self.TEST_EXTRACTED_TEXT[self.TEST_IMAGES[0]], [], self.TEST_EXTRACTED_TEXT[self.TEST_IMAGES[2]]]
+
+    kept = pdf_image_sorter.build_value_page_maps((pdf_image_sorter.get_page_values(text, sort_targets) for text in page_text), ['Order'], True)
+    dropped = pdf_image_sorter.build_value_page_maps((pdf_image_sorter.get_page_values(text, sort_targets, True) for text in page_text), ['Order'], True)
+
+    self.assertEqual(kept, [{'1001': [0, 1, 2]}])
+    self.assertEqual(dropped, [{'1001': [0, 2]}])
+
+  """ Adaptive dpi """
+
+  TEST_OCR_DATA = {
+    (120, 1): (['', 'Order', '#', '1001'], [-1, 95, 90, 92]),
+    (120, 2): (['', 'Order', '#', '10O2'], [-1, 95, 90, 31]),
+    (120, 3): (['', 'smudge'], [-1, 20]),
+    (300, 2): (['', 'Order', '#', '1002'], [-1, 96, 91, 94]),
+    (300, 3): (['', 'Order', '#', '1003'], [-1, 96, 91, 94])
+  }
+
+  def test_confident_match(self):
+    self.assertTrue(pdf_image_sorter.is_confident_match(['', 'Order', '#', '1001'], [-1, 95, 90, 92], 'Order', 2, 60))
+    self.assertFalse(pdf_image_sorter.is_confident_match(['', 'Order', '#', '1001'], [-1, 95, 90, 42], 'Order', 2, 60))
+    self.assertFalse(pdf_image_sorter.is_confident_match(['', 'Order', '#'], [-1, 95, 90], 'Order', 2, 60))
+    self.assertFalse(pdf_image_sorter.is_confident_match(['', 'Color:', 'Red'], [-1, 95, 90], 'Order', 1, 60))
+
+  @patch('pdf_sorter.pdf_image_sorter.extract_ocr_data_from_image')
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_images')
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer.get_page_count')
+  def test_extractor_adaptive_dpi(self, mock_page_count, mock_convert, mock_ocr_data):
+    mock_page_count.return_value = 3
+    mock_convert.side_effect = lambda pdf_path, dpi, quadrants, budget, threads, pages: iter([(dpi, page) for page in pages])
+    mock_ocr_data.side_effect = lambda image: self.TEST_OCR_DATA[image]
+
+    extractor = pdf_image_sorter.PageTextExtractor(self.pool, 300, [0], 'Order', adaptive_dpis=[120], value_index=2)
+    actual = list(extractor.extract('test.pdf'))
+
+    expected = [['', 'Order', '#', '1001'], ['', 'Order', '#', '1002'], ['', 'Order', '#', '1003']]
+    self.assertEqual(actual, expected)
+    passes = [(call.args[1], call.args[-1]) for call in mock_convert.call_args_list]
+    self.assertEqual(passes, [(120, [1, 2, 3]), (300, [2, 3])])
+
+  @patch('pdf_sorter.pdf_image_sorter.extract_ocr_data_from_image')
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_images')
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer.get_page_count')
+  def test_extractor_adaptive_dpi_streams_final_pages(self, mock_page_count, mock_convert, mock_ocr_data):
+    mock_page_count.return_value = 3
+    mock_convert.side_effect = lambda pdf_path, dpi, quadrants, budget, threads, pages: iter([(dpi, page) for page in pages])
+    mock_ocr_data.side_effect = lambda image: self.TEST_OCR_DATA[image]
+
+    extractor = pdf_image_sorter.PageTextExtractor(self.pool, 300, [0], 'Order', adaptive_dpis=[120], value_index=2)
+    pages = extractor.extract('test.pdf')
+
+    # The first page passes at 120 dpi, so it is yielded before the retry pass starts
+    self.assertEqual(next(pages), ['', 'Order', '#', '1001'])
+    self.assertEqual([call.args[1] for call in mock_convert.call_args_list], [120])
+    self.assertEqual(list(pages), [['', 'Order', '#', '1002'], ['', 'Order', '#', '1003']])
+
+  """ Targeted OCR """
+
+  TEST_OCR_BOXES = {
+    'text': ['', '', 'Packing', 'List', '', 'Order', '#', '1001'],
+    'conf': [-1, -1, 90, 90, -1, 95, 93, 91],
+    'block_num': [0, 1, 1, 1, 1, 1, 1, 1],
+    'par_num': [0, 1, 1, 1, 1, 1, 1, 1],
+    'line_num': [0, 1, 1, 1, 2, 2, 2, 2],
+    'left': [0, 0, 10, 60, 10, 100, 150, 170],
+    'top': [0, 0, 10, 10, 40, 40, 40, 40],
+    'width': [1000, 1000, 40, 30, 100, 40, 10, 30],
+    'height': [1000, 1000, 20, 20, 20, 20, 20, 20]
+  }
+
+  def test_key_region(self):
+    actual = pdf_image_sorter.get_key_region(self.TEST_OCR_BOXES, (1000, 1000), 'Order', 2)
+    expected = (0.08, 0.02, 0.32, 0.08)
+    for actual_ratio, expected_ratio in zip(actual, expected):
+      self.assertAlmostEqual(actual_ratio, expected_ratio)
+
+  def test_key_region_value_on_other_line(self):
+    actual = pdf_image_sorter.get_key_region(self.TEST_OCR_BOXES, (1000, 1000), 'List', 3)
+    self.assertIsNone(actual)
+
+  @patch('pdf_sorter.ocr_backend.pytesseract.image_to_data')
+  def test_targeted_ocr_falls_back_to_whole_page(self, mock_image_to_data):
+    region_data = {'text': ['', 'Continued'], 'conf': [-1, 90]}
+    mock_image_to_data.side_effect = [region_data, self.TEST_OCR_BOXES]
+    self.mock_extract_ocr_data_from_image.side_effect = self.extract_ocr_data_from_image
+    image = Image.new('L', (1000, 1000))
+
+    extracted_text, _, key_region, region_hit = pdf_image_sorter.extract_targeted_ocr_data_from_image((image, (0.1, 0.1, 0.3, 0.2), 'Order', 2))
+
+    self.assertEqual(extracted_text, self.TEST_OCR_BOXES['text'])
+    self.assertFalse(region_hit)
+    self.assertIsNotNone(key_region)
+    self.assertEqual(mock_image_to_data.call_args_list[0].args[0].size, (200, 100))
+
+  @patch('pdf_sorter.pdf_image_sorter.extract_targeted_ocr_data_from_image')
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_images')
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer.get_page_count')
+  def test_extractor_targeted(self, mock_page_count, mock_convert, mock_targeted_ocr):
+    region = (0.1, 0.1, 0.3, 0.2)
+    results = {
+      ('page0', None): (['', 'Order', '#', '1001'], [-1, 90, 90, 90], region, False),
+      ('page1', region): (['', 'Order', '#', '1002'], [-1, 90, 90, 90], region, True),
+      ('page2', region): (['', 'Continued'], [-1, 90], None, False),
+      ('page3', region): (['', 'Order', '#', '1003'], [-1, 90, 90, 90], region, True)
+    }
+    mock_page_count.return_value = 4
+    mock_convert.return_value = iter(self.TEST_IMAGES)
+    mock_targeted_ocr.side_effect = lambda task: results[(task[0], task[1])]
+
+    extractor = pdf_image_sorter.PageTextExtractor(self.pool, 300, [0], 'Order', value_index=2, targeted=True)
+    actual = list(extractor.extract('test.pdf'))
+
+    self.assertEqual(actual, [result[0] for result in results.values()])
+    self.assertEqual(extractor.key_region, region)
+    self.assertEqual(extractor.page_sources, {'ocr': 4, 'targeted region': 2, 'targeted fallback': 2})
+
+  """ Multiple input files """
+
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_images')
+  def test_extractor_multiple_files(self, mock_convert):
+    document = virtual_document.VirtualDocument(['first.pdf', 'second.pdf'], page_counts=[3, 1])
+    mock_convert.side_effect = lambda pdf_path, dpi, quadrants, budget, threads, pages: iter(self.TEST_IMAGES[:3] if pdf_path == 'first.pdf' else self.TEST_IMAGES[3:])
+
+    extractor = pdf_image_sorter.PageTextExtractor(self.pool, 300, [0], 'Order')
+    actual = list(extractor.extract(document))
+
+    self.assertEqual(actual, [self.TEST_EXTRACTED_TEXT[image] for image in self.TEST_IMAGES])
+    renders = [(call.args[0], call.args[-1]) for call in mock_convert.call_args_list]
+    self.assertEqual(renders, [('first.pdf', [1, 2, 3]), ('second.pdf', [1])])
+
+  @patch('pdf_sorter.pdf_image_sorter.pdf_writer.ChunkedPdfWriter')
+  @patch('pdf_sorter.pdf_image_sorter.PdfFileReader')
+  @patch('builtins.open', new_callable=mock_open)
+  def test_generate_sorted_document_from_sources(self, mock_file, mock_reader, mock_writer):
+    document = virtual_document.VirtualDocument(['first.pdf', 'second.pdf'], page_counts=[2, 2])
+    readers = {}
+    mock_reader.side_effect = lambda pdf_file: readers.setdefault(len(readers), MagicMock(name='reader%d' % len(readers)))
+    value_page_lookup = {'1001': [0], '1002': [1, 2], '1003': [3]}
+
+    pdf_image_sorter.generate_sorted_document(document, value_page_lookup, ['1003', '1001', '1002'], 'out.pdf', 2)
+
+    opened = [call.args[0] for call in mock_file.call_args_list]
+    self.assertEqual(opened, ['first.pdf', 'second.pdf'])
+    mock_writer.assert_called_once_with('out.pdf', 2)
+    pages = [call.args for call in mock_writer.return_value.__enter__.return_value.add_page.call_args_list]
+    self.assertEqual(pages, [(readers[1], 1), (readers[0], 0), (readers[0], 1), (readers[1], 0)])
+
+  """ Mapped pages """
+
+  class InlinePool:
+    """ Stands in for a pool of worker processes, running every page inline """
+    workers = 2
+    ocr_backend = 'pytesseract'
+
+    def map(self, func, items, run_metrics=None):
+      return map(func, items)
+
+  @patch('pdf_sorter.pdf_image_sorter.convert_document_to_mapped_pages')
+  @patch('pdf_sorter.pdf_image_sorter.rasterizer.get_page_count')
+  def test_extractor_worker_pool_uses_mapped_pages(self, mock_page_count, mock_convert):
+    mock_page_count.return_value = 2
+    rendered = []
+    def render_pages(pdf_path, dpi, quadrants, raster_directory, budget, threads, pages):
+      for page_number in pages:
+        page_path = os.path.join(raster_directory, 'page%d.pgm' % page_number)
+        with open(page_path, 'wb') as page_file:
+          page_file.write(b'P5\n1 1\n255\n\x00\x00')
+        rendered.append(rasterizer.MappedPage(page_path, 1, 1, 11))
+        yield rendered[-1]
+    mock_convert.side_effect = render_pages
+    self.mock_extract_ocr_data_from_image.side_effect = lambda image: (['', 'Order', image.path[-5]], [-1, 90, 90])
+
+    extractor = pdf_image_sorter.PageTextExtractor(self.InlinePool(), 300, [0], 'Order')
+    actual = list(extractor.extract('test.pdf'))
+
+    self.assertEqual(actual, [['', 'Order', '1'], ['', 'Order', '2']])
+    # Each page is removed as soon as its OCR result is back
+    self.assertFalse(any(os.path.exists(page.path) for page in rendered))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import io
+import os
+import tempfile
+from unittest import TestCase, main
+from PyPDF2 import PdfFileReader
+from pdf_sorter import pdf_writer
+from pdf_builder import build_pdf
+
+def build_pdf_with_resources(page_count):
+  """ Builds a PDF whose pages share one font, each with a link annotation back to its own page """
+  objects = [
+    b'<< /Type /Catalog /Pages 2 0 R >>',
+    b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % (4 + 3*i) for i in range(page_count)), page_count),
+    b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'
+  ]
+  for i in range(page_count):
+    page_number = 4 + 3*i
+    content = b'BT /F1 12 Tf 72 720 Td (Page %d) Tj ET' % i
+    objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R /Annots [%d 0 R] >>' % (page_number + 1, page_number + 2))
+    objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content))
+    objects.append(b'<< /Type /Annot /Subtype /Link /Rect [0 0 10 10] /P %d 0 R >>' % page_number)
+  return build_pdf(objects)
+
+
+# Binary image data that would not survive a decode and re-encode, and contains 'endstream'
+IMAGE_DATA = bytes(range(256)) + b'\nendstream\n' + bytes(range(255, -1, -1))
+
+def build_pdf_with_image():
+  """ Builds a one page PDF with an image whose length is an indirect object, and a string that looks like a reference """
+  return build_pdf([
+    b'<< /Type /Catalog /Pages 2 0 R >>',
+    b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+    b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /XObject << /Im1 4 0 R >> >> /Contents 6 0 R >>',
+    b'<< /Type /XObject /Subtype /Image /Width 16 /Height 33 /BitsPerComponent 8 /ColorSpace /DeviceGray /Length 5 0 R /Title (See 2 0 R \\) 5 0 R) >>\nstream\n%s\nendstream' % IMAGE_DATA,
+    b'%d' % len(IMAGE_DATA),
+    b'<< /Length 18 >>\nstream\nq 612 0 0 792 0 0 cm /Im1 Do Q\nendstream'
+  ])
+
+
+class TestPdfWriter(TestCase):
+
+  def setUp(self):
+    self.temp_directory = tempfile.TemporaryDirectory()
+    source_path = os.path.join(self.temp_directory.name, 'source.pdf')
+    with open(source_path, 'wb') as source_file:
+      source_file.write(build_pdf_with_resources(3))
+    self.source_file = open(source_path, 'rb')
+    self.reader = PdfFileReader(self.source_file)
+    self.output_path = os.path.join(self.temp_directory.name, 'sorted.pdf')
+
+  def tearDown(self):
+    self.source_file.close()
+    self.temp_directory.cleanup()
+
+  def read_pages(self, pdf_path):
+    with open(pdf_path, 'rb') as pdf_file:
+      reader = PdfFileReader(pdf_file)
+      return [reader.getPage(i).getContents().getData() for i in range(reader.getNumPages())]
+
+  def test_pages_in_order(self):
+    with pdf_writer.StreamingPdfWriter(self.output_path) as writer:
+      for page_index in [2, 0, 1]:
+        writer.add_page(self.reader, page_index)
+
+    self.assertEqual(self.read_pages(self.output_path), [b'BT /F1 12 Tf 72 720 Td (Page %d) Tj ET' % i for i in [2, 0, 1]])
+
+  def test_shared_objects_written_once(self):
+    with pdf_writer.StreamingPdfWriter(self.output_path) as writer:
+      for page_index in [1, 0, 1]:
+        writer.add_page(self.reader, page_index)
+
+    with open(self.output_path, 'rb') as output_file:
+      output = output_file.read()
+      reader = PdfFileReader(output_file)
+      pages = [reader.getPage(i) for i in range(3)]
+      contents = [page.raw_get('/Contents').idnum for page in pages]
+      fonts = set(page['/Resources']['/Font'].raw_get('/F1').idnum for page in pages)
+    self.assertEqual(contents[0], contents[2])
+    self.assertNotEqual(contents[0], contents[1])
+    self.assertEqual(len(fonts), 1)
+    self.assertEqual(output.count(b'/BaseFont /Helvetica'), 1)
+    # Links back to a source page are dropped rather than copying the source page tree
+    self.assertEqual(output.count(b'/Type /Pages'), 1)
+
+  def test_chunks(self):
+    with pdf_writer.ChunkedPdfWriter(self.output_path, 2) as writer:
+      for page_index in [0, 1, 2]:
+        writer.add_page(self.reader, page_index)
+
+    chunk_paths = [pdf_writer.get_chunk_path(self.output_path, 1), pdf_writer.get_chunk_path(self.output_path, 2)]
+    self.assertEqual(writer.output_paths, chunk_paths)
+    self.assertEqual([len(self.read_pages(chunk_path)) for chunk_path in chunk_paths], [2, 1])
+    self.assertTrue(chunk_paths[0].endswith('sorted_001.pdf'))
+
+  def test_no_pages(self):
+    with pdf_writer.ChunkedPdfWriter(self.output_path) as writer:
+      pass
+
+    self.assertEqual(writer.output_paths, [self.output_path])
+    self.assertEqual(self.read_pages(self.output_path), [])
+
+  def test_raw_copy(self):
+    image_pdf_path = os.path.join(self.temp_directory.name, 'image.pdf')
+    with open(image_pdf_path, 'wb') as image_pdf:
+      image_pdf.write(build_pdf_with_image())
+
+    with open(image_pdf_path, 'rb') as image_pdf, pdf_writer.StreamingPdfWriter(self.output_path) as writer:
+      writer.add_page(PdfFileReader(image_pdf), 0)
+      writer.add_page(self.reader, 1)
+
+    with open(self.output_path, 'rb') as output_file:
+      output = output_file.read()
+      reader = PdfFileReader(output_file)
+      image = reader.getPage(0)['/Resources']['/XObject']['/Im1']
+      self.assertEqual(image._data, IMAGE_DATA)
+      self.assertEqual(image['/Title'], 'See 2 0 R ) 5 0 R')
+      self.assertEqual(reader.getPage(1).getContents().getData(), b'BT /F1 12 Tf 72 720 Td (Page 1) Tj ET')
+    # Objects are copied as they are in the source, not re-serialized
+    self.assertIn(b'/Width 16 /Height 33 /BitsPerComponent 8', output)
+
+  def test_in_memory_source(self):
+    with open(self.source_file.name, 'rb') as source_file:
+      reader = PdfFileReader(io.BytesIO(source_file.read()))
+
+    with pdf_writer.StreamingPdfWriter(self.output_path) as writer:
+      writer.add_page(reader, 2)
+      self.assertIsNone(writer.get_source(reader))
+
+    self.assertEqual(self.read_pages(self.output_path), [b'BT /F1 12 Tf 72 720 Td (Page 2) Tj ET'])
+
+  def test_scan_object_body(self):
+    body = b' << /A 1 0 R /B (2 0 R) /C [3 0 R 4 5 R] % 6 0 R\n /D <0A> >>\nstream\n7 0 R'
+    keyword_position, keyword, references = pdf_writer.scan_object_body(body, 0)
+
+    self.assertEqual(keyword, b'stream')
+    self.assertEqual(body[keyword_position:], b'stream\n7 0 R')
+    self.assertEqual([(idnum, generation) for _, _, idnum, generation in references], [(1, 0), (3, 0), (4, 5)])
+    self.assertEqual(body[references[0][0]:references[0][1]], b'1 0 R')
+
+
+if __name__ == '__main__':
+  main()
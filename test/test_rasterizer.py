@@ -0,0 +1,174 @@
+import os
+import subprocess
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase, main
+from unittest.mock import patch
+from pdf_sorter import rasterizer
+
+class TestRasterizer(TestCase):
+
+  TEST_PAGE_COUNT = 7
+
+  def mock_convert_from_path(self, pdf_path, dpi, first_page, last_page, thread_count):
+    return ['page%d' % page for page in range(first_page, last_page + 1)]
+
+  def setUp(self):
+    self.info_patcher = patch('pdf_sorter.rasterizer.pdfinfo_from_path')
+    self.mock_pdfinfo = self.info_patcher.start()
+    self.mock_pdfinfo.return_value = {'Pages': self.TEST_PAGE_COUNT}
+
+    self.convert_patcher = patch('pdf_sorter.rasterizer.convert_from_path')
+    self.mock_convert = self.convert_patcher.start()
+    self.mock_convert.side_effect = self.mock_convert_from_path
+
+  def tearDown(self):
+    self.info_patcher.stop()
+    self.convert_patcher.stop()
+
+  def test_page_windows(self):
+    actual = rasterizer.get_page_windows(range(1, 8), 3)
+    self.assertEqual(actual, [(1, 3), (4, 6), (7, 7)])
+
+  def test_page_windows_single_window(self):
+    actual = rasterizer.get_page_windows(range(1, 3), 8)
+    self.assertEqual(actual, [(1, 2)])
+
+  def test_page_windows_split_on_gaps(self):
+    actual = rasterizer.get_page_windows([1, 2, 4, 5, 6, 9], 8)
+    self.assertEqual(actual, [(1, 2), (4, 6), (9, 9)])
+
+  def test_render_pages_in_order(self):
+    actual = list(rasterizer.render_pages('test.pdf', 200, page_budget=3, render_threads=2))
+    self.assertEqual(actual, ['page%d' % page for page in range(1, 8)])
+
+  def test_render_pages_bounded_windows(self):
+    list(rasterizer.render_pages('test.pdf', 200, page_budget=3, render_threads=2))
+    windows = [(call.kwargs['first_page'], call.kwargs['last_page'], call.kwargs['thread_count']) for call in self.mock_convert.call_args_list]
+    self.assertEqual(windows, [(1, 3, 2), (4, 6, 2), (7, 7, 1)])
+
+  def test_render_selected_pages(self):
+    actual = list(rasterizer.render_pages('test.pdf', 200, page_budget=3, page_numbers=[6, 2, 3]))
+    self.assertEqual(actual, ['page2', 'page3', 'page6'])
+    self.mock_pdfinfo.assert_not_called()
+
+  def test_render_pages_is_lazy(self):
+    pages = rasterizer.render_pages('test.pdf', 200, page_budget=3)
+    next(pages)
+    self.assertEqual(self.mock_convert.call_count, 1)
+
+  """ Region rendering """
+
+  TEST_PAGE_INFO = {
+    'Pages': 2,
+    'Page    1 size': '612 x 792 pts (letter)',
+    'Page    1 rot': '0',
+    'Page    2 size': '612 x 792 pts (letter)',
+    'Page    2 rot': '90'
+  }
+
+  def test_page_sizes(self):
+    self.mock_pdfinfo.return_value = self.TEST_PAGE_INFO
+    actual = rasterizer.get_page_sizes('test.pdf', 1, 2)
+    self.assertEqual(actual, [(612, 792), (792, 612)])
+
+  def test_page_sizes_single_page(self):
+    self.mock_pdfinfo.return_value = {'Pages': 1, 'Page size': '612 x 792 pts (letter)', 'Page rot': '0'}
+    actual = rasterizer.get_page_sizes('test.pdf', 1, 1)
+    self.assertEqual(actual, [(612, 792)])
+
+  def test_region_box_single_quadrant(self):
+    actual = rasterizer.get_region_box((612, 792), 72, (0.5, 1), (0.5, 1))
+    self.assertEqual(actual, (306, 396, 306, 396))
+
+  def test_region_box_whole_page(self):
+    actual = rasterizer.get_region_box((612, 792), 144, (0, 1), (0, 1))
+    self.assertEqual(actual, (0, 0, 1224, 1584))
+
+  @patch('pdf_sorter.rasterizer.subprocess.run')
+  def test_render_page_regions(self, mock_run):
+    self.mock_pdfinfo.return_value = self.TEST_PAGE_INFO
+    mock_run.return_value = subprocess.CompletedProcess([], 0, stdout=b'P6\n2 1\n255\n' + bytes(6))
+
+    actual = list(rasterizer.render_page_regions('test.pdf', 72, (0, 0.5), (0, 0.5)))
+
+    self.assertEqual([image.size for image in actual], [(2, 1), (2, 1)])
+    # Pages of a window are rendered on threads, so pdftoppm may be run for them in any order
+    commands = sorted((call.args[0] for call in mock_run.call_args_list), key=lambda command: int(command[4]))
+    self.assertEqual(commands, [
+      ['pdftoppm', '-r', '72', '-f', '1', '-l', '1', '-cropbox', '-x', '0', '-y', '0', '-W', '306', '-H', '396', 'test.pdf'],
+      ['pdftoppm', '-r', '72', '-f', '2', '-l', '2', '-cropbox', '-x', '0', '-y', '0', '-W', '396', '-H', '306', 'test.pdf']])
+    self.mock_convert.assert_not_called()
+
+  @patch('pdf_sorter.rasterizer.subprocess.run')
+  def test_render_regions_of_crop_box(self, mock_run):
+    # A letter MediaBox cropped to a 288 x 360 pt label in its middle: pdfinfo reports the CropBox
+    self.mock_pdfinfo.return_value = {'Pages': 1, 'Page size': '288 x 360 pts', 'Page rot': '0'}
+    mock_run.return_value = subprocess.CompletedProcess([], 0, stdout=b'P6\n2 1\n255\n' + bytes(6))
+
+    list(rasterizer.render_page_regions('test.pdf', 72, (0.5, 1), (0.5, 1)))
+    with tempfile.TemporaryDirectory() as raster_directory:
+      mock_run.side_effect = self.mock_pdftoppm
+      list(rasterizer.render_mapped_pages('test.pdf', 72, (0.5, 1), (0.5, 1), raster_directory))
+
+    # The bottom right quadrant of the label, measured from the CropBox origin rather than the MediaBox
+    region_arguments = ['-cropbox', '-x', '144', '-y', '180', '-W', '144', '-H', '180']
+    region_command, mapped_command = [call.args[0] for call in mock_run.call_args_list]
+    self.assertEqual(region_command[7:-1], region_arguments)
+    self.assertEqual(mapped_command[9:-2], region_arguments)
+
+  """ Mapped pages """
+
+  def mock_pdftoppm(self, command, stdout, stderr, check):
+    # 4 x 3 grayscale page whose pixel values count up from 0
+    with open(command[-1] + '.pgm', 'wb') as page_file:
+      page_file.write(b'P5\n4 3\n255\n' + bytes(range(12)))
+
+  @patch('pdf_sorter.rasterizer.subprocess.run')
+  def test_render_mapped_pages(self, mock_run):
+    mock_run.side_effect = self.mock_pdftoppm
+    with tempfile.TemporaryDirectory() as raster_directory:
+      pages = list(rasterizer.render_mapped_pages('test.pdf', 72, (0, 1), (0, 1), raster_directory, page_numbers=[2, 3]))
+
+      self.assertEqual([page.size for page in pages], [(4, 3), (4, 3)])
+      self.assertEqual(len(set(page.path for page in pages)), 2)
+      self.assertTrue(all(page.whole_file for page in pages))
+      with pages[0].open() as image:
+        self.assertEqual(image.tobytes(), bytes(range(12)))
+      pages[0].remove()
+      self.assertFalse(os.path.exists(pages[0].path))
+
+    # Pages of a window are rendered on threads, so pdftoppm may be run for them in any order
+    commands = sorted((call.args[0] for call in mock_run.call_args_list), key=lambda command: int(command[6]))
+    self.assertEqual([command[:8] for command in commands], [
+      ['pdftoppm', '-gray', '-singlefile', '-r', '72', '-f', '2', '-l'], ['pdftoppm', '-gray', '-singlefile', '-r', '72', '-f', '3', '-l']])
+    self.mock_pdfinfo.assert_not_called()
+
+  def test_mapped_page_bytes(self):
+    self.assertEqual(rasterizer.get_mapped_page_bytes(300, (612, 792)), 2550 * 3300)
+
+  @patch('pdf_sorter.rasterizer.shutil.disk_usage')
+  @patch('pdf_sorter.rasterizer.os.path.isdir', return_value=True)
+  def test_mapped_page_directory(self, mock_isdir, mock_disk_usage):
+    # Docker's default /dev/shm
+    mock_disk_usage.return_value = SimpleNamespace(total=64 * 2**20, used=0, free=64 * 2**20)
+
+    self.assertEqual(rasterizer.get_mapped_page_directory(16 * 2**20), rasterizer.SHARED_MEMORY_DIRECTORY)
+    self.assertIsNone(rasterizer.get_mapped_page_directory(100 * 2**20))
+    mock_isdir.return_value = False
+    self.assertIsNone(rasterizer.get_mapped_page_directory())
+
+  @patch('pdf_sorter.rasterizer.subprocess.run')
+  def test_mapped_page_crop_is_view(self, mock_run):
+    mock_run.side_effect = self.mock_pdftoppm
+    with tempfile.TemporaryDirectory() as raster_directory:
+      page = rasterizer.render_mapped_page('test.pdf', 72, 1, raster_directory)
+      crop = page.crop((1.5, 1, 4, 3))
+
+      self.assertEqual((crop.size, crop.path, crop.whole_file), ((3, 2), page.path, False))
+      with crop.open() as image:
+        self.assertEqual(image.tobytes(), bytes([5, 6, 7, 9, 10, 11]))
+        self.assertEqual(image.crop((0, 0, 1, 1)).tobytes(), bytes([5]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+import base64
+import http.client
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase, main
+from unittest.mock import patch
+from pdf_sorter import service
+
+class TestService(TestCase):
+
+  TEST_REQUEST = {
+    'uploads': [{'filename': 'route.pdf', 'content': base64.b64encode(b'%PDF-1.4').decode()}],
+    'sort_values': ['3', '1', '2'],
+    'criteria': 'Order',
+    'index': 2
+  }
+
+  def setUp(self):
+    self.temp_directory = tempfile.TemporaryDirectory()
+    self.working_directory = os.getcwd()
+    os.chdir(self.temp_directory.name)
+    self.run_job_patcher = patch('pdf_sorter.service.pipeline.run_job')
+    self.mock_run_job = self.run_job_patcher.start()
+    self.mock_run_job.side_effect = self.mock_sort
+    self.pool_patcher = patch('pdf_sorter.service.ocr_pool.OcrWorkerPool')
+    self.mock_pool = self.pool_patcher.start()
+    self.service = service.SortService(['--no-cache', '-w', '1'], concurrent_jobs=1)
+
+  def tearDown(self):
+    self.service.close()
+    self.run_job_patcher.stop()
+    self.pool_patcher.stop()
+    os.chdir(self.working_directory)
+    self.temp_directory.cleanup()
+
+  def mock_sort(self, args, pool, cache, explore_file, progress, run_metrics):
+    run_metrics.add_stage_time('extract', 0.5)
+    progress(1, 2)
+    progress(2, 2)
+    with open(args.output, 'wb') as output:
+      output.write(b'sorted')
+    return args.output
+
+  def wait_for_job(self, job_id):
+    for _ in range(100):
+      status = self.service.get_status(job_id)
+      if status['status'] not in ['queued', 'running'] and status['finished'] is not None:
+        return status
+      time.sleep(0.01)
+    self.fail('Job %s did not finish' % job_id)
+
+  def test_save_job_files_uploads(self):
+    job = self.service.save_job_files('abc', self.TEST_REQUEST)
+    self.assertEqual(job['files'], ['./output/service/abc/0_route.pdf'])
+    self.assertEqual(job['sort'], './output/service/abc/sort.txt')
+    self.assertEqual(job['output'], os.path.join('service', 'abc', 'sorted.pdf'))
+    self.assertEqual(job['index'], 2)
+    with open(job['sort']) as sort_file:
+      self.assertEqual(sort_file.read(), '3\n1\n2')
+    with open(job['files'][0], 'rb') as upload:
+      self.assertEqual(upload.read(), b'%PDF-1.4')
+
+  def test_submit_runs_job(self):
+    status = self.service.submit(self.TEST_REQUEST)
+    self.assertEqual(status['status'], 'queued')
+
+    status = self.wait_for_job(status['id'])
+    self.assertEqual(status['status'], 'success')
+    self.assertEqual(status['pages_done'], 2)
+    self.assertEqual(status['pages_total'], 2)
+    self.assertEqual(status['output'], './output/service/%s/sorted.pdf' % status['id'])
+    args = self.mock_run_job.call_args[0][0]
+    self.assertEqual(args.criteria, 'Order')
+    self.assertEqual(args.index, 2)
+    self.assertEqual(args.workers, 1)
+    self.assertEqual(status['metrics']['stages'], {'extract': 0.5})
+
+  def test_submit_shares_pool(self):
+    first = self.service.submit(self.TEST_REQUEST)
+    second = self.service.submit(self.TEST_REQUEST)
+    self.wait_for_job(first['id'])
+    self.wait_for_job(second['id'])
+    self.mock_pool.assert_called_once_with(1, 2, 'auto')
+    self.assertIs(self.mock_run_job.call_args_list[0][0][1], self.mock_run_job.call_args_list[1][0][1])
+
+  def test_submit_failed_job(self):
+    self.mock_run_job.side_effect = RuntimeError('tesseract not found')
+    status = self.wait_for_job(self.service.submit(self.TEST_REQUEST)['id'])
+    self.assertEqual(status['status'], 'failed')
+    self.assertEqual(status['error'], 'tesseract not found')
+
+  def test_submit_missing_fields(self):
+    with self.assertRaisesRegex(ValueError, 'missing files'):
+      self.service.submit({'sort_values': ['1'], 'criteria': 'Order'})
+
+  def test_submit_invalid_arguments(self):
+    with self.assertRaises(ValueError):
+      self.service.submit(dict(self.TEST_REQUEST, index=0))
+    # The uploads of the rejected request are removed
+    self.assertEqual(os.listdir(service.SERVICE_SUBDIRECTORY), [])
+
+  def test_prune_finished_jobs(self):
+    job_ids = [self.wait_for_job(self.service.submit(self.TEST_REQUEST)['id'])['id'] for _ in range(3)]
+    self.service.max_finished = 2
+    self.service.prune_finished_jobs()
+
+    # The oldest job beyond max_finished is removed, with its files
+    self.assertEqual(sorted(self.service.jobs), sorted(job_ids[1:]))
+    self.assertEqual(sorted(os.listdir(service.SERVICE_SUBDIRECTORY)), sorted(job_ids[1:]))
+
+    self.service.jobs[job_ids[1]]['finished'] -= self.service.finished_ttl + 1
+    self.service.prune_finished_jobs()
+    self.assertEqual(list(self.service.jobs), [job_ids[2]])
+    self.assertFalse(os.path.exists(os.path.join(service.SERVICE_SUBDIRECTORY, job_ids[1])))
+
+  def test_submit_queue_full(self):
+    self.service.max_queued = 1
+    self.service.jobs['waiting'] = {'status': 'queued'}
+    with self.assertRaises(service.QueueFullError):
+      self.service.submit(self.TEST_REQUEST)
+
+  def test_submit_reserves_queue_slot(self):
+    self.service.max_queued = 1
+    saving, saved = threading.Event(), threading.Event()
+    save_job_files = self.service.save_job_files
+    def slow_save(job_id, request):
+      saving.set()
+      saved.wait(5)
+      return save_job_files(job_id, request)
+
+    with patch.object(self.service, 'save_job_files', side_effect=slow_save):
+      first = threading.Thread(target=self.service.submit, args=(self.TEST_REQUEST,))
+      first.start()
+      saving.wait(5)
+      # The first request holds the only slot while its files are saved and validated
+      with self.assertRaises(service.QueueFullError):
+        self.service.submit(self.TEST_REQUEST)
+      saved.set()
+      first.join()
+
+    for job_id in list(self.service.jobs):
+      self.wait_for_job(job_id)
+    with self.assertRaises(ValueError):
+      self.service.submit(dict(self.TEST_REQUEST, index=0))
+    # Neither a finished nor a rejected request keeps its slot
+    self.assertEqual(self.service.submit(self.TEST_REQUEST)['status'], 'queued')
+
+  def test_http_api(self):
+    server = service.create_server(self.service, port=0)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    connection = http.client.HTTPConnection(*server.server_address)
+    try:
+      connection.request('POST', '/jobs', json.dumps(self.TEST_REQUEST))
+      response = connection.getresponse()
+      self.assertEqual(response.status, 202)
+      job_id = json.loads(response.read())['id']
+      self.wait_for_job(job_id)
+
+      connection.request('GET', '/jobs/%s' % job_id)
+      response = connection.getresponse()
+      self.assertEqual(response.status, 200)
+      self.assertEqual(json.loads(response.read())['status'], 'success')
+
+      connection.request('GET', '/jobs/%s/result' % job_id)
+      response = connection.getresponse()
+      self.assertEqual(response.status, 200)
+      self.assertEqual(response.getheader('Content-Type'), 'application/pdf')
+      self.assertEqual(response.read(), b'sorted')
+
+      connection.request('GET', '/jobs/unknown')
+      response = connection.getresponse()
+      response.read()
+      self.assertEqual(response.status, 404)
+
+      connection.request('POST', '/jobs', json.dumps({'criteria': 'Order'}))
+      response = connection.getresponse()
+      response.read()
+      self.assertEqual(response.status, 400)
+
+      connection.request('GET', '/health')
+      response = connection.getresponse()
+      self.assertEqual(json.loads(response.read()), {'success': 1})
+
+      connection.request('GET', '/metrics')
+      response = connection.getresponse()
+      exposition = response.read().decode()
+      self.assertIn('pdf_sorter_jobs{status="success"} 1', exposition)
+      self.assertIn('pdf_sorter_stage_seconds_total{stage="extract"} 0.5', exposition)
+    finally:
+      connection.close()
+      server.shutdown()
+      server.server_close()
+
+  def test_get_service_arguments(self):
+    service_args, shared_arguments = service.get_service_arguments(['--socket', 'sorter.sock', '-j', '3', '--dpi', '200'])
+    self.assertEqual(service_args.socket, 'sorter.sock')
+    self.assertEqual(service_args.jobs, 3)
+    self.assertEqual(service_args.port, service.DEFAULT_PORT)
+    self.assertEqual(shared_arguments, ['--dpi', '200'])
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,153 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase, main
+from unittest.mock import patch
+from pdf_sorter import argument_handler
+from pdf_sorter import metrics
+from pdf_sorter import ocr_cache
+from pdf_sorter import pdf_image_sorter
+from pdf_sorter import sharding
+from pdf_sorter import virtual_document
+from pdf_builder import build_pdf_from_contents
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGE_TEXT = [['Order', '1'], ['more'], ['Order', '2'], ['more'], ['more'], ['Order', '3']]
+
+
+class FakeExtractor:
+  """ Extracts PAGE_TEXT instead of OCRing the pages of a shard """
+
+  def __init__(self, pool, cache=None, run_metrics=None, **settings):
+    self.run_metrics = run_metrics
+
+  def extract(self, document, first_page=0, last_page=None):
+    for page_index in range(first_page, last_page):
+      if PAGE_TEXT[page_index] is None:
+        raise ValueError('OCR failed')
+      self.run_metrics.record_page(page_index + 1, 'ocr')
+      yield PAGE_TEXT[page_index]
+
+
+class TestSharding(TestCase):
+
+  def setUp(self):
+    self.temp_directory = tempfile.TemporaryDirectory()
+    self.shard_directory = os.path.join(self.temp_directory.name, 'shards')
+
+  def tearDown(self):
+    self.temp_directory.cleanup()
+
+  def test_get_shards(self):
+    self.assertEqual(sharding.get_shards(0, 5, 2), [(0, 2), (2, 4), (4, 5)])
+    self.assertEqual(sharding.get_shards(3, 5, 250), [(3, 5)])
+    self.assertEqual(sharding.get_shards(5, 5, 2), [])
+
+  def test_claim_task_once(self):
+    spool = sharding.ShardSpool(self.shard_directory)
+    spool.create()
+    spool.add_task(1, {'shard': 1})
+    spool.add_task(0, {'shard': 0})
+
+    first_task, first_claim = spool.claim_task()
+    second_task, _ = sharding.ShardSpool(self.shard_directory).claim_task()
+
+    self.assertEqual((first_task, second_task), ({'shard': 0}, {'shard': 1}))
+    self.assertIsNone(spool.claim_task())
+    spool.complete(0, {'pages': []}, first_claim)
+    self.assertEqual(spool.get_result(0), {'pages': []})
+    self.assertFalse(os.path.exists(first_claim))
+
+  def test_requeue_stale_claims(self):
+    spool = sharding.ShardSpool(self.shard_directory)
+    spool.create()
+    spool.add_task(0, {'shard': 0})
+    _, claim_path = spool.claim_task()
+
+    spool.requeue_stale_claims(60)
+    self.assertIsNone(spool.claim_task())
+
+    # The worker stopped touching its claim two minutes ago
+    os.utime(claim_path, (time.time() - 120, time.time() - 120))
+    spool.requeue_stale_claims(60)
+    self.assertEqual(spool.claim_task()[0], {'shard': 0})
+
+  def run_coordinator(self, shard_size):
+    """ Extracts PAGE_TEXT through a coordinator, with a worker on a thread of this process """
+    done = threading.Event()
+    def work():
+      while not done.is_set():
+        sharding.run_worker(self.shard_directory, None, once=True)
+        time.sleep(0.01)
+
+    worker = threading.Thread(target=work)
+    worker.start()
+    run_metrics = metrics.RunMetrics()
+    try:
+      coordinator = sharding.ShardCoordinator(self.shard_directory, {'dpi': 300}, shard_size, local_workers=0, run_metrics=run_metrics)
+      pages = list(coordinator.extract(virtual_document.VirtualDocument(['route.pdf'], [len(PAGE_TEXT)])))
+    finally:
+      done.set()
+      worker.join()
+    return pages, run_metrics
+
+  @patch('pdf_sorter.sharding.pdf_image_sorter.PageTextExtractor', FakeExtractor)
+  def test_shards_merged_in_page_order(self):
+    pages, run_metrics = self.run_coordinator(shard_size=2)
+
+    self.assertEqual(pages, PAGE_TEXT)
+    self.assertEqual([row[0] for row in run_metrics.pages], [1, 2, 3, 4, 5, 6])
+    self.assertIn('shard wait', run_metrics.stages)
+    # Each job's spool is removed once its pages are extracted
+    self.assertEqual(os.listdir(self.shard_directory), [])
+
+  @patch('pdf_sorter.sharding.pdf_image_sorter.PageTextExtractor', FakeExtractor)
+  def test_multipage_across_shards(self):
+    pages, _ = self.run_coordinator(shard_size=2)
+
+    page_values = (pdf_image_sorter.get_page_values(page_text, [argument_handler.SortTarget('Order', 1, None, None)]) for page_text in pages)
+    value_page_map, = pdf_image_sorter.build_value_page_maps(page_values, ['Order'], True)
+
+    # Pages 4 and 5 start new shards, but still follow order 2
+    self.assertEqual(dict(value_page_map), {'1': [0, 1], '2': [2, 3, 4], '3': [5]})
+
+  @patch('pdf_sorter.sharding.pdf_image_sorter.PageTextExtractor', FakeExtractor)
+  @patch('pdf_sorter.sharding.logger')
+  def test_failed_shard(self, mock_logger):
+    with patch(__name__ + '.PAGE_TEXT', PAGE_TEXT[:3] + [None] + PAGE_TEXT[4:]):
+      with self.assertRaisesRegex(RuntimeError, 'Shard 1 failed'):
+        self.run_coordinator(shard_size=2)
+
+  def test_local_worker_processes(self):
+    pdf_path = os.path.join(self.temp_directory.name, 'route.pdf')
+    with open(pdf_path, 'wb') as pdf_file:
+      pdf_file.write(build_pdf_from_contents([b'BT (page %d) Tj ET' % page for page in range(len(PAGE_TEXT))]))
+    document = virtual_document.VirtualDocument([pdf_path], [len(PAGE_TEXT)])
+    settings = {'dpi': 300, 'quadrants': [0], 'criteria_key': 'Order'}
+
+    # Every page is already in the shared OCR cache, so the workers need no poppler or tesseract
+    cache_directory = os.path.join(self.temp_directory.name, 'cache')
+    extractor = pdf_image_sorter.PageTextExtractor(None, cache=ocr_cache.OcrCache(cache_directory), **settings)
+    for page_index, key in extractor.get_cache_keys(extractor.get_page_fingerprints(document, 0, len(PAGE_TEXT))).items():
+      extractor.cache.put(key, PAGE_TEXT[page_index])
+
+    run_metrics = metrics.RunMetrics()
+    coordinator = sharding.ShardCoordinator(self.shard_directory, settings, shard_size=1, local_workers=2,
+      worker_arguments=['-w', '1', '--cache-dir', cache_directory], timeout=60, run_metrics=run_metrics)
+    working_directory = os.getcwd()
+    # Workers log to ./output/logs
+    os.chdir(self.temp_directory.name)
+    try:
+      with patch.dict(os.environ, {'PYTHONPATH': os.pathsep.join(filter(None, [REPOSITORY_DIRECTORY, os.environ.get('PYTHONPATH')]))}):
+        pages = list(coordinator.extract(document, 1))
+    finally:
+      os.chdir(working_directory)
+
+    self.assertEqual(pages, PAGE_TEXT[1:])
+    self.assertEqual(run_metrics.get_summary()['pages'], {'cache': 5})
+    self.assertEqual(os.listdir(self.shard_directory), [])
+
+if __name__ == '__main__':
+    main()
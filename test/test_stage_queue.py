@@ -0,0 +1,58 @@
+import threading
+from unittest import TestCase, main
+from pdf_sorter import metrics
+from pdf_sorter import stage_queue
+
+class TestStageQueue(TestCase):
+
+  def test_items_in_order(self):
+    run_metrics = metrics.RunMetrics()
+    with stage_queue.BackgroundStage(range(10), 'render', 2, run_metrics) as stage:
+      self.assertEqual(list(stage), list(range(10)))
+
+    self.assertIn('render wait', run_metrics.stages)
+    self.assertIn('render', run_metrics.get_summary()['utilization'])
+
+  def test_backpressure(self):
+    pulled = []
+    def items():
+      for item in range(10):
+        pulled.append(item)
+        yield item
+
+    with stage_queue.BackgroundStage(items(), 'render', 2) as stage:
+      stage_items = iter(stage)
+      self.assertEqual(next(stage_items), 0)
+      # The thread blocks once the queue is full, holding at most one more item
+      stage._thread.join(0.3)
+      self.assertLessEqual(len(pulled), 4)
+      self.assertEqual(list(stage_items), list(range(1, 10)))
+
+  def test_error_raised_by_consumer(self):
+    def items():
+      yield 1
+      raise ValueError('render failed')
+
+    with stage_queue.BackgroundStage(items(), 'render', 2) as stage:
+      stage_items = iter(stage)
+      self.assertEqual(next(stage_items), 1)
+      with self.assertRaises(ValueError):
+        next(stage_items)
+
+  def test_close_stops_thread(self):
+    closed = threading.Event()
+    def items():
+      try:
+        while True:
+          yield 1
+      finally:
+        closed.set()
+
+    with stage_queue.BackgroundStage(items(), 'render', 1) as stage:
+      self.assertEqual(next(iter(stage)), 1)
+
+    self.assertFalse(stage._thread.is_alive())
+    self.assertTrue(closed.is_set())
+
+if __name__ == '__main__':
+    main()
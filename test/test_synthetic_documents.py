@@ -0,0 +1,48 @@
+import os
+import tempfile
+from unittest import TestCase, main
+from PyPDF2 import PdfFileReader
+from pdf_sorter import synthetic_documents
+
+class TestSyntheticDocuments(TestCase):
+
+  def setUp(self):
+    self.temp_directory = tempfile.TemporaryDirectory()
+    self.pdf_path = os.path.join(self.temp_directory.name, 'synthetic.pdf')
+
+  def tearDown(self):
+    self.temp_directory.cleanup()
+
+  def test_generate_packing_list(self):
+    page_values, sort_values = synthetic_documents.generate_packing_list(self.pdf_path, 12, dpi=30, multipage_ratio=0.5, seed=3)
+    self.assertEqual(len(page_values), 12)
+    self.assertEqual(sorted(sort_values), sorted(set(page_values)))
+    self.assertLess(len(sort_values), 12)
+    with open(self.pdf_path, 'rb') as pdf_file:
+      self.assertEqual(PdfFileReader(pdf_file).getNumPages(), 12)
+
+  def test_generate_packing_list_single_pages(self):
+    page_values, sort_values = synthetic_documents.generate_packing_list(self.pdf_path, 5, dpi=30, multipage_ratio=0)
+    self.assertEqual(len(set(page_values)), 5)
+    self.assertEqual(len(sort_values), 5)
+
+  def test_generate_packing_list_seeded(self):
+    first = synthetic_documents.generate_packing_list(self.pdf_path, 6, dpi=30, seed=7)
+    second = synthetic_documents.generate_packing_list(self.pdf_path, 6, dpi=30, seed=7)
+    self.assertEqual(first, second)
+
+  def test_get_key_origin(self):
+    self.assertEqual(synthetic_documents.get_key_origin(1, (1200, 1600)), (100, 100))
+    self.assertEqual(synthetic_documents.get_key_origin(2, (1200, 1600)), (650, 100))
+    self.assertEqual(synthetic_documents.get_key_origin(3, (1200, 1600)), (100, 850))
+    self.assertEqual(synthetic_documents.get_key_origin(4, (1200, 1600)), (650, 850))
+
+  def test_add_noise(self):
+    image = synthetic_documents.draw_page('12345', 1, 1, 'Order:', 30, 1, 0, synthetic_documents.random.Random(0))
+    noisy = image.copy()
+    synthetic_documents.add_noise(noisy, 0.1, synthetic_documents.random.Random(0))
+    self.assertNotEqual(image.tobytes(), noisy.tobytes())
+
+
+if __name__ == '__main__':
+  main()
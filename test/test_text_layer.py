@@ -0,0 +1,67 @@
+import subprocess
+from unittest import TestCase, main
+from unittest.mock import patch
+from pdf_sorter import text_layer
+from textwrap import dedent
+
+class TestTextLayer(TestCase):
+
+  TEST_BBOX_LAYOUT = dedent("""
+    <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+    <html xmlns="http://www.w3.org/1999/xhtml">
+    <head>
+    <title></title>
+    </head>
+    <body>
+    <doc>
+      <page width="612.000000" height="792.000000">
+        <flow>
+          <block xMin="10" yMin="10" xMax="100" yMax="20">
+            <line xMin="10" yMin="10" xMax="100" yMax="20">
+              <word xMin="10" yMin="10" xMax="40" yMax="20">Order</word>
+              <word xMin="45" yMin="10" xMax="50" yMax="20">#</word>
+              <word xMin="55" yMin="10" xMax="80" yMax="20">1001</word>
+            </line>
+            <line xMin="10" yMin="30" xMax="100" yMax="40">
+              <word xMin="10" yMin="30" xMax="40" yMax="40">Color:</word>
+              <word xMin="45" yMin="30" xMax="60" yMax="40">Red</word>
+            </line>
+          </block>
+        </flow>
+      </page>
+      <page width="612.000000" height="792.000000">
+      </page>
+    </doc>
+    </body>
+    </html>
+    """).strip().encode()
+
+  def test_text_layer_tokens(self):
+    actual = text_layer.get_text_layer_tokens(self.TEST_BBOX_LAYOUT)
+    expected = [
+      ['', '', '', '', 'Order', '#', '1001', '', 'Color:', 'Red'],
+      ['']
+    ]
+    self.assertEqual(actual, expected)
+
+  @patch('pdf_sorter.text_layer.subprocess.run')
+  def test_extract_text_layer(self, mock_run):
+    mock_run.return_value = subprocess.CompletedProcess([], 0, stdout=self.TEST_BBOX_LAYOUT)
+    actual = text_layer.extract_text_layer('test.pdf')
+    self.assertEqual(len(actual), 2)
+    mock_run.assert_called_once()
+    self.assertEqual(mock_run.call_args.args[0], ['pdftotext', '-bbox-layout', 'test.pdf', '-'])
+
+  @patch('pdf_sorter.text_layer.subprocess.run')
+  def test_extract_text_layer_page_range(self, mock_run):
+    mock_run.return_value = subprocess.CompletedProcess([], 0, stdout=self.TEST_BBOX_LAYOUT)
+    text_layer.extract_text_layer('test.pdf', 3, 4)
+    self.assertEqual(mock_run.call_args.args[0], ['pdftotext', '-bbox-layout', '-f', '3', '-l', '4', 'test.pdf', '-'])
+
+  @patch('pdf_sorter.text_layer.subprocess.run')
+  def test_extract_text_layer_failure(self, mock_run):
+    mock_run.side_effect = subprocess.CalledProcessError(1, 'pdftotext')
+    self.assertIsNone(text_layer.extract_text_layer('test.pdf'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+from unittest import TestCase, main
+from pdf_sorter import virtual_document
+
+class TestVirtualDocument(TestCase):
+
+  def setUp(self):
+    self.document = virtual_document.VirtualDocument(['a.pdf', 'empty.pdf', 'b.pdf'], page_counts=[3, 0, 2])
+
+  def test_page_count(self):
+    self.assertEqual(self.document.page_count, 5)
+
+  def test_source_page(self):
+    actual = [self.document.get_source_page(page_index) for page_index in range(5)]
+    expected = [('a.pdf', 0), ('a.pdf', 1), ('a.pdf', 2), ('b.pdf', 0), ('b.pdf', 1)]
+    self.assertEqual(actual, expected)
+
+  def test_source_page_out_of_range(self):
+    with self.assertRaises(IndexError):
+      self.document.get_source_page(5)
+
+  def test_split_page_numbers(self):
+    actual = self.document.split_page_numbers([5, 1, 3, 4])
+    expected = [('a.pdf', [1, 3]), ('empty.pdf', []), ('b.pdf', [1, 2])]
+    self.assertEqual(actual, expected)
+
+  def test_split_page_range(self):
+    actual = self.document.split_page_range(2, 4)
+    expected = [('a.pdf', 0, 2, 3), ('b.pdf', 3, 0, 1)]
+    self.assertEqual(actual, expected)
+
+  def test_single_file(self):
+    document = virtual_document.as_virtual_document(self.document)
+    self.assertIs(document, self.document)
+
+if __name__ == '__main__':
+    main()